@@ -1,59 +1,93 @@
+import itertools
 import os
+from functools import wraps
 from typing import Any, Dict
 
-from flask import Flask, jsonify, render_template, request
-import numpy as np  # for JSON-safe conversion
+from flask import Flask, Response, jsonify, render_template, request
 
 # Support running as a module (python -m SQL.app) and as a script (python SQL/app.py)
 try:
-    from .sql_utils import (
-        ensure_hourly_frequency_view,
-        get_engine,
-        query_q1_busiest_stops as sql_q1,
-        query_q2_avg_duration_speed as sql_q2,
-        query_q3_transfer_points as sql_q3,
-        query_q4_hourly_frequency as sql_q4,
-    )
-    from . import csv_backend
+    from .json_provider import FastJSONProvider, stream_items
+    from .metrics import SERIALIZATION, endpoint_label, install_flask_metrics
+    from .precompiled import PrecompiledResponses, file_fingerprint
+    from .profiling import install_request_profiling
+    from .resilience import StaleCache, serve_stale_on
+    from .startup import Startup, install_health_endpoints, lazy_import
 except Exception:  # pragma: no cover
     import sys
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-    from SQL.sql_utils import (
-        ensure_hourly_frequency_view,
-        get_engine,
-        query_q1_busiest_stops as sql_q1,
-        query_q2_avg_duration_speed as sql_q2,
-        query_q3_transfer_points as sql_q3,
-        query_q4_hourly_frequency as sql_q4,
-    )
-    from SQL import csv_backend
+    from SQL.json_provider import FastJSONProvider, stream_items
+    from SQL.metrics import SERIALIZATION, endpoint_label, install_flask_metrics
+    from SQL.precompiled import PrecompiledResponses, file_fingerprint
+    from SQL.profiling import install_request_profiling
+    from SQL.resilience import StaleCache, serve_stale_on
+    from SQL.startup import Startup, install_health_endpoints, lazy_import
+
+# The backends pull in pandas, numpy, SQLAlchemy and DuckDB: they load on first use (or
+# in the startup phase), so importing the app and answering /healthz stay fast
+(csv_backend, duckdb_backend, export, isochrones, journey_planner, numpy_engine, service_calendar, sql_utils,
+ stop_tiles) = (lazy_import(f"SQL.{name}") for name in ("csv_backend", "duckdb_backend", "export", "isochrones",
+                                                       "journey_planner", "numpy_engine", "service_calendar",
+                                                       "sql_utils", "stop_tiles"))
 
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.json = FastJSONProvider(app)  # one-pass orjson encoding of numpy/pandas scalars and NaN
+install_flask_metrics(app)
+install_request_profiling(app)  # ?_profile=1 when PROFILE_REQUESTS=true
+startup = Startup("sql")
+install_health_endpoints(app, startup)
 
 # --- Helpers (must be defined before routes) ---
-def _to_json_safe(obj):
-    """Recursively convert numpy/pandas scalars to native Python types for JSON."""
-    if isinstance(obj, dict):
-        return {k: _to_json_safe(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_to_json_safe(v) for v in obj]
-    # numpy types
-    if isinstance(obj, (np.integer,)):
-        return int(obj)
-    if isinstance(obj, (np.floating,)):
-        return float(obj)
-    if isinstance(obj, (np.bool_,)):
-        return bool(obj)
-    # pandas NA-like
-    try:
-        if obj is None:
-            return None
-        if isinstance(obj, float) and np.isnan(obj):
-            return None
-    except Exception:
-        pass
-    return obj
+def _json_response(payload):
+    """jsonify with the encoding time recorded per endpoint."""
+    with SERIALIZATION.time(endpoint=endpoint_label()):
+        return jsonify(payload)
+
+# Last good response per URL, replayed (marked stale) when a live query times out
+_stale_cache = StaleCache()
+
+def _degradable(name: str):
+    """Run the view under STATEMENT_TIMEOUT_MS[_<NAME>] and fall back to _stale_cache on timeouts."""
+    def decorator(view):
+        guarded = serve_stale_on(lambda e: sql_utils.is_timeout_error(e), _stale_cache)(view)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with sql_utils.statement_timeout(sql_utils.statement_timeout_for(name)):
+                return guarded(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _precompiled(view):
+    """Answer the UI's fixed service_id/limit combinations from _precompiled_responses."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = _precompiled_responses.respond(app, request)
+        return view(*args, **kwargs) if response is None else response
+    return wrapper
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def _wants_ndjson() -> bool:
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def _items_response(rows, limit_param):
+    """Buffer bounded results; stream limit=all (and NDJSON) straight from the row iterator.
+
+    The first row is fetched here, so connecting, the statement and its timeout fail in
+    the view (where _degradable answers them) rather than after a 200 has gone out.
+    """
+    ndjson = _wants_ndjson()
+    if not ndjson and sql_utils._sanitize_limit(limit_param) is not None:
+        return _json_response({"items": list(rows)})
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is not None:
+        rows = itertools.chain((first,), rows)
+    return Response(stream_items(rows, ndjson=ndjson), mimetype=NDJSON_MIMETYPE if ndjson else "application/json")
 
 # CSV directory
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
@@ -64,13 +98,127 @@ def _has_csv(filename: str) -> bool:
     except Exception:
         return False
 
+_CSV_FILES = ('q1_busiest_stops.csv', 'q2_avg_duration_speed.csv', 'q3_transfer_points.csv', 'q4_hourly_frequency.csv')
+
+def _data_fingerprint():
+    """Changes whenever a file behind the Q1–Q4 answers is regenerated."""
+    return file_fingerprint(
+        [os.path.join(data_dir, f) for f in _CSV_FILES]
+        + [duckdb_backend._snapshot_path(t) for t in (*duckdb_backend.SNAPSHOT_EXPORTS, duckdb_backend.TRANSFERS_SNAPSHOT)]
+        + [os.path.join(numpy_engine.CACHE_DIR, numpy_engine.MANIFEST)])
+
+_precompiled_responses = PrecompiledResponses(("/api/q1", "/api/q2", "/api/q3", "/api/q4"), _data_fingerprint)
+
+def _snapshots_required(param: str):
+    return jsonify({"error": f"'{param}' filter requires Parquet snapshots (python -m SQL.duckdb_backend export)"}), 400
+
+def _route_type():
+    """(route_type as an int or None, None) from ?route_type=, or (None, error response)."""
+    value = request.args.get("route_type")
+    if value is None:
+        return None, None
+    try:
+        route_type = int(value)
+    except ValueError:
+        return None, (jsonify({"error": "'route_type' must be a whole number (GTFS route_type)"}), 400)
+    if not duckdb_backend.has_snapshots():
+        return None, _snapshots_required("route_type")
+    return route_type, None
+
+def _npy_cache_required():
+    return jsonify({"error": "Journey planning needs the NumPy cache (python -m SQL.numpy_engine build)"}), 503
+
+def _resolve_service(default=None):
+    """(service filter, None) from ?service_id= and ?date=, or (None, error response).
+
+    A date becomes the services running on it (one service_id, or a tuple when several
+    run); with both parameters the service_id must be one of them.
+    """
+    requested = request.args.get("service_id")
+    date_param = request.args.get("date")
+    if date_param is None:
+        return (default if requested is None else requested), None
+    try:
+        day = service_calendar.parse_date(date_param)
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    try:
+        calendar = service_calendar.get_calendar()
+    except LookupError as e:
+        return None, (jsonify({"error": f"'date' needs the GTFS calendar: {e}"}), 503)
+    services = calendar.services_on(day)
+    narrowed = requested not in (None, "", "4")
+    if narrowed:
+        services = tuple(s for s in services if s == requested)
+    if services:
+        return (services[0] if len(services) == 1 else services), None
+    if not calendar.covers(day):
+        message = f"{day.isoformat()} is outside the feed calendar ({calendar.start} to {calendar.end})"
+    elif narrowed:
+        message = f"service_id {requested} does not run on {day.isoformat()}"
+    else:
+        message = f"No service runs on {day.isoformat()}"
+    return None, (jsonify({"error": message}), 404)
+
+def _single_service(service_id) -> bool:
+    # The precomputed CSVs hold one row set per service_id
+    return not isinstance(service_id, tuple)
+
 # Eagerly prepare SQL engine only if needed (lazy init below)
 engine = None
 def _ensure_engine():
     global engine
     if engine is None:
-        engine = get_engine()
-        ensure_hourly_frequency_view(engine)
+        engine = sql_utils.get_engine()
+        sql_utils.ensure_hourly_frequency_view(engine)
+
+
+def _q1_rows(service_id, limit_param, route_type=None):
+    if route_type is None and _single_service(service_id) and _has_csv('q1_busiest_stops.csv'):
+        return csv_backend.iter_q1_busiest_stops(service_id, limit_param)
+    if duckdb_backend.has_snapshots():
+        return duckdb_backend.iter_q1_busiest_stops(service_id, limit_param, route_type=route_type)
+    if numpy_engine.has_store():
+        return numpy_engine.iter_q1_busiest_stops(service_id, limit_param)
+    _ensure_engine()
+    return sql_utils.iter_q1_busiest_stops(engine, service_id, limit_param)
+
+def _q3_rows(service_id, limit_param, route_type=None):
+    if route_type is None and _single_service(service_id) and _has_csv('q3_transfer_points.csv'):
+        return csv_backend.iter_q3_transfer_points(service_id, limit_param)
+    if duckdb_backend.has_snapshots():
+        return duckdb_backend.iter_q3_transfer_points(service_id, limit_param, route_type=route_type)
+    if numpy_engine.has_store():
+        return numpy_engine.iter_q3_transfer_points(service_id, limit_param)
+    _ensure_engine()
+    return sql_utils.iter_q3_transfer_points(engine, service_id, limit_param)
+
+_LAYER_ROWS = {"q1": _q1_rows, "q3": _q3_rows}
+TILE_MAX_AGE = int(os.getenv("TILE_MAX_AGE", "3600"))
+
+# --- Pre-fork hooks (python -m SQL.prefork sql) ---
+def preload():
+    """Load the read-only data in the master so forked workers share its pages."""
+    if all(_has_csv(f) for f in _CSV_FILES):
+        csv_backend._load()
+    if numpy_engine.has_store():
+        numpy_engine.warm_store()
+    print(f"[precompiled] {_precompiled_responses.build(app)}")
+
+def post_fork():
+    """Connections and pools are per process: drop anything inherited and reopen lazily."""
+    global engine
+    engine = None
+    duckdb_backend.reset_connection()
+    startup.run_in_background(startup_phase)
+
+def startup_phase():
+    """Warm the backend the first requests will use; /readyz answers 200 once this succeeds."""
+    preload()
+    if duckdb_backend.has_snapshots():
+        duckdb_backend._get_db()
+    elif not (all(_has_csv(f) for f in _CSV_FILES) or numpy_engine.has_store()):
+        _ensure_engine()  # MySQL is the only backend: connect and create the Q4 view now
 
 
 @app.get("/")
@@ -79,54 +227,213 @@ def index():
 
 
 @app.get("/api/q1")
+@_precompiled
+@_degradable("q1")
 def api_q1():
-    service_id = request.args.get("service_id")
+    service_id, error = _resolve_service()
+    if error:
+        return error
     limit_param = request.args.get("limit")
-    if _has_csv('q1_busiest_stops.csv'):
-        data = csv_backend.query_q1_busiest_stops(service_id, limit_param)
-    else:
-        _ensure_engine()
-        data = sql_q1(engine, service_id, limit_param)
-    return jsonify(_to_json_safe({"items": data}))
+    route_type, error = _route_type()
+    if error:
+        return error
+    return _items_response(_q1_rows(service_id, limit_param, route_type), limit_param)
 
 
 @app.get("/api/q2")
+@_precompiled
+@_degradable("q2")
 def api_q2():
-    service_id = request.args.get("service_id")
+    service_id, error = _resolve_service()
+    if error:
+        return error
     limit_param = request.args.get("limit")
-    if _has_csv('q2_avg_duration_speed.csv'):
+    route_type, error = _route_type()
+    if error:
+        return error
+    if route_type is None and _single_service(service_id) and _has_csv('q2_avg_duration_speed.csv'):
         data = csv_backend.query_q2_avg_duration_speed(service_id, limit_param)
+    elif duckdb_backend.has_snapshots():
+        data = duckdb_backend.query_q2_avg_duration_speed(service_id, limit_param, route_type=route_type)
+    elif numpy_engine.has_store():
+        data = numpy_engine.query_q2_avg_duration_speed(service_id, limit_param)
     else:
         _ensure_engine()
-        data = sql_q2(engine, service_id, limit_param)
-    return jsonify(_to_json_safe(data))
+        data = sql_utils.query_q2_avg_duration_speed(engine, service_id, limit_param)
+    return _json_response(data)
 
 
 @app.get("/api/q3")
+@_precompiled
+@_degradable("q3")
 def api_q3():
-    service_id = request.args.get("service_id")
+    service_id, error = _resolve_service()
+    if error:
+        return error
     limit_param = request.args.get("limit")
-    if _has_csv('q3_transfer_points.csv'):
-        data = csv_backend.query_q3_transfer_points(service_id, limit_param)
+    route_type, error = _route_type()
+    if error:
+        return error
+    if request.args.get("cluster") in ("1", "true"):
+        # Walking clusters come from stop_transfers; the precomputed CSVs only cover single stops
+        if duckdb_backend.has_snapshots() and duckdb_backend.has_transfers():
+            rows = duckdb_backend.iter_q3_transfer_clusters(service_id, limit_param, route_type=route_type)
+        elif route_type is not None:
+            return _snapshots_required("route_type")
+        elif numpy_engine.has_store():
+            rows = numpy_engine.iter_q3_transfer_clusters(service_id, limit_param)
+        else:
+            _ensure_engine()
+            rows = sql_utils.iter_q3_transfer_clusters(engine, service_id, limit_param)
     else:
-        _ensure_engine()
-        data = sql_q3(engine, service_id, limit_param)
-    return jsonify(_to_json_safe({"items": data}))
+        rows = _q3_rows(service_id, limit_param, route_type)
+    return _items_response(rows, limit_param)
 
 
 @app.get("/api/q4")
+@_precompiled
+@_degradable("q4")
 def api_q4():
-    service_id = request.args.get("service_id")
+    service_id, error = _resolve_service()
+    if error:
+        return error
     limit_param = request.args.get("limit")
-    if _has_csv('q4_hourly_frequency.csv'):
+    route_type, error = _route_type()
+    if error:
+        return error
+    if route_type is None and _single_service(service_id) and _has_csv('q4_hourly_frequency.csv'):
         data = csv_backend.query_q4_hourly_frequency(service_id, limit_param)
+    elif duckdb_backend.has_snapshots():
+        data = duckdb_backend.query_q4_hourly_frequency(service_id, limit_param, route_type=route_type)
+    elif numpy_engine.has_store():
+        data = numpy_engine.query_q4_hourly_frequency(service_id, limit_param)
     else:
         _ensure_engine()
-        data = sql_q4(engine, service_id, limit_param)
-    return jsonify(_to_json_safe(data))
+        data = sql_utils.query_q4_hourly_frequency(engine, service_id, limit_param)
+    return _json_response(data)
+
+
+@app.get("/api/<query>/export")
+def api_export(query):
+    """Q1–Q4 rows as an Arrow IPC stream, Parquet or CSV file, streamed in record batches."""
+    if query not in ("q1", "q2", "q3", "q4"):
+        return jsonify({"error": f"Unknown export {query!r} (q1, q2, q3 or q4)"}), 404
+    fmt = request.args.get("format", "arrow")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    service_id, error = _resolve_service()
+    if error:
+        return error
+    limit_param = request.args.get("limit", "all")
+    route_type, error = _route_type()
+    if error:
+        return error
+    if query == "q3" and request.args.get("cluster") in ("1", "true"):
+        if not duckdb_backend.has_transfers() and duckdb_backend.has_snapshots():
+            return _snapshots_required("cluster")
+        query = "q3_clusters"
+    if duckdb_backend.has_snapshots():
+        batches = export.duckdb_batches(query, service_id, limit_param, route_type)
+    else:
+        _ensure_engine()
+        batches = export.mysql_batches(engine, query, service_id, limit_param,
+                                       timeout_ms=sql_utils.statement_timeout_for("export"))
+    chunks = export.encode(batches, export.SCHEMAS[query], fmt)
+    # Run the query before answering, so a failure is an error status and not a truncated file
+    first = next(chunks)
+    mimetype, extension = export.FORMATS[fmt]
+    label = sql_utils.service_label(sql_utils._service_id_filter(service_id)) or "all"
+    response = Response(itertools.chain([first], chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{query}_service-{label}.{extension}"'
+    return response
+
+
+@app.get("/plan")
+def plan_journey():
+    from_stop = request.args.get("from")
+    to_stop = request.args.get("to")
+    depart = request.args.get("depart")
+    window = request.args.get("window")
+    if not (from_stop and to_stop and depart):
+        return jsonify({"error": "'from', 'to' (stop_id) and 'depart' (HH:MM[:SS]) are required"}), 400
+    service_id, error = _resolve_service("1")
+    if error:
+        return error
+    if not numpy_engine.has_store():
+        return _npy_cache_required()
+    if window is not None and not window.isdigit():
+        return jsonify({"error": "'window' must be a whole number of minutes"}), 400
+    try:
+        window_min = None if window is None else int(window)
+        data = journey_planner.plan(from_stop, to_stop, depart, service_id, window_min)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _json_response(data)
+
+
+@app.get("/api/isochrone")
+def api_isochrone():
+    stop_id = request.args.get("stop_id")
+    depart = request.args.get("depart", "08:00")
+    minutes = request.args.get("minutes", "30,45,60")
+    fmt = request.args.get("format", "geojson")
+    if not stop_id:
+        return jsonify({"error": "'stop_id' is required"}), 400
+    service_id, error = _resolve_service("1")
+    if error:
+        return error
+    if fmt not in ("geojson", "stops"):
+        return jsonify({"error": "'format' must be geojson or stops"}), 400
+    try:
+        bands = [int(m) for m in minutes.split(",")]
+    except ValueError:
+        return jsonify({"error": "'minutes' must be a comma-separated list of whole minutes"}), 400
+    if not numpy_engine.has_store():
+        return _npy_cache_required()
+    try:
+        data = isochrones.isochrone(stop_id, depart, service_id, bands, fmt)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _json_response(data)
+
+
+@app.get("/tiles/<layer>/<int:z>/<int:x>/<int:y>")
+@_degradable("tiles")
+def stop_tile(layer, z, x, y):
+    """Q1/Q3 stops for one map tile: clusters with counts up to TILE_CLUSTER_MAX_ZOOM, then single stops."""
+    if layer not in _LAYER_ROWS:
+        return jsonify({"error": f"Unknown tile layer {layer!r} (q1 or q3)"}), 404
+    # Before the ETag check, so a revalidation of a tile that cannot exist is not a 304
+    try:
+        stop_tiles.check_tile(z, x, y)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    service_id, error = _resolve_service()
+    if error:
+        return error
+    route_type, error = _route_type()
+    if error:
+        return error
+    key = (layer, service_id, route_type)
+    index = stop_tiles.get_index(key, layer, lambda: _LAYER_ROWS[layer](service_id, "all", route_type))
+    # The ETag covers the whole layer, so a revalidation skips building the tile
+    if index.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = _json_response(index.tile(z, x, y))
+        response.mimetype = "application/geo+json"
+    response.set_etag(index.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = TILE_MAX_AGE
+    return response
 
 
 if __name__ == "__main__":
+    startup.run_in_background(startup_phase)
     # Run on a different port to avoid conflict with Mongo UI
     app.run(host="127.0.0.1", port=5050, debug=True)
 
@@ -0,0 +1,263 @@
+"""Scale benchmarks for every query backend over synthetic (or real) GTFS feeds.
+
+DuckDB and the NumPy engine run standalone. MySQL (load + live SQL + CSV generation
++ CSV backend) and the Mongo ETL only run when asked for, because they overwrite the
+tables / collection they point at.
+
+    python -m SQL.benchmark --scales 1x 10x --targets numpy duckdb
+    python -m SQL.benchmark --dataset ../dataset --targets mysql csv mongo
+    python -m SQL.benchmark --compare bench_results/old.json bench_results/new.json
+"""
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from . import csv_backend, duckdb_backend, generate_csv, numpy_engine, sql_utils
+from .synthetic_gtfs import SCALES, generate_feed
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'bench_results')
+WORK_DIR = os.getenv("BENCH_WORK_DIR", os.path.join(tempfile.gettempdir(), 'transit_bench'))
+MONGO_BENCH_COLLECTION = os.getenv("MONGO_BENCH_COLLECTION", "stop_timetables_bench")
+
+QUERIES = ('query_q1_busiest_stops', 'query_q2_avg_duration_speed',
+           'query_q3_transfer_points', 'query_q4_hourly_frequency')
+SERVICES = (None, '1', '2', '3')
+LIMITS = ('20', 'all')
+TARGETS = ('numpy', 'duckdb', 'mysql', 'csv', 'mongo')
+DEFAULT_TARGETS = ('numpy', 'duckdb')
+
+
+@contextmanager
+def _patched(module: Any, **attrs: Any) -> Iterator[None]:
+    saved = {k: getattr(module, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(module, k, v)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(module, k, v)
+
+
+def _stats(runs: List[float]) -> Dict[str, Any]:
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def _time_once(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _time(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    return _stats([_time_once(fn) for _ in range(repeat)])
+
+
+def _query_cases(call: Callable[[str, Optional[str], str], Any], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for name in QUERIES:
+        for sid in SERVICES:
+            for limit in LIMITS:
+                stats = _time(lambda: call(name, sid, limit), repeat)
+                results.append({"case": name, "service_id": sid or '4', "limit": limit, **stats})
+                print(f"  {name:<28} service={sid or '4'} limit={limit:<3} median {stats['median'] * 1000:9.1f} ms")
+    return results
+
+
+def bench_numpy(dataset_dir: str, work_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    cache_dir = os.path.join(work_dir, 'npy_cache')
+    build = _time_once(lambda: numpy_engine.build_store(dataset_dir, cache_dir))
+    results = [{"case": "build_store", **_stats([build])}]
+    with _patched(numpy_engine, CACHE_DIR=cache_dir, DATASET_DIR=dataset_dir, _store=None):
+        results.append({"case": "load_store", **_time(lambda: numpy_engine.load_store(cache_dir), repeat)})
+        # First call pays for lazily derived arrays; report it apart from steady state
+        results.append({"case": "first_query", **_stats([_time_once(
+            lambda: numpy_engine.query_q2_avg_duration_speed(None, '20'))])})
+        results += _query_cases(lambda n, s, l: getattr(numpy_engine, n)(s, l), repeat)
+    return results
+
+
+def bench_duckdb(dataset_dir: str, work_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    snapshot_dir = os.path.join(work_dir, 'snapshots')
+    with _patched(duckdb_backend, SNAPSHOT_DIR=snapshot_dir, _db=None):
+        export = _time_once(lambda: duckdb_backend.export_snapshots_from_dataset(dataset_dir))
+        results = [{"case": "export_snapshots", **_stats([export])}]
+        results += _query_cases(lambda n, s, l: getattr(duckdb_backend, n)(s, l), repeat)
+        if duckdb_backend._db is not None:
+            duckdb_backend._db.close()
+    return results
+
+
+def bench_mysql(dataset_dir: str, work_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    from .load_gtfs import load_dataset
+
+    load = _time_once(lambda: load_dataset(dataset_dir))
+    results = [{"case": "load_dataset", **_stats([load])}]
+    engine = sql_utils.get_engine()
+    results += _query_cases(lambda n, s, l: getattr(sql_utils, n)(engine, s, l), repeat)
+    return results
+
+
+def bench_csv(dataset_dir: str, work_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    """Precompute the CSV fast path from whatever MySQL holds, then query it."""
+    data_dir = os.path.join(work_dir, 'csv_data')
+    engine = sql_utils.get_engine()
+    results = []
+    with _patched(generate_csv, DATA_DIR=data_dir):
+        generate_csv._ensure_data_dir()
+        for step in ('generate_q1', 'generate_q2', 'generate_q3', 'generate_q4'):
+            secs = _time_once(lambda: getattr(generate_csv, step)(engine))
+            results.append({"case": step, **_stats([secs])})
+    with _patched(csv_backend, DATA_DIR=data_dir, _q1_df=None, _q2_df=None, _q3_df=None, _q4_df=None):
+        results.append({"case": "load_csv", **_stats([_time_once(csv_backend._load)])})
+        results += _query_cases(lambda n, s, l: getattr(csv_backend, n)(s, l), repeat)
+    return results
+
+
+def _load_denormalization() -> Any:
+    path = os.path.join(REPO_ROOT, 'Mongo', 'denormalization.py')
+    spec = importlib.util.spec_from_file_location('denormalization', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_mongo(dataset_dir: str, work_dir: str, repeat: int) -> List[Dict[str, Any]]:
+    """Time the MySQL -> Mongo denormalization into a scratch collection."""
+    denorm = _load_denormalization()
+    collection = denorm.get_mongo_collection(MONGO_BENCH_COLLECTION, location_index=True)
+    engine = denorm.get_mysql_engine()
+    try:
+        secs = _time_once(lambda: denorm.run_etl(engine, collection))
+        return [{"case": "run_etl", "documents": collection.estimated_document_count(), **_stats([secs])}]
+    finally:
+        collection.drop()
+
+
+BENCHES = {
+    'numpy': bench_numpy,
+    'duckdb': bench_duckdb,
+    'mysql': bench_mysql,
+    'csv': bench_csv,
+    'mongo': bench_mongo,
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _dataset_counts(dataset_dir: str) -> Dict[str, int]:
+    counts = {}
+    for table in ('stops', 'routes', 'trips', 'stop_times'):
+        with open(os.path.join(dataset_dir, f'{table}.txt'), 'rb') as f:
+            counts[table] = max(sum(1 for _ in f) - 1, 0)
+    return counts
+
+
+def _synthetic_feed(label: str, seed: int) -> str:
+    scale = SCALES.get(label) or float(label.rstrip('x'))
+    out_dir = os.path.join(WORK_DIR, f'gtfs_{label}_seed{seed}')
+    if not os.path.exists(os.path.join(out_dir, 'stop_times.txt')):
+        print(f"Generating synthetic feed {label} into {out_dir}")
+        generate_feed(out_dir, scale=scale, seed=seed)
+    return out_dir
+
+
+def run(scales: List[str], targets: List[str], repeat: int = 3, seed: int = 42,
+        dataset_dir: Optional[str] = None) -> Dict[str, Any]:
+    feeds = [('dataset', dataset_dir)] if dataset_dir else [(s, _synthetic_feed(s, seed)) for s in scales]
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "seed": seed,
+        "feeds": [],
+    }
+    for label, path in feeds:
+        feed = {"scale": label, "path": path, "counts": _dataset_counts(path), "targets": {}}
+        work_dir = os.path.join(WORK_DIR, f'work_{label}')
+        os.makedirs(work_dir, exist_ok=True)
+        for target in targets:
+            print(f"[{label}] {target}")
+            feed["targets"][target] = BENCHES[target](path, work_dir, repeat)
+        report["feeds"].append(feed)
+    return report
+
+
+def _index(report: Dict[str, Any]) -> Dict[tuple, float]:
+    out = {}
+    for feed in report["feeds"]:
+        for target, rows in feed["targets"].items():
+            for r in rows:
+                out[(feed["scale"], target, r["case"], r.get("service_id"), r.get("limit"))] = r["median"]
+    return out
+
+
+def compare(old_path: str, new_path: str, threshold: float = 1.25) -> int:
+    """Print median ratios new/old; returns 1 when any case slowed down by more than threshold."""
+    with open(old_path) as f:
+        old = _index(json.load(f))
+    with open(new_path) as f:
+        new = _index(json.load(f))
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=str):
+        ratio = new[key] / old[key] if old[key] > 0 else float('inf')
+        flag = ' REGRESSION' if ratio > threshold else ''
+        regressions += bool(flag)
+        print(f"{' '.join(str(k) for k in key if k is not None):<70} {old[key] * 1000:9.1f} -> "
+              f"{new[key] * 1000:9.1f} ms  x{ratio:5.2f}{flag}")
+    return 1 if regressions else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the query backends on synthetic GTFS feeds")
+    parser.add_argument("--scales", nargs="+", default=["1x"], help="Synthetic feed sizes, e.g. 1x 10x 50x")
+    parser.add_argument("--dataset", default=None, help="Benchmark an existing GTFS directory instead")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(DEFAULT_TARGETS),
+                        help="mysql/csv/mongo overwrite the configured MYSQL_DB tables and a scratch collection")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="Result JSON path (default bench_results/<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    report = run(args.scales, args.targets, repeat=args.repeat, seed=args.seed, dataset_dir=args.dataset)
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        out = os.path.join(RESULTS_DIR, f"{report['commit'] or 'nogit'}-{stamp}.json")
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+-- Compact integer-key variant of the stop_times fact table (optional)
+--
+-- stop_times repeats VARCHAR(64) trip_id/stop_id and TIME values on every row, and
+-- every secondary index carries the (trip_id, stop_sequence) primary key again.
+-- Here each GTFS id is mapped once to an integer surrogate key and times are seconds
+-- after midnight (values past 24:00:00 kept), so a stop_times_compact row and its
+-- index entries take a fraction of the space and the Q1–Q4 joins compare integers.
+--
+-- python -m SQL.load_gtfs --compact         load the GTFS files, then fill these tables
+-- python -m SQL.load_gtfs --compact-only    fill them from the tables already loaded
+--
+-- The VARCHAR-keyed tables stay in place; stops, routes and calendar are shared.
+-- MYSQL_COMPACT_SCHEMA=true makes the API, generate_csv and denormalization use these.
+
+SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0;
+SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0;
+
+USE `transit` ;
+
+-- -----------------------------------------------------
+-- Table `transit`.`service_keys`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`service_keys` (
+  `service_key` SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `service_id` VARCHAR(64) NOT NULL,
+  PRIMARY KEY (`service_key`),
+  UNIQUE INDEX `ux_service_keys_service_id` (`service_id` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- -----------------------------------------------------
+-- Table `transit`.`route_keys`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`route_keys` (
+  `route_key` MEDIUMINT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `route_id` VARCHAR(64) NOT NULL,
+  PRIMARY KEY (`route_key`),
+  UNIQUE INDEX `ux_route_keys_route_id` (`route_id` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- -----------------------------------------------------
+-- Table `transit`.`stop_keys`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`stop_keys` (
+  `stop_key` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `stop_id` VARCHAR(64) NOT NULL,
+  PRIMARY KEY (`stop_key`),
+  UNIQUE INDEX `ux_stop_keys_stop_id` (`stop_id` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- -----------------------------------------------------
+-- Table `transit`.`trip_keys`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`trip_keys` (
+  `trip_key` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  `trip_id` VARCHAR(64) NOT NULL,
+  `route_key` MEDIUMINT UNSIGNED NOT NULL,
+  `service_key` SMALLINT UNSIGNED NOT NULL,
+  PRIMARY KEY (`trip_key`),
+  UNIQUE INDEX `ux_trip_keys_trip_id` (`trip_id` ASC) VISIBLE,
+  INDEX `ix_trip_keys_service_route` (`service_key` ASC, `route_key` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- -----------------------------------------------------
+-- Table `transit`.`stop_times_compact`
+-- Signed MEDIUMINT seconds: 0..8388607 covers any GTFS time, and differences
+-- such as MAX(arrival_s) - MIN(departure_s) cannot overflow an unsigned type
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`stop_times_compact` (
+  `trip_key` INT UNSIGNED NOT NULL,
+  `stop_sequence` INT NOT NULL,
+  `stop_key` INT UNSIGNED NOT NULL,
+  `arrival_s` MEDIUMINT NULL DEFAULT NULL,
+  `departure_s` MEDIUMINT NULL DEFAULT NULL,
+  `shape_dist_traveled` FLOAT NULL DEFAULT NULL,
+  PRIMARY KEY (`trip_key`, `stop_sequence`),
+  INDEX `ix_stc_stop_departure` (`stop_key` ASC, `departure_s` ASC) VISIBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
+SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;
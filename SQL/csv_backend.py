@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import pandas as pd
 
@@ -37,7 +37,7 @@ def _sanitize_limit(limit_param: Optional[str]) -> Optional[int]:
         return 20
 
 
-def query_q1_busiest_stops(service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
+def iter_q1_busiest_stops(service_id: Optional[str], limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
     _load()
     sid = '4' if service_id in (None, '', '4', 4) else str(service_id)
     df = _q1_df[_q1_df['service_id'].astype(str) == sid].copy()
@@ -45,8 +45,8 @@ def query_q1_busiest_stops(service_id: Optional[str], limit_param: Optional[str]
     limit_value = _sanitize_limit(limit_param)
     if limit_value is not None:
         df = df.head(limit_value)
-    return [
-        {
+    for _, r in df.iterrows():
+        yield {
             'stop_id': r.stop_id,
             'stop_code': r.stop_code if pd.notna(r.stop_code) else None,
             'stop_name': r.stop_name,
@@ -55,11 +55,13 @@ def query_q1_busiest_stops(service_id: Optional[str], limit_param: Optional[str]
             'total_trip_events': int(r.total_trip_events),
             'num_unique_routes': int(r.num_unique_routes),
         }
-        for _, r in df.iterrows()
-    ]
 
 
-def query_q3_transfer_points(service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
+def query_q1_busiest_stops(service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_q1_busiest_stops(service_id, limit_param))
+
+
+def iter_q3_transfer_points(service_id: Optional[str], limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
     _load()
     sid = '4' if service_id in (None, '', '4', 4) else str(service_id)
     df = _q3_df[_q3_df['service_id'].astype(str) == sid].copy()
@@ -67,8 +69,8 @@ def query_q3_transfer_points(service_id: Optional[str], limit_param: Optional[st
     limit_value = _sanitize_limit(limit_param)
     if limit_value is not None:
         df = df.head(limit_value)
-    return [
-        {
+    for _, r in df.iterrows():
+        yield {
             'stop_id': r.stop_id,
             'stop_code': r.stop_code if pd.notna(r.stop_code) else None,
             'stop_name': r.stop_name,
@@ -76,8 +78,10 @@ def query_q3_transfer_points(service_id: Optional[str], limit_param: Optional[st
             'stop_lon': float(r.stop_lon),
             'num_unique_routes': int(r.num_unique_routes),
         }
-        for _, r in df.iterrows()
-    ]
+
+
+def query_q3_transfer_points(service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_q3_transfer_points(service_id, limit_param))
 
 
 def query_q2_avg_duration_speed(service_id: Optional[str], limit_param: Optional[str]) -> Dict[str, Any]:
@@ -99,12 +103,12 @@ def query_q2_avg_duration_speed(service_id: Optional[str], limit_param: Optional
             gdf = gdf.head(limit_value)
         selected = set(zip(gdf['route_long_name'], gdf['route_short_name']))
         # per-service stats for selected routes
-        ps = df[df['service_id'].astype(str).isin(['1', '2', '3'])]
+        ps = df[df['service_id'].astype(str) != '4']
         ps = ps[ps.apply(lambda r: (r['route_long_name'], r['route_short_name']) in selected, axis=1)]
         routes = []
         for (rl, rs), g in gdf.groupby(['route_long_name', 'route_short_name']):
             services = []
-            for sid2 in ['1', '2', '3']:
+            for sid2 in sorted(ps['service_id'].astype(str).unique()):
                 r = ps[(ps['route_long_name'] == rl) & (ps['route_short_name'] == rs) & (ps['service_id'].astype(str) == sid2)]
                 if len(r):
                     row = r.iloc[0]
@@ -196,16 +200,16 @@ def query_q4_hourly_frequency(service_id: Optional[str], limit_param: Optional[s
         # For whole-week mode return per-service totals and average
         if sid == '4':
             per_service = (
-                _q4_df[_q4_df['service_id'].astype(str).isin(['1','2','3'])]
+                _q4_df[_q4_df['service_id'].astype(str) != '4']
                 .groupby(['route_long_name', 'route_short_name', 'service_id'], as_index=False)['trips_per_hour']
                 .sum()
             )
             rows = per_service[(per_service['route_long_name'] == rl) & (per_service['route_short_name'] == rs)]
-            totals_by_service = {'1': 0, '2': 0, '3': 0}
+            totals_by_service = {s: 0 for s in sorted(per_service['service_id'].astype(str).unique())}
             for _, r in rows.iterrows():
                 totals_by_service[str(r['service_id'])] = int(r['trips_per_hour'])
             route_obj['totals_by_service'] = totals_by_service
-            route_obj['average_daily_trips'] = sum(totals_by_service.values()) / 3.0
+            route_obj['average_daily_trips'] = sum(totals_by_service.values()) / max(len(totals_by_service), 1)
         out_routes.append(route_obj)
     max_hour = int(df['hour_of_day'].max()) if len(df) else 0
     return {
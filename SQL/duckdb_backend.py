@@ -0,0 +1,667 @@
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .sql_utils import (
+    Q3_CLUSTER_SELECT,
+    ServiceFilter,
+    _build_q2_single_service,
+    _build_q2_whole_week,
+    _build_q4_response,
+    _format_q1_row,
+    _format_q3_cluster_row,
+    _format_q3_row,
+    _sanitize_limit,
+    _service_id_filter,
+    service_label,
+)
+from .service_calendar import CALENDAR_FILE, ServiceCalendar, calendar_from_dataset, calendar_from_mysql
+from .stop_transfers import compute_transfers
+
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), 'snapshots'))
+
+# Columns exported per table; times are stored as seconds since service-day start
+# so that values past 24:00:00 survive the round trip.
+SNAPSHOT_EXPORTS = {
+    'stops': (
+        "SELECT stop_id, stop_code, stop_name, stop_lat, stop_lon FROM stops",
+        pa.schema([
+            ('stop_id', pa.string()), ('stop_code', pa.string()), ('stop_name', pa.string()),
+            ('stop_lat', pa.float64()), ('stop_lon', pa.float64()),
+        ]),
+    ),
+    'routes': (
+        "SELECT route_id, route_short_name, route_long_name, route_type FROM routes",
+        pa.schema([
+            ('route_id', pa.string()), ('route_short_name', pa.string()),
+            ('route_long_name', pa.string()), ('route_type', pa.int32()),
+        ]),
+    ),
+    'trips': (
+        "SELECT trip_id, route_id, service_id, trip_headsign, direction_id FROM trips",
+        pa.schema([
+            ('trip_id', pa.string()), ('route_id', pa.string()), ('service_id', pa.string()),
+            ('trip_headsign', pa.string()), ('direction_id', pa.int32()),
+        ]),
+    ),
+    'stop_times': (
+        "SELECT trip_id, stop_id, stop_sequence, TIME_TO_SEC(arrival_time) AS arrival_s, "
+        "TIME_TO_SEC(departure_time) AS departure_s, shape_dist_traveled FROM stop_times",
+        pa.schema([
+            ('trip_id', pa.string()), ('stop_id', pa.string()), ('stop_sequence', pa.int32()),
+            ('arrival_s', pa.int32()), ('departure_s', pa.int32()), ('shape_dist_traveled', pa.float64()),
+        ]),
+    ),
+}
+
+# Derived from the stops snapshot on every export; optional so older snapshot sets still load
+TRANSFERS_SNAPSHOT = 'stop_transfers'
+
+EXPORT_CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "100000"))
+
+_db: Optional[duckdb.DuckDBPyConnection] = None
+_db_lock = threading.Lock()
+
+
+def _snapshot_path(table: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f'{table}.parquet')
+
+
+def has_snapshots() -> bool:
+    return all(os.path.exists(_snapshot_path(t)) for t in SNAPSHOT_EXPORTS)
+
+
+def has_transfers() -> bool:
+    return os.path.exists(_snapshot_path(TRANSFERS_SNAPSHOT))
+
+
+def export_transfers() -> None:
+    """Write stop_transfers.parquet for the stops snapshot (walking pairs within TRANSFER_RADIUS_M)."""
+    stops = pq.read_table(_snapshot_path('stops'), columns=['stop_id', 'stop_lat', 'stop_lon']).to_pandas()
+    transfers = compute_transfers(stops)
+    tmp_path = _snapshot_path(TRANSFERS_SNAPSHOT) + '.tmp'
+    transfers.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, _snapshot_path(TRANSFERS_SNAPSHOT))
+    print(f"Wrote {len(transfers)} walking transfers to {_snapshot_path(TRANSFERS_SNAPSHOT)}")
+
+
+def export_calendar(calendar: ServiceCalendar) -> None:
+    """Save the service bitsets next to the snapshots so date= works without MySQL."""
+    path = os.path.join(SNAPSHOT_DIR, CALENDAR_FILE)
+    calendar.save(path)
+    print(f"Wrote {len(calendar.service_ids)} service calendars ({calendar.start} to {calendar.end}) to {path}")
+
+
+def export_snapshots(engine: Engine) -> None:
+    """Stream the base tables out of MySQL into one Parquet file per table."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for table, (sql, schema) in SNAPSHOT_EXPORTS.items():
+        tmp_path = _snapshot_path(table) + '.tmp'
+        rows = 0
+        with engine.connect() as conn, pq.ParquetWriter(tmp_path, schema) as writer:
+            stream = conn.execution_options(stream_results=True)
+            for chunk in pd.read_sql(text(sql), stream, chunksize=EXPORT_CHUNK_SIZE):
+                for field in schema:
+                    if pa.types.is_integer(field.type):
+                        chunk[field.name] = pd.to_numeric(chunk[field.name]).astype('Int32')
+                    elif pa.types.is_string(field.type):
+                        chunk[field.name] = chunk[field.name].map(lambda v: None if pd.isna(v) else str(v))
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                rows += len(chunk)
+        os.replace(tmp_path, _snapshot_path(table))
+        print(f"Exported {rows} rows from {table} to {_snapshot_path(table)}")
+    export_transfers()
+    export_calendar(calendar_from_mysql(engine))
+
+
+def _csv_columns(db: duckdb.DuckDBPyConnection, path: str) -> List[str]:
+    rel = db.sql(f"SELECT * FROM read_csv('{path}', header=true, all_varchar=true) LIMIT 0")
+    return [c.strip() for c in rel.columns]
+
+
+def export_snapshots_from_dataset(dataset_dir: str) -> None:
+    """Build the same Parquet snapshots straight from GTFS dataset/*.txt (no MySQL needed)."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    db = duckdb.connect(database=':memory:')
+
+    def seconds(col: str) -> str:
+        v = f"NULLIF(trim({col}), '')"
+        return (f"CAST(split_part({v}, ':', 1) AS INTEGER) * 3600 + CAST(split_part({v}, ':', 2) AS INTEGER) * 60"
+                f" + CAST(split_part({v}, ':', 3) AS INTEGER)")
+
+    for table, (_, schema) in SNAPSHOT_EXPORTS.items():
+        src = os.path.join(dataset_dir, f'{table}.txt').replace("'", "''")
+        present = set(_csv_columns(db, src))
+        exprs = []
+        for field in schema:
+            if field.name in ('arrival_s', 'departure_s'):
+                raw = field.name.replace('_s', '_time')
+                expr = seconds(raw) if raw in present else "NULL"
+            elif field.name not in present:
+                expr = "NULL"
+            elif pa.types.is_string(field.type):
+                expr = f"NULLIF({field.name}, '')"
+            elif pa.types.is_floating(field.type):
+                # MySQL stores these as single-precision FLOAT and prints the shortest repr
+                expr = f"CAST(CAST(CAST(NULLIF(trim({field.name}), '') AS FLOAT) AS VARCHAR) AS DOUBLE)"
+            else:
+                expr = f"CAST(NULLIF(trim({field.name}), '') AS INTEGER)"
+            exprs.append(f"{expr} AS {field.name}")
+        out = _snapshot_path(table).replace("'", "''")
+        db.execute(
+            f"COPY (SELECT {', '.join(exprs)} FROM read_csv('{src}', header=true, all_varchar=true)) "
+            f"TO '{out}' (FORMAT PARQUET)"
+        )
+        print(f"Wrote {_snapshot_path(table)}")
+    db.close()
+    export_transfers()
+    try:
+        export_calendar(calendar_from_dataset(dataset_dir))
+    except FileNotFoundError as e:
+        print(f"Skipped the service calendar: {e}")
+
+
+def _get_db() -> duckdb.DuckDBPyConnection:
+    global _db
+    with _db_lock:
+        if _db is None:
+            db = duckdb.connect(database=':memory:')
+            threads = os.getenv("DUCKDB_THREADS")
+            if threads:
+                db.execute(f"SET threads TO {int(threads)}")
+            for table in SNAPSHOT_EXPORTS:
+                path = _snapshot_path(table).replace("'", "''")
+                db.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+            if has_transfers():
+                path = _snapshot_path(TRANSFERS_SNAPSHOT).replace("'", "''")
+                db.execute(f"CREATE VIEW {TRANSFERS_SNAPSHOT} AS SELECT * FROM read_parquet('{path}')")
+            db.execute(
+                "CREATE VIEW vw_hourly_frequency AS\n"
+                "SELECT t.route_id, t.service_id, st.departure_s // 3600 AS hour_of_day,\n"
+                "       COUNT(DISTINCT t.trip_id) AS trips_per_hour\n"
+                "FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id\n"
+                "GROUP BY t.route_id, t.service_id, hour_of_day"
+            )
+            _db = db
+        return _db
+
+
+def reset_connection() -> None:
+    """Forget a connection inherited over fork(); the next query opens a fresh one."""
+    global _db
+    _db = None
+
+
+def _fetch(sql: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # One cursor per call: DuckDB cursors are independent connections to the same
+    # in-memory database, which keeps concurrent Flask requests thread-safe.
+    cur = _get_db().cursor()
+    try:
+        result = cur.execute(sql, params) if params else cur.execute(sql)
+        columns = [d[0] for d in result.description]
+        return [dict(zip(columns, row)) for row in result.fetchall()]
+    finally:
+        cur.close()
+
+
+def _iter_fetch(sql: str, params: Dict[str, Any], batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Like _fetch, but pulls the result in fetchmany batches."""
+    cur = _get_db().cursor()
+    try:
+        result = cur.execute(sql, params) if params else cur.execute(sql)
+        columns = [d[0] for d in result.description]
+        while True:
+            batch = result.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield dict(zip(columns, row))
+    finally:
+        cur.close()
+
+
+def _filters(service_filter: ServiceFilter, route_type: Optional[str], params: Dict[str, Any],
+             service_col: str = "t.service_id", route_type_col: str = "r.route_type") -> str:
+    clauses = []
+    if isinstance(service_filter, tuple):
+        clauses.append(f"list_contains($service_ids, {service_col})")
+        params["service_ids"] = list(service_filter)
+    elif service_filter is not None:
+        clauses.append(f"{service_col} = $service_id")
+        params["service_id"] = service_filter
+    if route_type is not None:
+        clauses.append(f"{route_type_col} = $route_type")
+        params["route_type"] = int(route_type)
+    return ("WHERE " + " AND ".join(clauses) + "\n") if clauses else ""
+
+
+def _limit_clause(limit_value: Optional[int]) -> str:
+    return f"LIMIT {limit_value}" if limit_value is not None else ""
+
+
+def _q1_sql(service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str],
+            params: Dict[str, Any]) -> str:
+    where = _filters(_service_id_filter(service_id), route_type, params)
+    return (
+        "SELECT st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon,\n"
+        "       COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_id) AS num_unique_routes\n"
+        "FROM stop_times st\n"
+        "JOIN trips t ON t.trip_id = st.trip_id\n"
+        "JOIN stops s ON s.stop_id = st.stop_id\n"
+        + ("JOIN routes r ON r.route_id = t.route_id\n" if route_type is not None else "")
+        + where
+        + "GROUP BY st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
+        "ORDER BY total_trip_events DESC\n"
+        + _limit_clause(_sanitize_limit(limit_param))
+    )
+
+
+def _q3_sql(service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str],
+            params: Dict[str, Any]) -> str:
+    where = _filters(_service_id_filter(service_id), route_type, params)
+    return (
+        "WITH UniqueStopRoutes AS (\n"
+        "    SELECT DISTINCT st.stop_id, t.route_id\n"
+        "    FROM stop_times st\n"
+        "    JOIN trips t ON t.trip_id = st.trip_id\n"
+        + ("    JOIN routes r ON r.route_id = t.route_id\n" if route_type is not None else "")
+        + "    " + where
+        + ")\n"
+        "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, COUNT(USR.route_id) AS num_unique_routes\n"
+        "FROM stops s\n"
+        "JOIN UniqueStopRoutes USR ON USR.stop_id = s.stop_id\n"
+        "GROUP BY s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
+        "HAVING COUNT(USR.route_id) >= 2\n"
+        "ORDER BY num_unique_routes DESC\n"
+        + _limit_clause(_sanitize_limit(limit_param))
+    )
+
+
+def _q3_cluster_sql(service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str],
+                    params: Dict[str, Any]) -> str:
+    where = _filters(_service_id_filter(service_id), route_type, params)
+    return (
+        "WITH UniqueStopRoutes AS (\n"
+        "    SELECT DISTINCT st.stop_id, t.route_id\n"
+        "    FROM stop_times st\n"
+        "    JOIN trips t ON t.trip_id = st.trip_id\n"
+        + ("    JOIN routes r ON r.route_id = t.route_id\n" if route_type is not None else "")
+        + "    " + where
+        + "),\n"
+        + Q3_CLUSTER_SELECT
+        + _limit_clause(_sanitize_limit(limit_param))
+    )
+
+
+def query_q1_busiest_stops(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q1_sql(service_id, limit_param, route_type, params)
+    return [_format_q1_row(r) for r in _fetch(sql, params)]
+
+
+def iter_q1_busiest_stops(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q1_sql(service_id, limit_param, route_type, params)
+    for r in _iter_fetch(sql, params):
+        yield _format_q1_row(r)
+
+
+def query_q3_transfer_points(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q3_sql(service_id, limit_param, route_type, params)
+    return [_format_q3_row(r) for r in _fetch(sql, params)]
+
+
+def iter_q3_transfer_points(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q3_sql(service_id, limit_param, route_type, params)
+    for r in _iter_fetch(sql, params):
+        yield _format_q3_row(r)
+
+
+def query_q3_transfer_clusters(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q3_cluster_sql(service_id, limit_param, route_type, params)
+    return [_format_q3_cluster_row(r) for r in _fetch(sql, params)]
+
+
+def iter_q3_transfer_clusters(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    params: Dict[str, Any] = {}
+    sql = _q3_cluster_sql(service_id, limit_param, route_type, params)
+    for r in _iter_fetch(sql, params):
+        yield _format_q3_cluster_row(r)
+
+
+# DuckDB equivalent of sql_utils._q2_trip_stats_cte: durations come straight from the
+# second-resolution columns and STDDEV_POP matches MySQL's STDDEV.
+_Q2_TRIP_STATS_CTE = (
+    "WITH trip_stats AS (\n"
+    "    SELECT\n"
+    "        t.route_id,\n"
+    "        t.service_id,\n"
+    "        MAX(st.arrival_s) - MIN(st.departure_s) AS trip_duration_seconds,\n"
+    "        (MAX(st.shape_dist_traveled) - MIN(st.shape_dist_traveled)) AS trip_distance\n"
+    "    FROM stop_times st\n"
+    "    JOIN trips t ON t.trip_id = st.trip_id\n"
+    "    GROUP BY t.trip_id, t.route_id, t.service_id\n"
+    "    HAVING MAX(st.arrival_s) - MIN(st.departure_s) > 60\n"
+    ")\n"
+)
+
+
+def query_q2_avg_duration_speed(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> Dict[str, Any]:
+    limit_value = _sanitize_limit(limit_param)
+    service_filter = _service_id_filter(service_id)
+
+    if service_filter is None:
+        params: Dict[str, Any] = {}
+        where = _filters(None, route_type, params)
+        global_sql = (
+            _Q2_TRIP_STATS_CTE
+            + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            + where
+            + "GROUP BY r.route_long_name\n"
+            "ORDER BY avg_duration_min DESC, r.route_long_name\n"
+            + _limit_clause(limit_value)
+        )
+        # Only the ranked routes' breakdown is fetched
+        per_service_sql = (
+            _Q2_TRIP_STATS_CTE
+            + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short, ts.service_id,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       STDDEV_POP(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            + _top_routes_join(_q2_top_routes_sql(where), limit_value)
+            + where
+            + "GROUP BY r.route_long_name, ts.service_id\n"
+        )
+        return _build_q2_whole_week(_fetch(global_sql, params), _fetch(per_service_sql, params))
+
+    # The services of a date are pooled per route
+    pooled = isinstance(service_filter, tuple)
+    params = {}
+    where = _filters(service_filter, route_type, params, service_col="ts.service_id")
+    sql = (
+        _Q2_TRIP_STATS_CTE
+        + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short,"
+        + ("\n" if pooled else " ts.service_id,\n")
+        + "       COUNT(*) AS total_trips,\n"
+        "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+        "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+        "       STDDEV_POP(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+        "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+        "FROM trip_stats ts\n"
+        "JOIN routes r ON r.route_id = ts.route_id\n"
+        + where
+        + ("GROUP BY r.route_long_name\n" if pooled else "GROUP BY r.route_long_name, ts.service_id\n")
+        + "ORDER BY avg_duration_min DESC, r.route_long_name\n"
+        + _limit_clause(limit_value)
+    )
+    return _build_q2_single_service(_fetch(sql, params), service_label(service_filter) if pooled else None)
+
+
+def query_q4_hourly_frequency(
+    service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str] = None
+) -> Dict[str, Any]:
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+
+    params: Dict[str, Any] = {}
+    where = _filters(service_filter, route_type, params, service_col="vhf.service_id")
+    if limit_value is None:
+        data_sql = (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id,\n"
+            "       vhf.hour_of_day, vhf.trips_per_hour\n"
+            "FROM vw_hourly_frequency vhf\n"
+            "JOIN routes r ON r.route_id = vhf.route_id\n"
+            + where
+            + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
+        )
+    else:
+        # As sql_utils._q4_data_statement: the top routes' rows, plus one NULL-route row per
+        # service so totals_by_service and max_hour still cover every service
+        data_sql = (
+            "WITH hourly AS (\n"
+            "    SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id,\n"
+            "           vhf.hour_of_day, vhf.trips_per_hour\n"
+            "    FROM vw_hourly_frequency vhf\n"
+            "    JOIN routes r ON r.route_id = vhf.route_id\n"
+            + ("    " + where if where else "")
+            + ")\n"
+            "SELECT h.route, h.route_short, h.service_id, h.hour_of_day, h.trips_per_hour\n"
+            "FROM hourly h\n"
+            "JOIN (SELECT route FROM hourly GROUP BY route ORDER BY SUM(trips_per_hour) DESC, route\n"
+            f"      {_limit_clause(limit_value)}) top ON top.route = h.route\n"
+            "UNION ALL\n"
+            "SELECT NULL, NULL, service_id, MAX(hour_of_day), NULL FROM hourly GROUP BY service_id\n"
+            "ORDER BY route, service_id, hour_of_day\n"
+        )
+    rows = _fetch(data_sql, params)
+    return _build_q4_response(rows, {r["route"] for r in rows if r["route"] is not None}, service_filter)
+
+
+def _q2_top_routes_sql(where: str) -> str:
+    """Route names in Q2 order (average duration, ties by name), for _top_routes_join."""
+    return ("SELECT r.route_long_name AS route FROM trip_stats ts JOIN routes r ON r.route_id = ts.route_id\n"
+            + where + "GROUP BY r.route_long_name ORDER BY AVG(ts.trip_duration_seconds)/60.0 DESC, r.route_long_name\n")
+
+
+def _top_routes_join(rank_sql: str, limit_value: Optional[int]) -> str:
+    if limit_value is None:
+        return ""
+    return f"JOIN ({rank_sql}{_limit_clause(limit_value)}) top ON top.route = r.route_long_name\n"
+
+
+def export_sql(query: str, service_id: ServiceFilter, limit_param: Optional[str], route_type: Optional[str],
+               params: Dict[str, Any]) -> str:
+    """SQL of the flat rows behind a Q1–Q4 answer, for SQL.export.
+
+    Q2 has one row per route and service, Q4 one per route, service and hour; a limit
+    keeps the top routes as ranked by the JSON endpoint.
+    """
+    if query == "q1":
+        return _q1_sql(service_id, limit_param, route_type, params)
+    if query == "q3":
+        return _q3_sql(service_id, limit_param, route_type, params)
+    if query == "q3_clusters":
+        return _q3_cluster_sql(service_id, limit_param, route_type, params)
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+    if query == "q2":
+        where = _filters(service_filter, route_type, params, service_col="ts.service_id")
+        rank_sql = _q2_top_routes_sql(where)
+        return (
+            _Q2_TRIP_STATS_CTE
+            + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short, ts.service_id,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       STDDEV_POP(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            + _top_routes_join(rank_sql, limit_value)
+            + where
+            + "GROUP BY r.route_long_name, ts.service_id\n"
+            "ORDER BY avg_duration_min DESC\n"
+        )
+    if query == "q4":
+        where = _filters(service_filter, route_type, params, service_col="vhf.service_id")
+        rank_sql = ("SELECT r.route_long_name AS route FROM vw_hourly_frequency vhf JOIN routes r ON r.route_id = vhf.route_id\n"
+                    + where + "GROUP BY r.route_long_name ORDER BY SUM(vhf.trips_per_hour) DESC, r.route_long_name\n")
+        return (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id,\n"
+            "       vhf.hour_of_day, vhf.trips_per_hour\n"
+            "FROM vw_hourly_frequency vhf\n"
+            "JOIN routes r ON r.route_id = vhf.route_id\n"
+            + _top_routes_join(rank_sql, limit_value)
+            + where
+            + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
+        )
+    raise ValueError(f"Unknown export {query!r}")
+
+
+def _diff(path: str, a: Any, b: Any, out: List[str], tol: float = 0.011) -> None:
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            _diff(f"{path}.{k}", a.get(k), b.get(k), out, tol)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            out.append(f"{path}: length {len(a)} != {len(b)}")
+        for i, (x, y) in enumerate(zip(a, b)):
+            _diff(f"{path}[{i}]", x, y, out, tol)
+    elif isinstance(a, float) or isinstance(b, float):
+        if a is None or b is None or abs(float(a) - float(b)) > tol:
+            out.append(f"{path}: {a!r} != {b!r}")
+    elif a != b:
+        out.append(f"{path}: {a!r} != {b!r}")
+
+
+def _keyed(data: Any, key: str) -> Dict[Any, Any]:
+    # Ties in ORDER BY ... LIMIT are resolved arbitrarily by each engine, so compare
+    # full (limit=all) result sets keyed by identity instead of by position.
+    items = data if isinstance(data, list) else data["routes"]
+    keyed = {}
+    for item in items:
+        item = dict(item)
+        if isinstance(item.get("services"), list):
+            item["services"] = {s["service_id"]: s for s in item["services"]}
+        keyed[item[key]] = item
+    if isinstance(data, dict):
+        return {"_meta": {k: v for k, v in data.items() if k != "routes"}, **keyed}
+    return keyed
+
+
+def _q2_rank(item: Dict[str, Any]) -> float:
+    return item.get("global", item)["avg_duration_min"]
+
+
+def _q4_rank(item: Dict[str, Any]) -> float:
+    return item["total_daily_trips"]
+
+
+def _check_top_n(path: str, full: Dict[str, Any], top: Dict[str, Any], limit: int, rank: Any,
+                 meta_keys: Tuple[str, ...], out: List[str]) -> None:
+    """A limited Q2/Q4 answer against the limit=all one of the same backend.
+
+    The top routes are compared in full with the unlimited answer, must number
+    min(limit, routes) and must not be outranked by a route left out (ties may go
+    either way). The top-level `meta_keys` must not change; Q2's `overall` covers the
+    returned routes only, so it does.
+    """
+    everything = _keyed(full, "route_long_name")
+    chosen = _keyed(top, "route_long_name")
+    meta, full_meta = chosen.pop("_meta"), everything.pop("_meta")
+    for key in meta_keys:
+        _diff(f"{path}.{key}", meta.get(key), full_meta.get(key), out)
+    if len(chosen) != min(limit, len(everything)):
+        out.append(f"{path}: {len(chosen)} routes, expected {min(limit, len(everything))}")
+    for route, item in chosen.items():
+        _diff(f"{path}.{route}", item, everything.get(route), out)
+    cutoff = min((rank(item) for item in chosen.values()), default=None)
+    for route, item in everything.items():
+        if cutoff is not None and route not in chosen and rank(item) > cutoff:
+            out.append(f"{path}: {route!r} ({rank(item)}) outranks the selected routes")
+
+
+def check_parity(engine: Engine, service_ids: Optional[List[Optional[str]]] = None,
+                 top_n: int = 10) -> List[str]:
+    """Run every query through MySQL and DuckDB with limit=all and list the differences.
+
+    Q2 and Q4 are also run with limit=`top_n` on both backends and checked against
+    their own limit=all answers, see _check_top_n.
+    """
+    from .sql_utils import (
+        query_q1_busiest_stops as sql_q1,
+        query_q2_avg_duration_speed as sql_q2,
+        query_q3_transfer_clusters as sql_q3_clusters,
+        query_q3_transfer_points as sql_q3,
+        query_q4_hourly_frequency as sql_q4,
+    )
+
+    checks = [
+        ("q1", sql_q1, query_q1_busiest_stops, "stop_id"),
+        ("q2", sql_q2, query_q2_avg_duration_speed, "route_long_name"),
+        ("q3", sql_q3, query_q3_transfer_points, "stop_id"),
+        ("q4", sql_q4, query_q4_hourly_frequency, "route_long_name"),
+    ]
+    if has_transfers():
+        checks.append(("q3_cluster", sql_q3_clusters, query_q3_transfer_clusters, "stop_id"))
+    if not service_ids:
+        service_ids = [None] + [r["service_id"] for r in _fetch("SELECT DISTINCT service_id FROM trips ORDER BY 1", {})]
+    problems: List[str] = []
+    for sid in service_ids:
+        for name, sql_fn, duck_fn, key in checks:
+            expected = _keyed(sql_fn(engine, sid, "all"), key)
+            actual = _keyed(duck_fn(sid, "all"), key)
+            _diff(f"{name}[service_id={sid or 'all'}]", expected, actual, problems)
+        for name, rank, meta_keys, sql_fn, duck_fn in (
+                ("q2", _q2_rank, ("mode",), sql_q2, query_q2_avg_duration_speed),
+                ("q4", _q4_rank, ("max_hour",), sql_q4, query_q4_hourly_frequency)):
+            for backend, run in (("mysql", lambda limit: sql_fn(engine, sid, limit)),
+                                 ("duckdb", lambda limit: duck_fn(sid, limit))):
+                _check_top_n(f"{name}[service_id={sid or 'all'}, limit={top_n}, {backend}]",
+                             run("all"), run(str(top_n)), top_n, rank, meta_keys, problems)
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    from .sql_utils import get_engine
+
+    parser = argparse.ArgumentParser(description="Parquet snapshots for the embedded DuckDB backend")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--from-dataset", metavar="DIR", help="Export from GTFS *.txt instead of MySQL")
+    args = parser.parse_args(argv)
+
+    if args.command == "export" and args.from_dataset:
+        export_snapshots_from_dataset(args.from_dataset)
+        return 0
+    engine = get_engine()
+    if args.command == "export":
+        export_snapshots(engine)
+        return 0
+
+    problems = check_parity(engine)
+    for p in problems[:200]:
+        print(p)
+    print("Parity OK" if not problems else f"{len(problems)} differences")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Columnar Q1–Q4 exports for analysts: Arrow IPC stream, Parquet or CSV.
+
+    GET /api/q1/export?format=arrow|parquet|csv&service_id=&date=&route_type=&limit=
+
+The rows behind each answer are streamed in record batches of EXPORT_BATCH_ROWS
+without going through Python dicts or JSON: from DuckDB over the Parquet snapshots
+when they exist, else from a server-side MySQL cursor. Each batch is encoded and sent
+as soon as it arrives (one Parquet row group per batch), so server memory stays flat
+however large the export, and `pyarrow.ipc.open_stream` / `pandas.read_parquet` load
+the result without re-parsing. The default limit is all rows.
+
+Q1 and Q3 (`q3_clusters` for the walking clusters) export the rows the JSON endpoint
+lists. Q2 exports one row per route and service and Q4 one per route, service and hour;
+there a limit keeps the top routes as ranked by the JSON endpoint.
+"""
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from . import duckdb_backend, sql_utils
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "65536"))
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'csv': ('text/csv', 'csv'),
+}
+
+_STOP_FIELDS = [('stop_id', pa.string()), ('stop_code', pa.string()), ('stop_name', pa.string()),
+                ('stop_lat', pa.float64()), ('stop_lon', pa.float64())]
+
+# One schema per export whatever the backend, so DuckDB and MySQL files are interchangeable
+SCHEMAS = {
+    'q1': pa.schema(_STOP_FIELDS + [('total_trip_events', pa.int64()), ('num_unique_routes', pa.int64())]),
+    'q2': pa.schema([('route', pa.string()), ('route_short', pa.string()), ('service_id', pa.string()),
+                     ('total_trips', pa.int64()), ('avg_trip_distance_km', pa.float64()),
+                     ('avg_duration_min', pa.float64()), ('duration_stddev_min', pa.float64()),
+                     ('avg_speed_kmh', pa.float64())]),
+    'q3': pa.schema(_STOP_FIELDS + [('num_unique_routes', pa.int64())]),
+    'q3_clusters': pa.schema(_STOP_FIELDS + [('num_unique_routes', pa.int64()), ('num_stops', pa.int64())]),
+    'q4': pa.schema([('route', pa.string()), ('route_short', pa.string()), ('service_id', pa.string()),
+                     ('hour_of_day', pa.int64()), ('trips_per_hour', pa.int64())]),
+}
+
+
+def duckdb_batches(query: str, service_id: Any, limit_param: Optional[str],
+                   route_type: Optional[str] = None) -> Iterator[pa.RecordBatch]:
+    """Record batches of an export from the Parquet snapshots."""
+    params: Dict[str, Any] = {}
+    sql = duckdb_backend.export_sql(query, service_id, limit_param, route_type, params)
+    cur = duckdb_backend._get_db().cursor()
+    try:
+        result = cur.execute(sql, params) if params else cur.execute(sql)
+        # to_arrow_reader replaces fetch_record_batch in newer DuckDB releases
+        reader = getattr(result, 'to_arrow_reader', None) or result.fetch_record_batch
+        yield from reader(EXPORT_BATCH_ROWS)
+    finally:
+        cur.close()
+
+
+def mysql_batches(engine: Any, query: str, service_id: Any, limit_param: Optional[str],
+                  timeout_ms: Optional[int] = None) -> Iterator[pa.RecordBatch]:
+    """Record batches of an export from a server-side MySQL cursor."""
+    sql, params = sql_utils.export_statement(query, service_id, limit_param)
+    with engine.connect() as conn:
+        conn = conn.execution_options(statement_timeout_ms=timeout_ms, stream_results=True,
+                                      max_row_buffer=EXPORT_BATCH_ROWS)
+        result = conn.execute(sql, params)
+        columns = list(result.keys())
+        for rows in result.partitions(EXPORT_BATCH_ROWS):
+            yield pa.RecordBatch.from_arrays([pa.array(values) for values in zip(*rows)], names=columns)
+
+
+class _Chunks:
+    """Write-only file object handing back what the writer produced since the last drain."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+_WRITERS: Dict[str, Callable[[Any, pa.Schema], Any]] = {
+    'arrow': lambda sink, schema: pa.ipc.new_stream(sink, schema),
+    'parquet': lambda sink, schema: pq.ParquetWriter(sink, schema, compression='zstd'),
+    'csv': lambda sink, schema: pa_csv.CSVWriter(sink, schema),
+}
+
+
+def encode(batches: Iterable[pa.RecordBatch], schema: pa.Schema, fmt: str) -> Iterator[bytes]:
+    """The bytes of `batches` in format `fmt`, yielded batch by batch."""
+    sink = _Chunks()
+    writer = _WRITERS[fmt](sink, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch.cast(schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -1,36 +1,103 @@
 import os
-from typing import List
+import sys
+from typing import List, Optional
 
 import pandas as pd
 from sqlalchemy import text
 
-from .sql_utils import get_engine, ensure_hourly_frequency_view, _q2_trip_stats_cte
+from .profiling import PhaseProfiler
+from .sql_utils import COMPACT_SCHEMA, HOURLY_VIEW, get_engine, ensure_hourly_frequency_view, _q2_trip_stats_cte
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
+# The statements behind the CSVs; {where} is the service filter or empty for the whole
+# week (service_id 4). SQL.query_plans explains them alongside the API's queries.
+Q1_SQL = (
+    "SELECT st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
+    "COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_id) AS num_unique_routes, :sid AS service_id\n"
+    "FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id JOIN stops s ON s.stop_id = st.stop_id\n"
+    "{where}\n"
+    "GROUP BY st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
+)
+Q1_SERVICE_WHERE = "WHERE t.service_id = :sid"
+
+Q3_SQL = (
+    "WITH UniqueStopRoutes AS (\n"
+    "  SELECT DISTINCT st.stop_id, t.route_id\n"
+    "  FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id\n"
+    "{where}"
+    ")\n"
+    "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, COUNT(USR.route_id) AS num_unique_routes, :sid AS service_id\n"
+    "FROM stops s JOIN UniqueStopRoutes USR ON USR.stop_id = s.stop_id\n"
+    "GROUP BY s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
+    "HAVING num_unique_routes >= 2\n"
+    "ORDER BY num_unique_routes DESC\n"
+)
+Q3_SERVICE_WHERE = "  WHERE t.service_id = :sid\n"
+
+# The same statements over the integer-keyed tables (MYSQL_COMPACT_SCHEMA)
+if COMPACT_SCHEMA:
+    Q1_SQL = (
+        "SELECT sk.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
+        "c.total_trip_events, c.num_unique_routes, :sid AS service_id\n"
+        "FROM (SELECT st.stop_key, COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_key) AS num_unique_routes\n"
+        "      FROM stop_times_compact st JOIN trip_keys t ON t.trip_key = st.trip_key\n"
+        "{where}\n"
+        "      GROUP BY st.stop_key) c\n"
+        "JOIN stop_keys sk ON sk.stop_key = c.stop_key JOIN stops s ON s.stop_id = sk.stop_id\n"
+    )
+    Q1_SERVICE_WHERE = "      WHERE t.service_key = (SELECT service_key FROM service_keys WHERE service_id = :sid)"
+
+    Q3_SQL = Q3_SQL.replace(
+        "  SELECT DISTINCT st.stop_id, t.route_id\n"
+        "  FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id\n"
+        "{where}",
+        "  SELECT sk.stop_id, rk.route_id\n"
+        "  FROM (SELECT DISTINCT st.stop_key, t.route_key\n"
+        "        FROM stop_times_compact st JOIN trip_keys t ON t.trip_key = st.trip_key\n"
+        "{where}"
+        "       ) u\n"
+        "  JOIN stop_keys sk ON sk.stop_key = u.stop_key JOIN route_keys rk ON rk.route_key = u.route_key\n",
+    )
+    Q3_SERVICE_WHERE = "        WHERE t.service_key = (SELECT service_key FROM service_keys WHERE service_id = :sid)\n"
+
+Q2_SQL = (
+    _q2_trip_stats_cte()
+    + "SELECT r.route_long_name, r.route_short_name, ts.service_id,\n"
+    "       COUNT(*) AS total_trips,\n"
+    "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+    "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+    "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+    "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+    "FROM trip_stats ts JOIN routes r ON r.route_id = ts.route_id\n"
+    "GROUP BY r.route_long_name, r.route_short_name, ts.service_id\n"
+)
+
+Q4_SQL = (
+    "SELECT r.route_long_name, r.route_short_name, vhf.service_id, vhf.hour_of_day, vhf.trips_per_hour\n"
+    f"FROM {HOURLY_VIEW} vhf JOIN routes r ON r.route_id = vhf.route_id\n"
+)
+
 
 def _ensure_data_dir() -> None:
     os.makedirs(DATA_DIR, exist_ok=True)
 
 
+def _service_ids(conn) -> List[str]:
+    return [str(sid) for sid in conn.execute(text("SELECT DISTINCT service_id FROM trips ORDER BY service_id")).scalars()]
+
+
 def generate_q1(engine) -> None:
-    # service 1/2/3 and all (4)
+    # each service and all (4)
     frames: List[pd.DataFrame] = []
     with engine.begin() as conn:
-        base = (
-            "SELECT st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
-            "COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_id) AS num_unique_routes, :sid AS service_id\n"
-            "FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id JOIN stops s ON s.stop_id = st.stop_id\n"
-            "{where}\n"
-            "GROUP BY st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
-        )
-        for sid in ['1', '2', '3']:
-            sql = text(base.format(where="WHERE t.service_id = :sid"))
+        for sid in _service_ids(conn):
+            sql = text(Q1_SQL.format(where=Q1_SERVICE_WHERE))
             df = pd.read_sql(sql, conn, params={"sid": sid})
             frames.append(df)
         # Whole week (4) computed without service filter
-        sql_all = text(base.format(where=""))
+        sql_all = text(Q1_SQL.format(where=""))
         df_all = pd.read_sql(sql_all, conn, params={"sid": '4'})
         frames.append(df_all)
     out = pd.concat(frames, ignore_index=True)
@@ -38,38 +105,17 @@ def generate_q1(engine) -> None:
 
 
 def generate_q3(engine) -> None:
-    # service 1/2/3 and all (4)
+    # each service and all (4)
     frames: List[pd.DataFrame] = []
     with engine.begin() as conn:
         # UniqueStopRoutes CTE with optional service filter
-        for sid in ['1', '2', '3']:
-            sql = text(
-                "WITH UniqueStopRoutes AS (\n"
-                "  SELECT DISTINCT st.stop_id, t.route_id\n"
-                "  FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id\n"
-                "  WHERE t.service_id = :sid\n"
-                ")\n"
-                "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, COUNT(USR.route_id) AS num_unique_routes, :sid AS service_id\n"
-                "FROM stops s JOIN UniqueStopRoutes USR ON USR.stop_id = s.stop_id\n"
-                "GROUP BY s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
-                "HAVING num_unique_routes >= 2\n"
-                "ORDER BY num_unique_routes DESC\n"
-            )
+        for sid in _service_ids(conn):
+            sql = text(Q3_SQL.format(where=Q3_SERVICE_WHERE))
             df = pd.read_sql(sql, conn, params={"sid": sid})
             frames.append(df)
         # Whole week (4) uses all trips
-        sql_all = text(
-            "WITH UniqueStopRoutes AS (\n"
-            "  SELECT DISTINCT st.stop_id, t.route_id\n"
-            "  FROM stop_times st JOIN trips t ON t.trip_id = st.trip_id\n"
-            ")\n"
-            "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, COUNT(USR.route_id) AS num_unique_routes, '4' AS service_id\n"
-            "FROM stops s JOIN UniqueStopRoutes USR ON USR.stop_id = s.stop_id\n"
-            "GROUP BY s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon\n"
-            "HAVING num_unique_routes >= 2\n"
-            "ORDER BY num_unique_routes DESC\n"
-        )
-        df_all = pd.read_sql(sql_all, conn)
+        sql_all = text(Q3_SQL.format(where=""))
+        df_all = pd.read_sql(sql_all, conn, params={"sid": '4'})
         frames.append(df_all)
     out = pd.concat(frames, ignore_index=True)
     out.to_csv(os.path.join(DATA_DIR, 'q3_transfer_points.csv'), index=False)
@@ -78,20 +124,7 @@ def generate_q3(engine) -> None:
 def generate_q2(engine) -> None:
     # per route per service and global (4)
     with engine.begin() as conn:
-        cte = _q2_trip_stats_cte()
-        sql = text(
-            cte
-            + (
-                "SELECT r.route_long_name, r.route_short_name, ts.service_id,\n"
-                "       COUNT(*) AS total_trips,\n"
-                "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
-                "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
-                "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
-                "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
-                "FROM trip_stats ts JOIN routes r ON r.route_id = ts.route_id\n"
-                "GROUP BY r.route_long_name, r.route_short_name, ts.service_id\n"
-            )
-        )
+        sql = text(Q2_SQL)
         df = pd.read_sql(sql, conn)
         # Global (4) weighted by total_trips across services
         grouped = df.groupby(["route_long_name", "route_short_name"], as_index=False).apply(
@@ -111,10 +144,7 @@ def generate_q2(engine) -> None:
 def generate_q4(engine) -> None:
     ensure_hourly_frequency_view(engine)
     with engine.begin() as conn:
-        sql = text(
-            "SELECT r.route_long_name, r.route_short_name, vhf.service_id, vhf.hour_of_day, vhf.trips_per_hour\n"
-            "FROM vw_hourly_frequency vhf JOIN routes r ON r.route_id = vhf.route_id\n"
-        )
+        sql = text(Q4_SQL)
         df = pd.read_sql(sql, conn)
         # Create '4' rows summing across service_ids
         summed = (
@@ -125,17 +155,25 @@ def generate_q4(engine) -> None:
         out.to_csv(os.path.join(DATA_DIR, 'q4_hourly_frequency.csv'), index=False)
 
 
-def main() -> None:
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write the Q1–Q4 CSVs of the CSV backend from MySQL")
+    parser.add_argument("--profile", action="store_true", help="cProfile each query's phase into PROFILE_DIR")
+    args = parser.parse_args(argv)
+
+    phases = PhaseProfiler("generate_csv", enabled=args.profile)
     _ensure_data_dir()
     engine = get_engine()
-    generate_q1(engine)
-    generate_q2(engine)
-    generate_q3(engine)
-    generate_q4(engine)
+    for name, generate in (("q1", generate_q1), ("q2", generate_q2), ("q3", generate_q3), ("q4", generate_q4)):
+        with phases.phase(name):
+            generate(engine)
     print(f"CSV files written to {DATA_DIR}")
+    phases.finish()
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 
 
@@ -1,27 +1,27 @@
 -- ----------------------------------------------------------------------
 -- 1. CORE RELATIONAL INDEXES (Critical for performance)
 -- ----------------------------------------------------------------------
+-- InnoDB appends the primary key to every secondary index: trips indexes end in
+-- trip_id and stop_times indexes in (trip_id, stop_sequence). The primary key
+-- (trip_id, stop_sequence) already serves stop_times lookups by trip_id, and
+-- `transit schema.sql` indexes trips.route_id and stop_times.stop_id.
+-- python -m SQL.query_plans apply creates these and drops indexes they make redundant.
 
--- trips table: Index on Foreign Key field connecting to routes
-CREATE INDEX ix_trips_route_id ON trips (route_id);
+-- trips table: service filter -> route and trip without reading the rows (Q1-Q4)
+-- Also the index behind the service_id foreign key
+CREATE INDEX ix_trips_service_route ON trips (service_id, route_id);
 
--- trips table: Index on Foreign Key field connecting to calendar
-CREATE INDEX ix_trips_service_id ON trips (service_id);
-
--- stop_times table: Index on Foreign Key field connecting to trips (Essential for all joins)
-CREATE INDEX ix_stop_times_trip_id ON stop_times (trip_id);
-
--- stop_times table: Index on Foreign Key field connecting to stops (Essential for Busiest Stops count)
-CREATE INDEX ix_stop_times_stop_id ON stop_times (stop_id);
+-- stop_times table: trip -> stop, covering for the Q1/Q3 joins driven from trips
+CREATE INDEX ix_st_trip_stop ON stop_times (trip_id, stop_id);
 
 
 -- ----------------------------------------------------------------------
 -- 2. AUXILIARY INDEXES (For common analytical queries)
 -- ----------------------------------------------------------------------
 
--- stop_times table: Composite index on (trip_id, departure_time) 
--- Supports fast lookups for MIN/MAX departure times for Average Trip Duration query
-CREATE INDEX ix_st_trip_dep_time ON stop_times (trip_id, departure_time);
+-- stop_times table: covering index for the per-trip MIN/MAX of the Q2 trip_stats CTE
+-- and the hour of each departure in vw_hourly_frequency (Q4)
+CREATE INDEX ix_st_trip_times ON stop_times (trip_id, departure_time, arrival_time, shape_dist_traveled);
 
 -- stops table: Index on stop_name to potentially speed up GROUP BY and result display
 CREATE INDEX ix_stops_name ON stops (stop_name);
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""Isochrones: every stop reachable from an origin within N minutes, for one origin or hundreds.
+
+One-to-all scans reuse the journey planner's connection arrays. For batches, the
+timetable is copied once into a shared-memory block that pool workers map read-only.
+Each worker writes its rows of the (origins x stops) arrival matrix straight into a
+second shared block, so only origin indices cross the process boundary.
+
+    python -m SQL.isochrones batch --top 500 --depart 08:00 --minutes 60 --out hubs.npz
+    python -m SQL.isochrones geojson <stop_id> --depart 08:00 --bands 30 45 60
+"""
+import math
+import os
+import sys
+import time
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .journey_planner import (
+    UNREACHED,
+    Scan,
+    Timetable,
+    _stop_ref,
+    format_clock,
+    get_timetable,
+    parse_clock,
+    stop_index,
+)
+from .numpy_engine import GTFSStore, get_store
+from .sql_utils import ServiceFilter, service_label
+
+
+WALK_SPEED_MPS = float(os.getenv("ISOCHRONE_WALK_SPEED_MPS", "1.3"))
+# Contours extend this far on foot around every reached stop
+WALK_RADIUS_M = float(os.getenv("ISOCHRONE_WALK_RADIUS_M", "500"))
+CELL_M = float(os.getenv("ISOCHRONE_CELL_M", "200"))
+MAX_MINUTES = int(os.getenv("ISOCHRONE_MAX_MINUTES", "180"))
+DEFAULT_BANDS = (30, 45, 60)
+
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
+
+
+def arrivals_from(tt: Timetable, origin: int, depart: int, max_minutes: int) -> np.ndarray:
+    """Earliest arrival (seconds after midnight) at every stop, UNREACHED beyond the horizon."""
+    until = depart + max_minutes * 60
+    arrival = Scan(tt, origin, depart).run(until=until).arrival
+    return np.where(arrival <= until, arrival, UNREACHED).astype(np.int32)
+
+
+# --- Shared-memory batches ---
+
+class SharedArrays:
+    """Named arrays packed into one shared-memory block; `spec` lets another process map them."""
+
+    ALIGN = 64
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        layout, offset = [], 0
+        for name, arr in arrays.items():
+            layout.append((name, arr.dtype.str, arr.shape, offset))
+            offset += -(-arr.nbytes // self.ALIGN) * self.ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.spec = {"name": self.shm.name, "layout": layout}
+        self.arrays = self._view(self.shm, layout)
+        for name, arr in arrays.items():
+            self.arrays[name][...] = arr
+
+    @staticmethod
+    def _view(shm: shared_memory.SharedMemory, layout: List[Tuple]) -> Dict[str, np.ndarray]:
+        return {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for name, dtype, shape, offset in layout
+        }
+
+    @classmethod
+    def attach(cls, spec: Dict[str, Any]) -> Tuple[shared_memory.SharedMemory, Dict[str, np.ndarray]]:
+        # Pool workers share the creator's resource tracker, which unlinks the block if the creator dies
+        shm = shared_memory.SharedMemory(name=spec["name"])
+        return shm, cls._view(shm, spec["layout"])
+
+    def close(self) -> None:
+        self.arrays = {}
+        self.shm.close()
+        self.shm.unlink()
+
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(tt_spec: Dict[str, Any], out_spec: Dict[str, Any], meta: Dict[str, Any]) -> None:
+    tt_shm, tt_arrays = SharedArrays.attach(tt_spec)
+    out_shm, out_arrays = SharedArrays.attach(out_spec)
+    _worker.update(
+        shms=(tt_shm, out_shm),
+        tt=Timetable.from_arrays(tt_arrays, meta["service_id"], meta["n_stops"], meta["n_trips"]),
+        out=out_arrays["arrival"],
+    )
+
+
+def _scan_rows(task: Tuple[List[int], List[int], int, int]) -> int:
+    rows, origins, depart, max_minutes = task
+    for row, origin in zip(rows, origins):
+        _worker["out"][row] = arrivals_from(_worker["tt"], origin, depart, max_minutes)
+    return len(rows)
+
+
+def batch_arrivals(tt: Timetable, origins: Sequence[int], depart: int, max_minutes: int,
+                   workers: Optional[int] = None, chunk_size: int = 8) -> np.ndarray:
+    """(len(origins), n_stops) int32 arrival matrix, computed across `workers` processes."""
+    workers = workers or os.cpu_count() or 1
+    origins = [int(o) for o in origins]
+    if workers <= 1 or len(origins) <= 1:
+        return np.stack([arrivals_from(tt, o, depart, max_minutes) for o in origins]) if origins \
+            else np.empty((0, tt.n_stops), dtype=np.int32)
+
+    shared_tt = SharedArrays(tt.to_arrays())
+    shared_out = SharedArrays({"arrival": np.empty((len(origins), tt.n_stops), dtype=np.int32)})
+    try:
+        meta = {"service_id": tt.service_id, "n_stops": tt.n_stops, "n_trips": tt.n_trips}
+        tasks = [
+            (list(range(i, min(i + chunk_size, len(origins)))), origins[i:i + chunk_size], depart, max_minutes)
+            for i in range(0, len(origins), chunk_size)
+        ]
+        with get_context().Pool(workers, initializer=_init_worker,
+                                initargs=(shared_tt.spec, shared_out.spec, meta)) as pool:
+            for _ in pool.imap_unordered(_scan_rows, tasks):
+                pass
+        return shared_out.arrays["arrival"].copy()
+    finally:
+        shared_tt.close()
+        shared_out.close()
+
+
+# --- GeoJSON ---
+
+def stop_items(store: GTFSStore, arrival: np.ndarray, depart: int) -> List[Dict[str, Any]]:
+    """Reached stops with arrival clock time and minutes of travel, soonest first."""
+    reached = np.flatnonzero(arrival != UNREACHED)
+    reached = reached[np.argsort(arrival[reached], kind='stable')]
+    return [
+        {**_stop_ref(store, int(s)), "arrival": format_clock(int(arrival[s])),
+         "minutes": round((int(arrival[s]) - depart) / 60.0, 1)}
+        for s in reached
+    ]
+
+
+def _walk_kernel() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    reach = int(math.ceil(WALK_RADIUS_M / CELL_M))
+    dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+    dist = np.hypot(dx, dy).ravel() * CELL_M
+    keep = dist <= WALK_RADIUS_M
+    return dx.ravel()[keep], dy.ravel()[keep], (dist[keep] / WALK_SPEED_MPS).astype(np.int64)
+
+
+def _cell_rectangles(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Cover the True cells with rectangles: horizontal runs, stacked where rows repeat the same run.
+
+    Returns (first_col, end_col, first_row, end_row), ends exclusive.
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    order = np.lexsort((rows, ends, starts))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = (starts[1:] != starts[:-1]) | (ends[1:] != ends[:-1]) | (rows[1:] != rows[:-1] + 1)
+    first = np.flatnonzero(new)
+    last = np.r_[first[1:], len(rows)] - 1
+    return starts[first], ends[first], rows[first], rows[last] + 1
+
+
+def contours(store: GTFSStore, arrival: np.ndarray, depart: int,
+             bands: Sequence[int] = DEFAULT_BANDS) -> Dict[str, Any]:
+    """GeoJSON FeatureCollection with one MultiPolygon per band (largest first, for layering).
+
+    Travel time is rasterised onto a CELL_M grid: a cell counts as reached within a band
+    when some reached stop lies within WALK_RADIUS_M and the remaining minutes cover the
+    walk. Each band is the union of its cells, merged into rectangles.
+    """
+    bands = sorted({int(b) for b in bands}, reverse=True)
+    reached = np.flatnonzero((arrival != UNREACHED) & ~np.isnan(store.stop_lat) & ~np.isnan(store.stop_lon))
+    features: List[Dict[str, Any]] = []
+    if not len(reached) or not bands:
+        return {"type": "FeatureCollection", "features": features}
+
+    lat = np.asarray(store.stop_lat, dtype=np.float64)[reached]
+    lon = np.asarray(store.stop_lon, dtype=np.float64)[reached]
+    travel = arrival[reached].astype(np.int64) - depart
+    lon_scale = M_PER_DEG_LON * math.cos(math.radians(float(lat.mean())))
+    x, y = lon * lon_scale, lat * M_PER_DEG_LAT
+    pad = WALK_RADIUS_M + CELL_M
+    x0, y0 = x.min() - pad, y.min() - pad
+    n_cols = int((x.max() + pad - x0) // CELL_M) + 1
+    n_rows = int((y.max() + pad - y0) // CELL_M) + 1
+
+    dx, dy, walk = _walk_kernel()
+    col = ((x - x0) // CELL_M).astype(np.int64)[:, None] + dx
+    row = ((y - y0) // CELL_M).astype(np.int64)[:, None] + dy
+    grid = np.full(n_rows * n_cols, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(grid, (row * n_cols + col).ravel(), (travel[:, None] + walk).ravel())
+    grid = grid.reshape(n_rows, n_cols)
+
+    def lonlat(c: np.ndarray, r: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return np.round((x0 + c * CELL_M) / lon_scale, 6), np.round((y0 + r * CELL_M) / M_PER_DEG_LAT, 6)
+
+    for band in bands:
+        c0, c1, r0, r1 = _cell_rectangles(grid <= band * 60)
+        west, south = lonlat(c0, r0)
+        east, north = lonlat(c1, r1)
+        polygons = [
+            [[[w, s], [e, s], [e, n], [w, n], [w, s]]]
+            for w, s, e, n in zip(west.tolist(), south.tolist(), east.tolist(), north.tolist())
+        ]
+        features.append({
+            "type": "Feature",
+            "properties": {"minutes": band, "stops": int(np.count_nonzero(travel <= band * 60))},
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def isochrone(stop_id: str, depart: str, service_id: ServiceFilter, bands: Sequence[int] = DEFAULT_BANDS,
+              fmt: str = 'geojson', store: Optional[GTFSStore] = None) -> Dict[str, Any]:
+    """Contours (fmt='geojson') or reached stops (fmt='stops') for one origin.
+
+    Raises KeyError for unknown stops/services and ValueError for bad times or bands.
+    """
+    store = store or get_store()
+    index = stop_index(store)
+    if stop_id not in index:
+        raise KeyError(f"unknown stop_id {stop_id!r}")
+    if not len(store.service_codes(service_id)):
+        raise KeyError(f"unknown service_id {service_label(service_id)!r}")
+    depart_s = parse_clock(depart)
+    if not bands or not all(0 < int(b) <= MAX_MINUTES for b in bands):
+        raise ValueError(f"minutes must be between 1 and {MAX_MINUTES}")
+    tt = get_timetable(service_id, store)
+    arrival = arrivals_from(tt, index[stop_id], depart_s, max(bands))
+    if fmt == 'stops':
+        return {"origin": _stop_ref(store, index[stop_id]), "depart": format_clock(depart_s),
+                "service_id": service_label(service_id), "items": stop_items(store, arrival, depart_s)}
+    collection = contours(store, arrival, depart_s, bands)
+    collection["properties"] = {"origin": _stop_ref(store, index[stop_id]), "depart": format_clock(depart_s),
+                                "service_id": service_label(service_id)}
+    return collection
+
+
+def _top_stops(service_id: str, n: int) -> List[str]:
+    from .numpy_engine import query_q1_busiest_stops
+
+    return [row["stop_id"] for row in query_q1_busiest_stops(service_id, str(n))]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="One-to-all reachability over the NumPy timetable")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_batch = sub.add_parser("batch", help="Arrival matrix for many origins (process pool, shared memory)")
+    origins = p_batch.add_mutually_exclusive_group(required=True)
+    origins.add_argument("--stops", nargs="+", help="Origin stop_ids")
+    origins.add_argument("--top", type=int, help="The N busiest stops of the service (Q1 ranking)")
+    p_batch.add_argument("--depart", default="08:00")
+    p_batch.add_argument("--minutes", type=int, default=60)
+    p_batch.add_argument("--service", default="1")
+    p_batch.add_argument("--workers", type=int, default=None, help="Defaults to the CPU count")
+    p_batch.add_argument("--out", required=True, help=".npz with origin_ids, stop_ids and arrival seconds")
+    p_batch.add_argument("--geojson", default=None, help="Also write <dir>/<stop_id>.geojson contours")
+    p_batch.add_argument("--bands", type=int, nargs="+", default=list(DEFAULT_BANDS))
+    p_geo = sub.add_parser("geojson", help="Contours for one origin to stdout")
+    p_geo.add_argument("stop_id")
+    p_geo.add_argument("--depart", default="08:00")
+    p_geo.add_argument("--service", default="1")
+    p_geo.add_argument("--bands", type=int, nargs="+", default=list(DEFAULT_BANDS))
+    args = parser.parse_args(argv)
+
+    if args.command == "geojson":
+        print(json.dumps(isochrone(args.stop_id, args.depart, args.service, args.bands)))
+        return 0
+
+    store = get_store()
+    index = stop_index(store)
+    origin_ids = args.stops or _top_stops(args.service, args.top)
+    unknown = [s for s in origin_ids if s not in index]
+    if unknown:
+        raise SystemExit(f"Unknown stop_ids: {', '.join(unknown[:10])}")
+    depart = parse_clock(args.depart)
+    tt = get_timetable(args.service, store)
+    start = time.perf_counter()
+    arrival = batch_arrivals(tt, [index[s] for s in origin_ids], depart, args.minutes, args.workers)
+    elapsed = time.perf_counter() - start
+    np.savez_compressed(args.out, origin_ids=np.asarray(origin_ids), stop_ids=np.asarray(store.stop_ids),
+                        arrival=arrival, depart=depart)
+    print(f"{len(origin_ids)} origins x {tt.n_stops} stops in {elapsed:.1f} s -> {args.out}")
+    if args.geojson:
+        os.makedirs(args.geojson, exist_ok=True)
+        for stop_id, row in zip(origin_ids, arrival):
+            with open(os.path.join(args.geojson, f"{stop_id}.geojson"), "w") as f:
+                json.dump(contours(store, row, depart, args.bands), f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
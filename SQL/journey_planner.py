@@ -0,0 +1,438 @@
+"""Journey planning over the NumPy timetable with the Connection Scan Algorithm.
+
+Each consecutive stop pair of a trip is a connection; per service the connections are
+kept as flat int32 arrays sorted by departure, next to a CSR footpath table (stop ->
+stops within walking distance). A query scans the sorted connections in short time
+slices and settles each slice with vectorised relaxations until nothing improves, so
+the cost is a few NumPy passes per minute of travel rather than a Python-level step
+per connection.
+
+    python -m SQL.journey_planner plan <from_stop_id> <to_stop_id> 08:00 --service 1
+    python -m SQL.journey_planner bench --queries 200 --service 1
+"""
+import os
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .numpy_engine import MISSING, GTFSStore, _mysql_float, _nullable_str, get_store, stop_transfer_pairs
+from .sql_utils import ServiceFilter, service_label
+from .stop_transfers import walk_seconds
+
+
+# Connections departing within one slice are settled together
+SLICE_SECONDS = int(os.getenv("PLAN_SLICE_SECONDS", "60"))
+# Scan horizon after the requested departure
+MAX_JOURNEY_SECONDS = int(os.getenv("PLAN_MAX_JOURNEY_MINUTES", "240")) * 60
+MAX_PROFILE_MINUTES = int(os.getenv("PLAN_MAX_PROFILE_MINUTES", "180"))
+
+UNREACHED = np.iinfo(np.int32).max
+
+
+def parse_clock(text: str) -> int:
+    """'HH:MM' or 'HH:MM:SS' (hours may exceed 24, as in GTFS) -> seconds after midnight."""
+    parts = text.strip().split(':')
+    if len(parts) not in (2, 3) or not all(p.isdigit() for p in parts):
+        raise ValueError(f"expected HH:MM or HH:MM:SS, got {text!r}")
+    h, m = int(parts[0]), int(parts[1])
+    s = int(parts[2]) if len(parts) == 3 else 0
+    if m > 59 or s > 59:
+        raise ValueError(f"expected HH:MM or HH:MM:SS, got {text!r}")
+    return h * 3600 + m * 60 + s
+
+
+def format_clock(seconds: int) -> str:
+    h, rem = divmod(int(seconds), 3600)
+    return f"{h:02d}:{rem // 60:02d}:{rem % 60:02d}"
+
+
+@dataclass
+class Footpaths:
+    """Walking links in CSR form: targets[offsets[s]:offsets[s + 1]] are reachable from stop s."""
+    offsets: np.ndarray
+    targets: np.ndarray
+    seconds: np.ndarray
+
+    @classmethod
+    def empty(cls, n_stops: int) -> 'Footpaths':
+        return cls(np.zeros(n_stops + 1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+
+    @classmethod
+    def from_pairs(cls, n_stops: int, from_stop: np.ndarray, to_stop: np.ndarray, seconds: np.ndarray) -> 'Footpaths':
+        order = np.lexsort((to_stop, from_stop))
+        counts = np.bincount(from_stop, minlength=n_stops)
+        offsets = np.zeros(n_stops + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(offsets, to_stop[order].astype(np.int32), seconds[order].astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+
+def store_footpaths(store: GTFSStore) -> Footpaths:
+    """Walking links from the stop_transfers pairs (TRANSFER_RADIUS_M at WALK_SPEED_MPS)."""
+    src, dst, dist = stop_transfer_pairs(store)
+    return Footpaths.from_pairs(store.n_stops, src, dst, walk_seconds(dist))
+
+
+class Timetable:
+    """Connections of one service (or of the services running on a date), sorted by departure time."""
+
+    ARRAYS = ('dep_stop', 'arr_stop', 'dep_time', 'arr_time', 'trip', 'bounds')
+
+    def __init__(self, store: GTFSStore, service_id: ServiceFilter, footpaths: Optional[Footpaths] = None):
+        codes = store.service_codes(service_id)
+        if not len(codes):
+            raise KeyError(service_id)
+        self.store: Optional[GTFSStore] = store
+        self.service_id = service_label(service_id)
+        self.n_stops = store.n_stops
+        self.n_trips = store.n_trips
+        self.footpaths = footpaths if footpaths is not None else store_footpaths(store)
+
+        st_trip = np.asarray(store.st_trip)
+        st_stop = np.asarray(store.st_stop)
+        # Blank times between timepoints fall back to the other time at the same stop
+        st_arr = np.where(store.st_arr == MISSING, store.st_dep, store.st_arr)
+        st_dep = np.where(store.st_dep == MISSING, store.st_arr, store.st_dep)
+        trip_service = np.asarray(store.trip_service)
+
+        i = np.flatnonzero((st_trip[:-1] == st_trip[1:]) & (st_trip[:-1] >= 0))
+        j = i + 1
+        keep = np.isin(trip_service[st_trip[i]], codes) & (st_stop[i] >= 0) & (st_stop[j] >= 0)
+        keep &= (st_dep[i] != MISSING) & (st_arr[j] != MISSING) & (st_arr[j] >= st_dep[i])
+        i, j = i[keep], j[keep]
+        # Ties on departure keep trip order, so a trip's connections stay ascending by index
+        order = np.lexsort((i, st_dep[i]))
+        i, j = i[order], j[order]
+
+        self.dep_stop = st_stop[i].astype(np.int32)
+        self.arr_stop = st_stop[j].astype(np.int32)
+        self.dep_time = st_dep[i].astype(np.int32)
+        self.arr_time = st_arr[j].astype(np.int32)
+        self.trip = st_trip[i].astype(np.int32)
+        # bounds[k]:bounds[k + 1] are the connections departing in [k, k + 1) * SLICE_SECONDS
+        edges = np.arange(0, int(self.dep_time.max(initial=0)) + 2 * SLICE_SECONDS, SLICE_SECONDS, dtype=np.int32)
+        self.bounds = np.searchsorted(self.dep_time, edges, 'left')
+
+    def __len__(self) -> int:
+        return len(self.dep_time)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays.update(fp_offsets=self.footpaths.offsets, fp_targets=self.footpaths.targets,
+                      fp_seconds=self.footpaths.seconds)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], service_id: str, n_stops: int, n_trips: int) -> 'Timetable':
+        """Rebuild a scan-only timetable (no store, so no journey legs) from `to_arrays` output."""
+        tt = cls.__new__(cls)
+        tt.store = None
+        tt.service_id = str(service_id)
+        tt.n_stops = n_stops
+        tt.n_trips = n_trips
+        tt.footpaths = Footpaths(arrays['fp_offsets'], arrays['fp_targets'], arrays['fp_seconds'])
+        for name in cls.ARRAYS:
+            setattr(tt, name, arrays[name])
+        return tt
+
+
+def get_timetable(service_id: ServiceFilter, store: Optional[GTFSStore] = None) -> Timetable:
+    store = store or get_store()
+    key = f'timetable:{service_label(service_id)}'
+    if key not in store._derived:
+        store._derived[key] = Timetable(store, service_id)
+    return store._derived[key]
+
+
+def stop_index(store: GTFSStore) -> Dict[str, int]:
+    if 'stop_index' not in store._derived:
+        store._derived['stop_index'] = {str(s): i for i, s in enumerate(store.stop_ids)}
+    return store._derived['stop_index']
+
+
+def _first_per_key(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Positions holding the smallest value for each distinct key."""
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return order[first]
+
+
+class Scan:
+    """Earliest-arrival labels from one origin and departure time, with back-pointers for journeys."""
+
+    def __init__(self, tt: Timetable, origin: int, depart: int):
+        self.tt = tt
+        self.origin = origin
+        self.depart = depart
+        self.arrival = np.full(tt.n_stops, UNREACHED, dtype=np.int32)
+        self.in_conn = np.full(tt.n_stops, -1, dtype=np.int64)
+        self.walk_from = np.full(tt.n_stops, -1, dtype=np.int32)
+        self.walk_seconds = np.zeros(tt.n_stops, dtype=np.int32)
+        # Lowest reachable connection index per trip; the trip can be ridden from there on
+        self.boarded = np.full(tt.n_trips, len(tt), dtype=np.int64)
+        self.arrival[origin] = depart
+        self._walk(np.asarray([origin], dtype=np.int32), np.asarray([depart], dtype=np.int32))
+
+    def _walk(self, stops: np.ndarray, times: np.ndarray) -> None:
+        fp = self.tt.footpaths
+        if not len(fp):
+            return
+        starts = fp.offsets[stops]
+        counts = fp.offsets[stops + 1] - starts
+        total = int(counts.sum())
+        if not total:
+            return
+        src = np.repeat(np.arange(len(stops)), counts)
+        pos = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        to = fp.targets[pos]
+        at = times[src] + fp.seconds[pos]
+        better = np.flatnonzero(at < self.arrival[to])
+        if not len(better):
+            return
+        best = better[_first_per_key(to[better], at[better])]
+        to = to[best]
+        self.arrival[to] = at[best]
+        self.in_conn[to] = -1
+        self.walk_from[to] = stops[src[best]]
+        self.walk_seconds[to] = fp.seconds[pos[best]]
+
+    def _settle(self, lo: int, hi: int) -> None:
+        tt = self.tt
+        dep_stop, arr_stop = tt.dep_stop[lo:hi], tt.arr_stop[lo:hi]
+        dep_time, arr_time, trip = tt.dep_time[lo:hi], tt.arr_time[lo:hi], tt.trip[lo:hi]
+        conn = np.arange(lo, hi, dtype=np.int64)
+        while True:
+            usable = np.flatnonzero((self.arrival[dep_stop] <= dep_time) | (self.boarded[trip] <= conn))
+            if not len(usable):
+                return
+            changed = False
+            c, t = conn[usable], trip[usable]
+            boards = c < self.boarded[t]
+            if boards.any():
+                np.minimum.at(self.boarded, t[boards], c[boards])
+                changed = True
+            stops, times = arr_stop[usable], arr_time[usable]
+            better = np.flatnonzero(times < self.arrival[stops])
+            if len(better):
+                best = better[_first_per_key(stops[better], times[better])]
+                stops, times = stops[best], times[best]
+                self.arrival[stops] = times
+                self.in_conn[stops] = c[best]
+                self.walk_from[stops] = -1
+                self._walk(stops, times)
+                changed = True
+            if not changed:
+                return
+
+    def run(self, target: Optional[int] = None, until: Optional[int] = None) -> 'Scan':
+        """Scan connections departing from `depart` up to `until` (or until `target` is settled)."""
+        tt = self.tt
+        until = self.depart + MAX_JOURNEY_SECONDS if until is None else until
+        lo = int(np.searchsorted(tt.dep_time, np.int32(self.depart), 'left'))
+        for k in range(self.depart // SLICE_SECONDS, len(tt.bounds) - 1):
+            hi = int(tt.bounds[k + 1])
+            if hi <= lo:
+                continue
+            start = int(tt.dep_time[lo])
+            if start > until or (target is not None and start >= self.arrival[target]):
+                break
+            self._settle(lo, hi)
+            lo = hi
+        return self
+
+    def journey(self, target: int) -> Optional[List[Dict[str, Any]]]:
+        """Legs from the origin to `target` by following the back-pointers; None if unreachable."""
+        if self.arrival[target] == UNREACHED:
+            return None
+        tt, store = self.tt, self.tt.store
+        legs: List[Dict[str, Any]] = []
+        stop = target
+        for _ in range(tt.n_stops):
+            if stop == self.origin:
+                legs.reverse()
+                return legs
+            if self.walk_from[stop] >= 0:
+                start = int(self.walk_from[stop])
+                arrive = int(self.arrival[stop])
+                legs.append({
+                    "mode": "walk",
+                    "from": _stop_ref(store, start),
+                    "to": _stop_ref(store, stop),
+                    "departure": format_clock(arrive - int(self.walk_seconds[stop])),
+                    "arrival": format_clock(arrive),
+                    "duration_min": round(int(self.walk_seconds[stop]) / 60.0, 1),
+                })
+                stop = start
+                continue
+            alight = int(self.in_conn[stop])
+            trip = int(tt.trip[alight])
+            board = int(self.boarded[trip])
+            route = int(store.trip_route[trip])
+            legs.append({
+                "mode": "transit",
+                "trip_id": str(store.trip_ids[trip]),
+                "route_id": None if route == MISSING else str(store.route_ids[route]),
+                "route_short_name": None if route == MISSING else _nullable_str(str(store.route_short_names[route])),
+                "route_long_name": None if route == MISSING else _nullable_str(str(store.route_long_names[route])),
+                "trip_headsign": _nullable_str(str(store.trip_headsigns[trip])),
+                "from": _stop_ref(store, int(tt.dep_stop[board])),
+                "to": _stop_ref(store, stop),
+                "departure": format_clock(int(tt.dep_time[board])),
+                "arrival": format_clock(int(tt.arr_time[alight])),
+                "num_stops": int(np.count_nonzero(tt.trip[board:alight + 1] == trip)),
+            })
+            stop = int(tt.dep_stop[board])
+        raise RuntimeError("journey back-pointers do not lead to the origin")
+
+
+def _stop_ref(store: GTFSStore, stop: int) -> Dict[str, Any]:
+    return {
+        "stop_id": str(store.stop_ids[stop]),
+        "stop_name": _nullable_str(str(store.stop_names[stop])),
+        "stop_lat": _mysql_float(store.stop_lat[stop]),
+        "stop_lon": _mysql_float(store.stop_lon[stop]),
+    }
+
+
+def _summarize(legs: List[Dict[str, Any]], depart: int, arrival: int) -> Dict[str, Any]:
+    # A journey leaves with its first leg; a pure wait at the origin is not travel time
+    leaves = parse_clock(legs[0]["departure"]) if legs else depart
+    return {
+        "departure": format_clock(leaves),
+        "arrival": format_clock(arrival),
+        "duration_min": round((arrival - leaves) / 60.0, 1),
+        "transfers": max(sum(1 for leg in legs if leg["mode"] == "transit") - 1, 0),
+        "legs": legs,
+    }
+
+
+def earliest_arrival(tt: Timetable, origin: int, target: int, depart: int) -> Optional[Dict[str, Any]]:
+    scan = Scan(tt, origin, depart).run(target=target)
+    legs = scan.journey(target)
+    return None if legs is None else _summarize(legs, depart, int(scan.arrival[target]))
+
+
+def _origin_departures(tt: Timetable, origin: int, start: int, end: int) -> np.ndarray:
+    """Times one could leave the origin in [start, end] and catch a connection, directly or on foot."""
+    fp = tt.footpaths
+    near = fp.targets[fp.offsets[origin]:fp.offsets[origin + 1]]
+    walk = fp.seconds[fp.offsets[origin]:fp.offsets[origin + 1]]
+    lead = np.zeros(tt.n_stops, dtype=np.int32)
+    is_near = np.zeros(tt.n_stops, dtype=bool)
+    is_near[near] = True
+    lead[near] = walk
+    is_near[origin] = True
+    lead[origin] = 0
+    lo = int(np.searchsorted(tt.dep_time, np.int32(start), 'left'))
+    hi = int(np.searchsorted(tt.dep_time, np.int32(end + int(walk.max(initial=0))), 'right'))
+    stops = tt.dep_stop[lo:hi]
+    hit = is_near[stops]
+    leave = tt.dep_time[lo:hi][hit] - lead[stops[hit]]
+    return np.unique(leave[(leave >= start) & (leave <= end)])
+
+
+def profile(tt: Timetable, origin: int, target: int, depart: int, window_min: int) -> List[Dict[str, Any]]:
+    """Pareto-optimal journeys (leave later or arrive earlier) leaving within `window_min` minutes.
+
+    Departures are scanned latest first; a journey is kept only if it arrives strictly
+    before every journey that leaves after it.
+    """
+    journeys: List[Dict[str, Any]] = []
+    best_arrival = UNREACHED
+    for leave in _origin_departures(tt, origin, depart, depart + window_min * 60)[::-1]:
+        scan = Scan(tt, origin, int(leave)).run(target=target, until=min(best_arrival, int(leave) + MAX_JOURNEY_SECONDS))
+        arrival = int(scan.arrival[target])
+        if arrival >= best_arrival:
+            continue
+        best_arrival = arrival
+        journeys.append(_summarize(scan.journey(target), int(leave), arrival))
+    journeys.reverse()
+    return journeys
+
+
+def plan(from_stop: str, to_stop: str, depart: str, service_id: ServiceFilter,
+         window_min: Optional[int] = None, store: Optional[GTFSStore] = None) -> Dict[str, Any]:
+    """Journeys between two stop_ids; raises KeyError for unknown stops/services, ValueError for bad times."""
+    store = store or get_store()
+    index = stop_index(store)
+    for stop_id in (from_stop, to_stop):
+        if stop_id not in index:
+            raise KeyError(f"unknown stop_id {stop_id!r}")
+    if not len(store.service_codes(service_id)):
+        raise KeyError(f"unknown service_id {service_label(service_id)!r}")
+    depart_s = parse_clock(depart)
+    if window_min is not None and not 0 <= window_min <= MAX_PROFILE_MINUTES:
+        raise ValueError(f"window must be between 0 and {MAX_PROFILE_MINUTES} minutes")
+    tt = get_timetable(service_id, store)
+    origin, target = index[from_stop], index[to_stop]
+    if window_min is None:
+        best = earliest_arrival(tt, origin, target, depart_s)
+        journeys = [] if best is None else [best]
+    else:
+        journeys = profile(tt, origin, target, depart_s, window_min)
+    return {
+        "from": _stop_ref(store, origin),
+        "to": _stop_ref(store, target),
+        "service_id": service_label(service_id),
+        "depart": format_clock(depart_s),
+        "window_min": window_min,
+        "journeys": journeys,
+    }
+
+
+def _bench(service_id: str, queries: int, seed: int) -> Tuple[float, List[float]]:
+    import time
+
+    store = get_store()
+    start = time.perf_counter()
+    tt = get_timetable(service_id, store)
+    build = time.perf_counter() - start
+    rng = np.random.default_rng(seed)
+    served = np.unique(np.concatenate([tt.dep_stop, tt.arr_stop]))
+    timings = []
+    for _ in range(queries):
+        origin, target = rng.choice(served, 2, replace=False)
+        depart = int(rng.integers(6 * 3600, 20 * 3600))
+        start = time.perf_counter()
+        earliest_arrival(tt, int(origin), int(target), depart)
+        timings.append(time.perf_counter() - start)
+    return build, timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Plan journeys over the NumPy timetable")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_plan = sub.add_parser("plan", help="Earliest arrival (or a profile with --window) between two stop_ids")
+    p_plan.add_argument("from_stop")
+    p_plan.add_argument("to_stop")
+    p_plan.add_argument("depart", help="HH:MM[:SS]")
+    p_plan.add_argument("--service", default="1")
+    p_plan.add_argument("--window", type=int, default=None, help="Profile over this many minutes")
+    p_bench = sub.add_parser("bench", help="Time random earliest-arrival queries")
+    p_bench.add_argument("--service", default="1")
+    p_bench.add_argument("--queries", type=int, default=200)
+    p_bench.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        print(json.dumps(plan(args.from_stop, args.to_stop, args.depart, args.service, args.window), indent=2))
+        return 0
+    build, timings = _bench(args.service, args.queries, args.seed)
+    ms = np.sort(np.asarray(timings)) * 1000
+    print(f"timetable build {build:.2f} s, {len(get_timetable(args.service)):,} connections")
+    print(f"{len(ms)} queries: p50 {np.percentile(ms, 50):.1f} ms  p95 {np.percentile(ms, 95):.1f} ms  "
+          f"max {ms[-1]:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
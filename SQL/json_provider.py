@@ -0,0 +1,213 @@
+"""Flask JSON provider that encodes responses in one orjson pass.
+
+Output is byte-for-byte what Flask's default provider produces for the same payload
+after `to_json_safe` (sorted keys, ASCII-only, compact separators). The few inputs
+orjson formats differently (exponent floats such as 1e+16 / 1e-05, ints beyond 64
+bits) fall back to the stdlib encoder, as does pretty-printed debug output.
+"""
+import json
+import logging
+import math
+import re
+import sys
+from typing import Any, Iterable, Iterator, List, Optional
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: without it every response takes the stdlib path
+    orjson = None
+
+logger = logging.getLogger('transit.stream')
+
+
+# Python writes 1e+16 / 1e-05 where orjson writes 1e16 / 0.00001. A literal-first
+# pattern keeps the scan fast; the digit before the 'e' is checked per match.
+_EXPONENT_RE = re.compile(rb'e[-0-9]')
+_DIGITS = frozenset(b'0123456789')
+# ensure_ascii escapes everything from DEL upwards
+_NON_ASCII_RE = re.compile('[\x7f-\U0010ffff]')
+
+_ORJSON_OPTIONS = (
+    orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    if orjson is not None else 0
+)
+
+
+def _numpy() -> Any:
+    """numpy, if something has imported it; before that no numpy scalar can exist, so the
+    provider never has to import it itself (fast app start-up)."""
+    return sys.modules.get('numpy')
+
+
+def to_json_safe(obj: Any) -> Any:
+    """Recursively convert numpy/pandas scalars to native Python types for JSON.
+
+    Non-finite floats (NaN/inf, numpy or not) become None so the output stays valid JSON.
+    """
+    if isinstance(obj, dict):
+        return {k: to_json_safe(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_json_safe(v) for v in obj]
+    np = _numpy()
+    if np is not None:
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.bool_):
+            return bool(obj)
+        if isinstance(obj, np.floating):
+            obj = float(obj)
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    return obj
+
+
+def _escape_char(match: "re.Match[str]") -> str:
+    cp = ord(match.group())
+    if cp < 0x10000:
+        return '\\u%04x' % cp
+    cp -= 0x10000
+    return '\\u%04x\\u%04x' % (0xd800 | (cp >> 10), 0xdc00 | (cp & 0x3ff))
+
+
+def _orjson_default(obj: Any) -> Any:
+    np = _numpy()
+    if np is not None:
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.bool_):
+            return bool(obj)
+        if isinstance(obj, np.floating):
+            value = float(obj)
+            return value if math.isfinite(value) else None
+    return DefaultJSONProvider.default(obj)
+
+
+def fast_dumps(obj: Any) -> Optional[str]:
+    """Compact, key-sorted, ASCII-escaped JSON via orjson; None when the stdlib must be used."""
+    if orjson is None:
+        return None
+    try:
+        raw = orjson.dumps(obj, default=_orjson_default, option=_ORJSON_OPTIONS)
+    except TypeError:  # orjson.JSONEncodeError: non-str keys, >64-bit ints, unknown types
+        return None
+    if b'0.0000' in raw or any(raw[m.start() - 1] in _DIGITS for m in _EXPONENT_RE.finditer(raw)):
+        return None
+    text = raw.decode('utf-8')
+    if not raw.isascii() or b'\x7f' in raw:
+        text = _NON_ASCII_RE.sub(_escape_char, text)
+    return text
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Drop-in for Flask's provider: `app.json = FastJSONProvider(app)`."""
+
+    def response(self, *args: Any, **kwargs: Any) -> Any:
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(to_json_safe(obj))
+        body = fast_dumps(obj) if (self.sort_keys and self.ensure_ascii) else None
+        if body is None:
+            body = self.dumps(to_json_safe(obj), separators=(",", ":"))
+        return self._app.response_class(f"{body}\n", mimetype=self.mimetype)
+
+
+def stdlib_dumps(obj: Any) -> str:
+    """Compact stdlib encoding, i.e. what jsonify(to_json_safe(obj)) produces."""
+    return json.dumps(to_json_safe(obj), default=DefaultJSONProvider.default,
+                      ensure_ascii=True, sort_keys=True, separators=(",", ":"))
+
+
+def _dumps_row(row: Any) -> str:
+    text = fast_dumps(row)
+    return stdlib_dumps(row) if text is None else text
+
+
+def stream_items(rows: Iterable[Any], ndjson: bool = False, batch_size: int = 500) -> Iterator[str]:
+    """Encode rows incrementally as `{"items":[...]}` (same bytes as the buffered response) or NDJSON.
+
+    Rows are flushed in batches of `batch_size`. The status line is already sent when
+    `rows` fails part-way, so the error is logged and the body marks it: NDJSON ends
+    with an {"error": ...} line, JSON stops without its closing `]}` (invalid on purpose).
+    Callers fetch the first row before responding (see SQL/app.py), so connection and
+    statement errors still reach the view.
+    """
+    if not ndjson:
+        yield '{"items":['
+    sep = '\n' if ndjson else ','
+    batch: List[str] = []
+    first = True
+    try:
+        for row in rows:
+            batch.append(_dumps_row(row))
+            if len(batch) >= batch_size:
+                chunk = sep.join(batch)
+                yield (chunk + '\n') if ndjson else (chunk if first else ',' + chunk)
+                first = False
+                batch = []
+    except Exception:
+        logger.exception("Streamed response interrupted")
+        if ndjson:
+            yield ''.join(line + '\n' for line in batch) + '{"error":"Stream interrupted; the result is incomplete"}\n'
+        return
+    if batch:
+        chunk = sep.join(batch)
+        yield (chunk + '\n') if ndjson else (chunk if first else ',' + chunk)
+    if not ndjson:
+        yield ']}\n'
+
+
+def _largest_payloads() -> dict:
+    from . import duckdb_backend, numpy_engine
+
+    if duckdb_backend.has_snapshots():
+        backend = duckdb_backend
+    elif numpy_engine.has_store():
+        backend = numpy_engine
+    else:
+        raise SystemExit("Needs Parquet snapshots or the NumPy cache to build payloads")
+    payloads = {}
+    for sid in (None, '1'):
+        label = sid or '4'
+        payloads[f'q1 service={label} limit=all'] = {"items": backend.query_q1_busiest_stops(sid, 'all')}
+        payloads[f'q2 service={label} limit=all'] = backend.query_q2_avg_duration_speed(sid, 'all')
+        payloads[f'q3 service={label} limit=all'] = {"items": backend.query_q3_transfer_points(sid, 'all')}
+        payloads[f'q4 service={label} limit=all'] = backend.query_q4_hourly_frequency(sid, 'all')
+    return payloads
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Check and time the fast JSON path on the largest responses")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if orjson is None:
+        raise SystemExit("orjson is not installed")
+    mismatches = 0
+    for name, payload in _largest_payloads().items():
+        legacy = stdlib_dumps(payload)
+        fast = fast_dumps(payload)
+        if fast is None:
+            print(f"{name:<28} stdlib fallback ({len(legacy):,} bytes)")
+            continue
+        if fast != legacy:
+            mismatches += 1
+            print(f"{name:<28} MISMATCH")
+            continue
+        timings = []
+        for fn in (stdlib_dumps, fast_dumps):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                fn(payload)
+            timings.append((time.perf_counter() - start) / args.repeat * 1000)
+        print(f"{name:<28} {len(fast):>10,} bytes  walk+json {timings[0]:8.2f} ms  "
+              f"orjson {timings[1]:7.2f} ms  x{timings[0] / max(timings[1], 1e-9):5.1f}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,367 @@
+import csv
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+from .sql_utils import ensure_hourly_frequency_view, get_mysql_connection_url
+from .stop_transfers import refresh_mysql as refresh_stop_transfers
+
+
+SQL_DIR = os.path.dirname(__file__)
+SCHEMA_FILE = os.path.join(SQL_DIR, 'transit schema.sql')
+INDEX_FILE = os.path.join(SQL_DIR, 'index and view.sql')
+COMPACT_SCHEMA_FILE = os.path.join(SQL_DIR, 'compact schema.sql')
+DATASET_DIR = os.getenv("DATASET_DIR", os.path.join(os.path.dirname(SQL_DIR), 'dataset'))
+
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "4"))
+BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "10000"))
+
+# Tables in drop order (children first); loading itself runs in parallel with FK checks off.
+TABLES = ('stop_times', 'trips', 'stops', 'routes', 'calendar_dates', 'calendar')
+# Tables of 'compact schema.sql' in drop order, and how each is filled from the loaded tables.
+# Keys are handed out in id order, so ordering by a key orders by the GTFS id.
+COMPACT_TABLES = ('stop_times_compact', 'trip_keys', 'stop_keys', 'route_keys', 'service_keys')
+COMPACT_FILL = {
+    'service_keys': "INSERT INTO service_keys (service_id) SELECT DISTINCT service_id FROM trips ORDER BY service_id",
+    'route_keys': "INSERT INTO route_keys (route_id) SELECT route_id FROM routes ORDER BY route_id",
+    'stop_keys': "INSERT INTO stop_keys (stop_id) SELECT stop_id FROM stops ORDER BY stop_id",
+    'trip_keys': (
+        "INSERT INTO trip_keys (trip_id, route_key, service_key)\n"
+        "SELECT t.trip_id, rk.route_key, sk.service_key FROM trips t\n"
+        "JOIN route_keys rk ON rk.route_id = t.route_id\n"
+        "JOIN service_keys sk ON sk.service_id = t.service_id\n"
+        "ORDER BY t.trip_id"
+    ),
+    'stop_times_compact': (
+        "INSERT INTO stop_times_compact\n"
+        "    (trip_key, stop_sequence, stop_key, arrival_s, departure_s, shape_dist_traveled)\n"
+        "SELECT tk.trip_key, st.stop_sequence, sk.stop_key,\n"
+        "       TIME_TO_SEC(st.arrival_time), TIME_TO_SEC(st.departure_time), st.shape_dist_traveled\n"
+        "FROM stop_times st\n"
+        "JOIN trip_keys tk ON tk.trip_id = st.trip_id\n"
+        "JOIN stop_keys sk ON sk.stop_id = st.stop_id"
+    ),
+}
+# GTFS files a feed may omit; their tables are still created, just left empty
+OPTIONAL_TABLES = ('calendar_dates',)
+
+# MySQL errors meaning LOAD DATA LOCAL is disabled on the client or server side
+LOCAL_INFILE_ERRORS = {1148, 2068, 3948, 3950}
+
+
+class TableDDL:
+    """CREATE TABLE split into the part needed for loading and the deferred parts."""
+
+    def __init__(self, name: str, columns: List[str], create_sql: str,
+                 indexes: List[str], foreign_keys: List[str], primary_key: Tuple[str, ...] = ()):
+        self.name = name
+        self.columns = columns
+        self.create_sql = create_sql
+        self.indexes = indexes
+        self.foreign_keys = foreign_keys
+        self.primary_key = primary_key
+
+
+def parse_schema(path: str = SCHEMA_FILE) -> Dict[str, TableDDL]:
+    with open(path, encoding='utf-8') as f:
+        sql = f.read()
+    tables: Dict[str, TableDDL] = {}
+    pattern = re.compile(r"CREATE TABLE IF NOT EXISTS `\w+`\.`(\w+)` \((.*?)\n\)\s*(ENGINE=[^;]*);", re.S)
+    for name, body, options in pattern.findall(sql):
+        keep, indexes, fks, columns = [], [], [], []
+        primary_key: Tuple[str, ...] = ()
+        for line in body.strip().splitlines():
+            line = line.strip().rstrip(',')
+            if not line:
+                continue
+            if line.startswith(('INDEX', 'KEY', 'UNIQUE')):
+                indexes.append(line.replace(' VISIBLE', ''))
+            elif line.startswith('CONSTRAINT'):
+                # Drop the schema qualifier so the DDL works for any MYSQL_DB
+                fks.append(re.sub(r"`\w+`\.(`\w+`)", r"\1", line))
+            else:
+                keep.append(line)
+                m = re.match(r"`(\w+)`", line)
+                if m:
+                    columns.append(m.group(1))
+                elif line.startswith('PRIMARY KEY'):
+                    primary_key = _column_list(line[line.index('('):])
+        create_sql = f"CREATE TABLE `{name}` (\n  " + ",\n  ".join(keep) + f"\n) {options}"
+        tables[name] = TableDDL(name, columns, create_sql, indexes, fks, primary_key)
+    return tables
+
+
+def parse_index_file(path: str = INDEX_FILE) -> Dict[str, List[str]]:
+    """CREATE INDEX statements from 'index and view.sql' as ADD INDEX clauses per table."""
+    with open(path, encoding='utf-8') as f:
+        sql = re.sub(r"--[^\n]*", "", f.read())
+    per_table: Dict[str, List[str]] = {}
+    for name, table, cols in re.findall(r"CREATE INDEX (\w+) ON (\w+) \(([^)]*)\)", sql):
+        per_table.setdefault(table, []).append(f"INDEX `{name}` ({cols})")
+    return per_table
+
+
+def _column_list(sql: str) -> Tuple[str, ...]:
+    """('a', 'b') from "(`a` ASC, b)"."""
+    inner = sql[sql.index('(') + 1:sql.rindex(')')]
+    return tuple(re.sub(r"\s+(ASC|DESC)$", "", c.strip(), flags=re.I).strip('`') for c in inner.split(','))
+
+
+def index_columns(clause: str) -> Tuple[str, Tuple[str, ...]]:
+    """(name, columns) of an "INDEX `name` (cols)" clause."""
+    m = re.match(r"(?:INDEX|KEY)\s+`?(\w+)`?\s*(\(.*\))", clause)
+    if not m:
+        raise ValueError(f"Not an index clause: {clause!r}")
+    return m.group(1), _column_list(m.group(2))
+
+
+def redundant_indexes(indexes: List[Tuple[str, Tuple[str, ...]]], primary_key: Tuple[str, ...]) -> List[str]:
+    """Names of the indexes that the primary key or another index already serves.
+
+    InnoDB appends the primary key to every secondary index, so an index is redundant
+    when its columns lead another index's columns plus that primary key. Of two
+    equivalent indexes the one listed first is kept.
+    """
+    def effective(cols: Tuple[str, ...]) -> Tuple[str, ...]:
+        return cols + tuple(c for c in primary_key if c not in cols)
+
+    candidates = [(-1, primary_key, primary_key)] + [(j, cols, effective(cols)) for j, (_, cols) in enumerate(indexes)]
+    redundant = []
+    for i, (name, cols) in enumerate(indexes):
+        for j, other_cols, other_effective in candidates:
+            if j == i or not other_cols or other_effective[:len(cols)] != cols:
+                continue
+            equivalent = effective(cols)[:len(other_cols)] == other_cols
+            if not equivalent or j < i:
+                redundant.append(name)
+                break
+    return redundant
+
+
+def table_indexes(ddl: TableDDL, extra: List[str]) -> List[str]:
+    """The table's ADD INDEX clauses from the schema and the index file, minus redundant ones."""
+    clauses = ddl.indexes + extra
+    named = [index_columns(c) for c in clauses]
+    drop = set(redundant_indexes(named, ddl.primary_key))
+    return [c for c, (name, _) in zip(clauses, named) if name not in drop]
+
+
+def get_load_engine() -> Engine:
+    return create_engine(
+        get_mysql_connection_url(), pool_pre_ping=True,
+        pool_size=LOAD_WORKERS, max_overflow=2,
+        connect_args={"local_infile": True},
+    )
+
+
+def _session_setup(cursor) -> None:
+    cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 0")
+    cursor.execute("SET SESSION UNIQUE_CHECKS = 0")
+
+
+def _read_header(path: str) -> Tuple[List[str], str]:
+    with open(path, 'rb') as f:
+        first = f.readline()
+    terminator = '\\r\\n' if first.endswith(b'\r\n') else '\\n'
+    header = next(csv.reader([first.decode('utf-8-sig').strip()]))
+    return [h.strip() for h in header], terminator
+
+
+def _load_data_local(cursor, ddl: TableDDL, path: str) -> int:
+    header, terminator = _read_header(path)
+    targets, assignments = [], []
+    for i, col in enumerate(header):
+        if col in ddl.columns:
+            targets.append(f"@v{i}")
+            # GTFS leaves optional fields empty; store those as NULL
+            assignments.append(f"`{col}` = NULLIF(@v{i}, '')")
+        else:
+            targets.append("@skip")
+    escaped = os.path.abspath(path).replace('\\', '/').replace("'", "\\'")
+    sql = (
+        f"LOAD DATA LOCAL INFILE '{escaped}' INTO TABLE `{ddl.name}`\n"
+        "CHARACTER SET utf8mb4\n"
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'\n"
+        f"LINES TERMINATED BY '{terminator}'\n"
+        "IGNORE 1 LINES\n"
+        f"({', '.join(targets)})\n"
+        f"SET {', '.join(assignments)}"
+    )
+    return cursor.execute(sql)
+
+
+def _load_executemany(cursor, ddl: TableDDL, path: str) -> int:
+    rows = 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader)]
+        picks = [(i, col) for i, col in enumerate(header) if col in ddl.columns]
+        cols = ", ".join(f"`{col}`" for _, col in picks)
+        sql = f"INSERT INTO `{ddl.name}` ({cols}) VALUES ({', '.join(['%s'] * len(picks))})"
+        batch = []
+        for record in reader:
+            batch.append(tuple((record[i] if i < len(record) and record[i] != '' else None) for i, _ in picks))
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                rows += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            rows += len(batch)
+    return rows
+
+
+def load_table(engine: Engine, ddl: TableDDL, path: str, use_local_infile: bool = True) -> Tuple[str, int, float, str]:
+    start = time.perf_counter()
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        _session_setup(cursor)
+        method = 'LOAD DATA LOCAL'
+        rows = None
+        if use_local_infile:
+            try:
+                rows = _load_data_local(cursor, ddl, path)
+            except Exception as e:
+                code = e.args[0] if getattr(e, 'args', None) else None
+                if code not in LOCAL_INFILE_ERRORS:
+                    raise
+                raw.rollback()
+        if rows is None:
+            method = 'executemany'
+            rows = _load_executemany(cursor, ddl, path)
+        raw.commit()
+    finally:
+        raw.close()
+    return ddl.name, rows, time.perf_counter() - start, method
+
+
+def _run(engine: Engine, statements: List[str]) -> None:
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        _session_setup(cursor)
+        for sql in statements:
+            cursor.execute(sql)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _timed(label: str, fn, *args) -> Tuple[str, float]:
+    start = time.perf_counter()
+    fn(*args)
+    return label, time.perf_counter() - start
+
+
+def build_compact_tables(engine: Optional[Engine] = None) -> None:
+    """Recreate the integer-keyed tables of 'compact schema.sql' from the loaded transit tables.
+
+    Each key table is filled and indexed before the tables that look ids up in it;
+    stop_times_compact gets its secondary index after the bulk INSERT ... SELECT.
+    """
+    engine = engine or get_load_engine()
+    schema = parse_schema(COMPACT_SCHEMA_FILE)
+    _run(engine, ["DROP VIEW IF EXISTS vw_hourly_frequency_compact"]
+         + [f"DROP TABLE IF EXISTS `{t}`" for t in COMPACT_TABLES]
+         + [schema[t].create_sql for t in schema])
+
+    start = time.perf_counter()
+    for name in reversed(COMPACT_TABLES):
+        ddl = schema[name]
+        statements = [COMPACT_FILL[name]]
+        if ddl.indexes:
+            statements.append(f"ALTER TABLE `{name}` " + ", ".join(f"ADD {c}" for c in ddl.indexes))
+        label, secs = _timed(name, _run, engine, statements)
+        print(f"{label:<18} filled and indexed in {secs:.1f}s")
+
+    ensure_hourly_frequency_view(engine, "vw_hourly_frequency_compact")
+    print(f"Compact tables built in {time.perf_counter() - start:.1f}s")
+
+
+def load_dataset(dataset_dir: Optional[str] = None, workers: int = LOAD_WORKERS,
+                 use_local_infile: bool = True, engine: Optional[Engine] = None) -> None:
+    """Recreate the transit tables and bulk-load dataset/*.txt into them.
+
+    Tables are created without secondary indexes or foreign keys, loaded in parallel
+    with FK/unique checks disabled, then indexed with one ALTER TABLE per table.
+    stop_transfers is recomputed from the new stops at the end. The compact tables, if
+    any, are left stale until build_compact_tables runs (load_gtfs --compact).
+    """
+    dataset_dir = dataset_dir or DATASET_DIR
+    engine = engine or get_load_engine()
+    schema = parse_schema()
+    extra_indexes = parse_index_file()
+
+    present = [t for t in schema if os.path.exists(os.path.join(dataset_dir, f'{t}.txt'))]
+    missing = [t for t in schema if t not in present and t not in OPTIONAL_TABLES]
+    if missing:
+        raise SystemExit(f"Missing GTFS files in {dataset_dir}: {', '.join(m + '.txt' for m in missing)}")
+
+    _run(engine, ["DROP VIEW IF EXISTS vw_hourly_frequency"]
+         + [f"DROP TABLE IF EXISTS `{t}`" for t in TABLES if t in schema]
+         + [schema[t].create_sql for t in schema])
+
+    total_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(load_table, engine, ddl, os.path.join(dataset_dir, f'{name}.txt'), use_local_infile)
+            for name, ddl in schema.items() if name in present
+        ]
+        for fut in futures:
+            name, rows, secs, method = fut.result()
+            print(f"{name:<12} {rows:>12,} rows  {secs:8.1f}s  {rows / max(secs, 1e-9):>12,.0f} rows/s  ({method})")
+
+    # Secondary indexes: one ALTER per table so each table is rebuilt once; tables in parallel
+    alters = {}
+    for name, ddl in schema.items():
+        clauses = table_indexes(ddl, extra_indexes.get(name, []))
+        if clauses:
+            alters[name] = [f"ALTER TABLE `{name}` " + ", ".join(f"ADD {c}" for c in clauses)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for label, secs in pool.map(lambda item: _timed(item[0], _run, engine, item[1]), alters.items()):
+            print(f"{label:<12} indexes built in {secs:.1f}s")
+
+    fk_sql = [
+        f"ALTER TABLE `{name}` " + ", ".join(f"ADD {fk}" for fk in ddl.foreign_keys)
+        for name, ddl in schema.items() if ddl.foreign_keys
+    ]
+    label, secs = _timed("foreign keys", _run, engine, fk_sql)
+    print(f"{label:<12} added in {secs:.1f}s")
+
+    ensure_hourly_frequency_view(engine)
+    start = time.perf_counter()
+    pairs = refresh_stop_transfers(engine)
+    print(f"{'transfers':<12} {pairs:>12,} rows  {time.perf_counter() - start:8.1f}s  (stop_transfers)")
+    print(f"Import finished in {time.perf_counter() - total_start:.1f}s")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-load GTFS dataset/*.txt into the transit schema")
+    parser.add_argument("--dataset", default=None, help="Defaults to DATASET_DIR")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument("--no-local-infile", action="store_true", help="Always use batched executemany")
+    compact = parser.add_mutually_exclusive_group()
+    compact.add_argument("--compact", action="store_true",
+                         help="Also build the integer-keyed tables of 'compact schema.sql'")
+    compact.add_argument("--compact-only", action="store_true",
+                         help="Only rebuild the compact tables from the tables already loaded")
+    args = parser.parse_args(argv)
+    engine = get_load_engine()
+    if not args.compact_only:
+        load_dataset(args.dataset, args.workers, use_local_infile=not args.no_local_infile, engine=engine)
+    if args.compact or args.compact_only:
+        build_compact_tables(engine)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
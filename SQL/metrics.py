@@ -0,0 +1,320 @@
+"""In-process metrics for the SQL and Mongo apps, exposed in Prometheus text format.
+
+Standard library only, so both apps (and the ETL scripts) can import it cheaply.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 1000000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _fmt_value(v: float) -> str:
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_fmt_labels(k)} {_fmt_value(v)}' for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._callbacks: Dict[LabelKey, Callable[[], float]] = {}
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_function(self, fn: Callable[[], float], **labels: Any) -> None:
+        with self._lock:
+            self._callbacks[self._key(labels)] = fn
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+            callbacks = list(self._callbacks.items())
+        for key, fn in callbacks:
+            try:
+                items.append((key, float(fn())))
+            except Exception:
+                continue
+        return [f'{self.name}{_fmt_labels(k)} {_fmt_value(v)}' for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # bucket counts..., sum, count
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for key, series in items:
+            for i, bound in enumerate(self.buckets):
+                lines.append(f'{self.name}_bucket{_fmt_labels(key, ("le", _fmt_value(bound)))} {_fmt_value(series[i])}')
+            lines.append(f'{self.name}_sum{_fmt_labels(key)} {repr(float(series[-2]))}')
+            lines.append(f'{self.name}_count{_fmt_labels(key)} {_fmt_value(series[-1])}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str, **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram('http_request_duration_seconds', 'Flask request latency by endpoint.')
+HTTP_REQUESTS = REGISTRY.counter('http_requests_total', 'Flask requests by endpoint and status.')
+SERIALIZATION = REGISTRY.histogram('response_serialization_seconds', 'Time spent converting and encoding JSON responses.')
+SQL_LATENCY = REGISTRY.histogram('sql_query_duration_seconds', 'SQL statement wall time by normalized statement.')
+SQL_ROWS = REGISTRY.histogram('sql_query_rows', 'Rows returned per SQL statement.', buckets=ROW_BUCKETS)
+SLOW_QUERIES = REGISTRY.counter('sql_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.')
+POOL_WAIT = REGISTRY.histogram('sql_pool_wait_seconds', 'Time spent obtaining a pooled MySQL connection.')
+POOL_TIMEOUTS = REGISTRY.counter('sql_pool_timeouts_total', 'Connection checkouts that gave up after MYSQL_POOL_TIMEOUT.')
+POOL_CONNECTIONS = REGISTRY.gauge('sql_pool_connections', 'Pooled MySQL connections by state.')
+POOL_UTILIZATION = REGISTRY.gauge('sql_pool_utilization', 'Checked-out connections / (pool size + max overflow).')
+STATEMENT_TIMEOUTS = REGISTRY.counter('sql_statement_timeouts_total', 'Statements stopped by max_execution_time.')
+
+slow_query_logger = logging.getLogger('transit.slow_query')
+
+_WS_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)')
+
+
+def normalize_statement(statement: str, max_length: int = 300) -> str:
+    """Collapse whitespace and replace literals with '?' so similar statements share a label."""
+    s = _WS_RE.sub(' ', statement).strip()
+    s = _STRING_RE.sub('?', s)
+    s = _NUMBER_RE.sub('?', s)
+    s = s.replace('%s', '?')
+    s = _IN_LIST_RE.sub('(?)', s)
+    return s if len(s) <= max_length else s[:max_length] + '…'
+
+
+def _slow_query_threshold() -> Optional[float]:
+    value = os.getenv('SLOW_QUERY_MS')
+    if not value:
+        return None
+    try:
+        return float(value) / 1000.0
+    except ValueError:
+        return None
+
+
+def _configure_slow_query_log() -> None:
+    path = os.getenv('SLOW_QUERY_LOG')
+    if path and not slow_query_logger.handlers:
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(handler)
+        slow_query_logger.setLevel(logging.INFO)
+        slow_query_logger.propagate = False
+
+
+def _explain(cursor, statement: str, parameters: Any) -> Optional[str]:
+    if not re.match(r'\s*(SELECT|WITH)\b', statement, re.I):
+        return None
+    try:
+        explain_cursor = cursor.connection.cursor()
+        try:
+            explain_cursor.execute('EXPLAIN FORMAT=JSON ' + statement, parameters)
+            row = explain_cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            explain_cursor.close()
+    except Exception as e:  # EXPLAIN must never break the request
+        return f'EXPLAIN failed: {e}'
+
+
+def instrument_engine(engine: Any) -> Any:
+    """Attach timing/row-count hooks (and the optional slow-query log) to a SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    if getattr(engine, '_transit_instrumented', False):
+        return engine
+    _configure_slow_query_log()
+
+    # The start time lives on the execution context, which is dropped with the statement
+    # even when it fails (a statement timeout never reaches after_cursor_execute).
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._transit_query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_transit_query_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        label = normalize_statement(statement)
+        SQL_LATENCY.observe(elapsed, statement=label)
+        streaming = bool(context is not None and context.execution_options.get('stream_results'))
+        if not streaming and cursor.rowcount is not None and cursor.rowcount >= 0:
+            SQL_ROWS.observe(cursor.rowcount, statement=label)
+        threshold = _slow_query_threshold()
+        if threshold is not None and elapsed >= threshold:
+            SLOW_QUERIES.inc(statement=label)
+            # A server-side cursor still owns the connection, so EXPLAIN only buffered results.
+            plan = None if streaming or executemany else _explain(cursor, statement, parameters)
+            slow_query_logger.warning(
+                'slow query %.1f ms: %s | params=%r%s',
+                elapsed * 1000.0, label, parameters, f'\nEXPLAIN: {plan}' if plan else '',
+            )
+
+    engine._transit_instrumented = True
+    return engine
+
+
+def instrument_pool(engine: Any, max_overflow: int) -> None:
+    """Expose the engine's QueuePool occupancy as gauges (read at scrape time)."""
+    POOL_CONNECTIONS.set_function(lambda: engine.pool.checkedout(), state='checked_out')
+    POOL_CONNECTIONS.set_function(lambda: engine.pool.checkedin(), state='idle')
+    POOL_CONNECTIONS.set_function(lambda: max(engine.pool.overflow(), 0), state='overflow')
+    POOL_UTILIZATION.set_function(lambda: engine.pool.checkedout() / max(engine.pool.size() + max_overflow, 1))
+
+
+def endpoint_label() -> str:
+    """The matched URL rule of the current request (e.g. /tiles/<layer>/<int:z>/...), so one
+    endpoint is one label value however many URLs it serves."""
+    from flask import request
+
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def install_flask_metrics(app: Any, registry: Registry = REGISTRY) -> None:
+    """Per-endpoint latency histograms via before/after hooks, plus GET /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(response):
+        start = getattr(g, '_metrics_start', None)
+        if start is not None:
+            endpoint = endpoint_label()
+            HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    def metrics_endpoint():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
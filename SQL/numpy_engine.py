@@ -0,0 +1,598 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .service_calendar import CALENDAR_FILE, calendar_from_dataset
+from .sql_utils import (
+    ServiceFilter,
+    _build_q2_single_service,
+    _build_q2_whole_week,
+    _build_q4_response,
+    _format_q1_row,
+    _format_q3_cluster_row,
+    _format_q3_row,
+    _sanitize_limit,
+    _service_id_filter,
+    service_label,
+)
+from .stop_transfers import pairs_within
+
+
+DATASET_DIR = os.getenv("DATASET_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dataset'))
+CACHE_DIR = os.getenv("NPY_CACHE_DIR", os.path.join(os.path.dirname(__file__), 'npy_cache'))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "100000"))
+
+SOURCE_FILES = ('stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt')
+MANIFEST = 'manifest.json'
+
+# Sentinel for NULL times/codes in the int32 arrays
+MISSING = -1
+
+
+class GTFSStore:
+    """Dictionary-encoded GTFS arrays (memory-mapped when loaded from the cache)."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        self.n_stops = len(self.stop_ids)
+        self.n_routes = len(self.route_ids)
+        self.n_trips = len(self.trip_ids)
+        self.n_services = len(self.service_ids)
+        self._service_index = {str(s): i for i, s in enumerate(self.service_ids)}
+        self._derived: Dict[str, Any] = {}
+
+    def service_code(self, service_id: str) -> int:
+        return self._service_index.get(str(service_id), MISSING)
+
+    def service_codes(self, service_filter: ServiceFilter) -> np.ndarray:
+        """Codes for one service_id or a tuple of them (unknown ids are dropped)."""
+        ids = service_filter if isinstance(service_filter, tuple) else (service_filter,)
+        codes = [self.service_code(s) for s in ids]
+        return np.asarray([c for c in codes if c != MISSING], dtype=np.int32)
+
+
+def _read_chunks(path: str, usecols: List[str]):
+    return pd.read_csv(
+        path, dtype=str, keep_default_na=False, usecols=lambda c: c.strip() in usecols,
+        chunksize=CHUNK_SIZE, encoding='utf-8-sig', skipinitialspace=True,
+    )
+
+
+def _read_table(path: str, usecols: List[str]) -> pd.DataFrame:
+    frames = [c.rename(columns=str.strip) for c in _read_chunks(path, usecols)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=usecols)
+    for col in usecols:
+        if col not in df.columns:
+            df[col] = ''
+    return df
+
+
+def _str_array(values) -> np.ndarray:
+    # Fixed-width unicode arrays can be np.save'd and memory-mapped without pickle.
+    arr = np.asarray([str(v) for v in values])
+    return arr if arr.size else np.asarray([], dtype='<U1')
+
+
+def _encode(values: pd.Series, index: Dict[str, int]) -> np.ndarray:
+    return values.map(index).fillna(MISSING).to_numpy(dtype=np.int32)
+
+
+def parse_gtfs_seconds(values: pd.Series) -> np.ndarray:
+    """Vectorized 'H:MM:SS' -> int32 seconds; hours may exceed 24, blanks become MISSING."""
+    values = values.str.strip()
+    blank = values == ''
+    parts = values.where(~blank, '0:0:0').str.split(':', expand=True)
+    secs = (
+        parts[0].astype(np.int64) * 3600 + parts[1].astype(np.int64) * 60 + parts[2].astype(np.int64)
+    ).to_numpy(dtype=np.int64)
+    return np.where(blank.to_numpy(), MISSING, secs).astype(np.int32)
+
+
+def _float32(values: pd.Series) -> np.ndarray:
+    # MySQL stores lat/lon/shape_dist_traveled as FLOAT, so keep single precision to match it.
+    return pd.to_numeric(values.replace('', np.nan), errors='coerce').to_numpy(dtype=np.float32)
+
+
+def encode_dataset(dataset_dir: Optional[str] = None) -> Dict[str, np.ndarray]:
+    dataset_dir = dataset_dir or DATASET_DIR
+    stops = _read_table(os.path.join(dataset_dir, 'stops.txt'),
+                        ['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon'])
+    routes = _read_table(os.path.join(dataset_dir, 'routes.txt'),
+                         ['route_id', 'route_short_name', 'route_long_name', 'route_type'])
+    trips = _read_table(os.path.join(dataset_dir, 'trips.txt'),
+                        ['trip_id', 'route_id', 'service_id', 'trip_headsign'])
+
+    stop_index = {s: i for i, s in enumerate(stops['stop_id'])}
+    route_index = {r: i for i, r in enumerate(routes['route_id'])}
+    trip_index = {t: i for i, t in enumerate(trips['trip_id'])}
+    service_ids = sorted(set(trips['service_id']))
+    service_index = {s: i for i, s in enumerate(service_ids)}
+
+    st_trip, st_stop, st_seq, st_arr, st_dep, st_dist = [], [], [], [], [], []
+    st_cols = ['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time', 'shape_dist_traveled']
+    for chunk in _read_chunks(os.path.join(dataset_dir, 'stop_times.txt'), st_cols):
+        chunk = chunk.rename(columns=str.strip)
+        if 'shape_dist_traveled' not in chunk.columns:
+            chunk['shape_dist_traveled'] = ''
+        st_trip.append(_encode(chunk['trip_id'], trip_index))
+        st_stop.append(_encode(chunk['stop_id'], stop_index))
+        st_seq.append(chunk['stop_sequence'].astype(np.int32).to_numpy())
+        st_arr.append(parse_gtfs_seconds(chunk['arrival_time']))
+        st_dep.append(parse_gtfs_seconds(chunk['departure_time']))
+        st_dist.append(_float32(chunk['shape_dist_traveled']))
+
+    def _cat(parts, dtype):
+        return np.concatenate(parts).astype(dtype, copy=False) if parts else np.empty(0, dtype=dtype)
+
+    st_trip_a = _cat(st_trip, np.int32)
+    st_seq_a = _cat(st_seq, np.int32)
+    # Rows ordered by (trip, stop_sequence) so per-trip reductions are contiguous segments.
+    order = np.lexsort((st_seq_a, st_trip_a))
+
+    return {
+        'stop_ids': _str_array(stops['stop_id']),
+        'stop_codes': _str_array(stops['stop_code']),
+        'stop_names': _str_array(stops['stop_name']),
+        'stop_lat': _float32(stops['stop_lat']),
+        'stop_lon': _float32(stops['stop_lon']),
+        'route_ids': _str_array(routes['route_id']),
+        'route_short_names': _str_array(routes['route_short_name']),
+        'route_long_names': _str_array(routes['route_long_name']),
+        'route_types': pd.to_numeric(routes['route_type'], errors='coerce').fillna(MISSING).to_numpy(dtype=np.int32),
+        'service_ids': _str_array(service_ids),
+        'trip_ids': _str_array(trips['trip_id']),
+        'trip_route': _encode(trips['route_id'], route_index),
+        'trip_service': _encode(trips['service_id'], service_index),
+        'trip_headsigns': _str_array(trips['trip_headsign']),
+        'st_trip': st_trip_a[order],
+        'st_stop': _cat(st_stop, np.int32)[order],
+        'st_seq': st_seq_a[order],
+        'st_arr': _cat(st_arr, np.int32)[order],
+        'st_dep': _cat(st_dep, np.int32)[order],
+        'st_dist': _cat(st_dist, np.float32)[order],
+    }
+
+
+def _source_signature(dataset_dir: str) -> Dict[str, List[float]]:
+    sig = {}
+    for name in SOURCE_FILES:
+        st = os.stat(os.path.join(dataset_dir, name))
+        sig[name] = [st.st_size, st.st_mtime]
+    return sig
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _array_dir(cache_dir: str, manifest: Dict[str, Any]) -> str:
+    """Where the manifest's arrays live (caches written before generations keep them beside it)."""
+    generation = manifest.get('generation')
+    return os.path.join(cache_dir, generation) if generation else cache_dir
+
+
+def build_store(dataset_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> None:
+    """Parse dataset/*.txt and publish the encoded arrays as a new generation of .npy files.
+
+    Running servers keep the previous generation memory-mapped, so nothing is rewritten in
+    place: the arrays go to a private temporary directory, which is renamed to its generation
+    name once synced, and only then does the manifest (replaced atomically) point readers at it.
+    Concurrent builders each publish a complete generation; the last manifest wins.
+    """
+    dataset_dir = dataset_dir or DATASET_DIR
+    cache_dir = cache_dir or CACHE_DIR
+    arrays = encode_dataset(dataset_dir)
+    sources = _source_signature(dataset_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    previous = None
+    if has_store(cache_dir):
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            previous = json.load(f).get('generation')
+
+    generation = f"gen-{time.time_ns()}-{os.getpid()}"
+    tmp_dir = tempfile.mkdtemp(prefix='.build-', dir=cache_dir)
+    try:
+        for name, arr in arrays.items():
+            with open(os.path.join(tmp_dir, f'{name}.npy'), 'wb') as f:
+                np.save(f, arr, allow_pickle=False)
+                f.flush()
+                os.fsync(f.fileno())
+        _fsync_dir(tmp_dir)
+        os.rename(tmp_dir, os.path.join(cache_dir, generation))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    tmp_path = os.path.join(cache_dir, f'{MANIFEST}.tmp{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        json.dump({'generation': generation, 'arrays': sorted(arrays), 'sources': sources}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(cache_dir, MANIFEST))
+    _fsync_dir(cache_dir)
+    print(f"Encoded {len(arrays['st_trip'])} stop_times rows into {os.path.join(cache_dir, generation)}")
+    try:
+        calendar_from_dataset(dataset_dir).save(os.path.join(cache_dir, CALENDAR_FILE))
+    except FileNotFoundError:
+        pass
+
+    # Older generations go; the one just replaced stays for readers that read its manifest
+    # but have not mapped it yet (mappings already made survive the unlink).
+    for entry in os.listdir(cache_dir):
+        if entry.startswith('gen-') and entry not in (generation, previous):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def has_store(cache_dir: Optional[str] = None) -> bool:
+    return os.path.exists(os.path.join(cache_dir or CACHE_DIR, MANIFEST))
+
+
+def is_stale(dataset_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> bool:
+    """True when dataset/*.txt changed since the cache was built (False if the dataset is absent)."""
+    dataset_dir = dataset_dir or DATASET_DIR
+    if not all(os.path.exists(os.path.join(dataset_dir, n)) for n in SOURCE_FILES):
+        return False
+    with open(os.path.join(cache_dir or CACHE_DIR, MANIFEST)) as f:
+        manifest = json.load(f)
+    return manifest.get('sources') != _source_signature(dataset_dir)
+
+
+def load_store(cache_dir: Optional[str] = None) -> GTFSStore:
+    """Map the generation the manifest names."""
+    cache_dir = cache_dir or CACHE_DIR
+    with open(os.path.join(cache_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    array_dir = _array_dir(cache_dir, manifest)
+    arrays = {
+        name: np.load(os.path.join(array_dir, f'{name}.npy'), mmap_mode='r', allow_pickle=False)
+        for name in manifest['arrays']
+    }
+    return GTFSStore(arrays)
+
+
+_store: Optional[GTFSStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> GTFSStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if not has_store() or is_stale():
+                    build_store()
+                _store = load_store()
+    return _store
+
+
+def warm_store() -> GTFSStore:
+    """get_store() plus the service-independent derived arrays (pre-fork servers share them)."""
+    store = get_store()
+    _stop_id_rank(store)
+    _route_long_groups(store)
+    _trip_stats(store)
+    _hourly_frequency(store)
+    stop_transfer_pairs(store)
+    return store
+
+
+# --- Shared derived arrays ---
+
+def _trip_service_ok(store: GTFSStore, service_filter: ServiceFilter) -> np.ndarray:
+    if isinstance(service_filter, tuple):
+        return np.isin(store.trip_service, store.service_codes(service_filter))
+    return store.trip_service == store.service_code(service_filter)
+
+
+def _valid_rows(store: GTFSStore, service_filter: ServiceFilter, need_stop: bool) -> np.ndarray:
+    mask = store.st_trip >= 0
+    if need_stop:
+        mask &= store.st_stop >= 0
+    if service_filter is not None:
+        trip_ok = _trip_service_ok(store, service_filter)
+        mask &= trip_ok[np.where(store.st_trip >= 0, store.st_trip, 0)]
+    return mask
+
+
+def _mysql_float(x: np.float32) -> float:
+    # MySQL sends FLOAT columns as their shortest single-precision text form.
+    return float(str(np.float32(x)))
+
+
+def _nullable_str(value: str) -> Optional[str]:
+    return value if value != '' else None
+
+
+def _iter_stop_rows(store: GTFSStore, stops: np.ndarray, **columns: np.ndarray) -> Iterator[Dict[str, Any]]:
+    for i, s in enumerate(stops):
+        row = {
+            'stop_id': str(store.stop_ids[s]),
+            'stop_code': _nullable_str(str(store.stop_codes[s])),
+            'stop_name': str(store.stop_names[s]),
+            'stop_lat': _mysql_float(store.stop_lat[s]),
+            'stop_lon': _mysql_float(store.stop_lon[s]),
+        }
+        for name, values in columns.items():
+            row[name] = int(values[i])
+        yield row
+
+
+def _rank(values: np.ndarray, limit_value: Optional[int]) -> np.ndarray:
+    order = np.argsort(-values, kind='stable')
+    return order if limit_value is None else order[:limit_value]
+
+
+def _stop_route_counts(store: GTFSStore, mask: np.ndarray) -> np.ndarray:
+    trip_route = store.trip_route[store.st_trip[mask]]
+    ok = trip_route >= 0
+    pairs = np.unique(store.st_stop[mask][ok].astype(np.int64) * max(store.n_routes, 1) + trip_route[ok])
+    return np.bincount(pairs // max(store.n_routes, 1), minlength=store.n_stops)
+
+
+def stop_transfer_pairs(store: GTFSStore) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Walking pairs (from stop, to stop, metres) within TRANSFER_RADIUS_M, i.e. the stop_transfers table."""
+    if 'stop_transfers' not in store._derived:
+        lat = np.array([_mysql_float(v) for v in store.stop_lat], dtype=np.float64)
+        lon = np.array([_mysql_float(v) for v in store.stop_lon], dtype=np.float64)
+        store._derived['stop_transfers'] = pairs_within(lat, lon)
+    return store._derived['stop_transfers']
+
+
+def _stop_id_rank(store: GTFSStore) -> np.ndarray:
+    if 'stop_id_rank' not in store._derived:
+        rank = np.empty(store.n_stops, dtype=np.int64)
+        rank[np.argsort(store.stop_ids, kind='stable')] = np.arange(store.n_stops)
+        store._derived['stop_id_rank'] = rank
+    return store._derived['stop_id_rank']
+
+
+# --- Q1–Q4 ---
+
+def iter_q1_busiest_stops(service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    store = get_store()
+    mask = _valid_rows(store, _service_id_filter(service_id), need_stop=True)
+    events = np.bincount(store.st_stop[mask], minlength=store.n_stops)
+    routes = _stop_route_counts(store, mask)
+    served = np.flatnonzero(events)
+    top = served[_rank(events[served], _sanitize_limit(limit_param))]
+    for r in _iter_stop_rows(store, top, total_trip_events=events[top], num_unique_routes=routes[top]):
+        yield _format_q1_row(r)
+
+
+def query_q1_busiest_stops(service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_q1_busiest_stops(service_id, limit_param))
+
+
+def iter_q3_transfer_points(service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    store = get_store()
+    mask = _valid_rows(store, _service_id_filter(service_id), need_stop=True)
+    routes = _stop_route_counts(store, mask)
+    hubs = np.flatnonzero(routes >= 2)
+    top = hubs[_rank(routes[hubs], _sanitize_limit(limit_param))]
+    for r in _iter_stop_rows(store, top, num_unique_routes=routes[top]):
+        yield _format_q3_row(r)
+
+
+def query_q3_transfer_points(service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_q3_transfer_points(service_id, limit_param))
+
+
+def iter_q3_transfer_clusters(service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Q3 over walking clusters; same rules as sql_utils.Q3_CLUSTER_SELECT."""
+    store = get_store()
+    mask = _valid_rows(store, _service_id_filter(service_id), need_stop=True)
+    n_routes = max(store.n_routes, 1)
+    trip_route = store.trip_route[store.st_trip[mask]]
+    ok = trip_route >= 0
+    pairs = np.unique(store.st_stop[mask][ok].astype(np.int64) * n_routes + trip_route[ok])
+    pair_stop, pair_route = pairs // n_routes, pairs % n_routes
+    served = np.zeros(store.n_stops, dtype=bool)
+    served[pair_stop] = True
+    # Routes of stop s are pair_route[offsets[s]:offsets[s + 1]]
+    offsets = np.searchsorted(pair_stop, np.arange(store.n_stops + 1))
+
+    src, dst, _ = stop_transfer_pairs(store)
+    walk = served[src] & served[dst]
+    src, dst = src[walk], dst[walk]
+    own = np.flatnonzero(served)
+    hub, member = np.concatenate([own, src]), np.concatenate([own, dst])
+    counts = offsets[member + 1] - offsets[member]
+    pos = np.repeat(offsets[member] - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+    hub_routes = np.unique(np.repeat(hub, counts).astype(np.int64) * n_routes + pair_route[pos])
+    routes = np.bincount(hub_routes // n_routes, minlength=store.n_stops)
+    num_stops = np.bincount(hub, minlength=store.n_stops)
+
+    rank = _stop_id_rank(store)
+    beaten = np.zeros(store.n_stops, dtype=bool)
+    beaten[src[(routes[dst] > routes[src]) | ((routes[dst] == routes[src]) & (rank[dst] < rank[src]))]] = True
+    hubs = np.flatnonzero(served & (routes >= 2) & ~beaten)
+    top = hubs[_rank(routes[hubs], _sanitize_limit(limit_param))]
+    for r in _iter_stop_rows(store, top, num_unique_routes=routes[top], num_stops=num_stops[top]):
+        yield _format_q3_cluster_row(r)
+
+
+def query_q3_transfer_clusters(service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_q3_transfer_clusters(service_id, limit_param))
+
+
+def _route_long_groups(store: GTFSStore) -> Tuple[np.ndarray, List[Optional[str]], List[Optional[str]]]:
+    """Map route codes onto route_long_name groups (the SQL GROUP BY key)."""
+    if 'long_groups' not in store._derived:
+        names, first, codes = np.unique(store.route_long_names, return_index=True, return_inverse=True)
+        long_names = [_nullable_str(str(n)) for n in names]
+        short_names = [_nullable_str(str(store.route_short_names[i])) for i in first]
+        store._derived['long_groups'] = (codes.astype(np.int32), long_names, short_names)
+    return store._derived['long_groups']
+
+
+def _trip_stats(store: GTFSStore) -> Dict[str, np.ndarray]:
+    """Per-trip duration/distance, equivalent to the trip_stats CTE (before HAVING)."""
+    if 'trip_stats' not in store._derived:
+        big = np.iinfo(np.int64).max
+        valid = store.st_trip >= 0
+        trip = store.st_trip[valid]
+        dep = store.st_dep[valid].astype(np.int64)
+        arr = store.st_arr[valid].astype(np.int64)
+        dist = store.st_dist[valid].astype(np.float64)
+        starts = np.flatnonzero(np.r_[True, trip[1:] != trip[:-1]]) if len(trip) else np.empty(0, dtype=np.int64)
+        trips = trip[starts]
+        min_dep = np.minimum.reduceat(np.where(dep == MISSING, big, dep), starts) if len(trip) else np.empty(0, np.int64)
+        max_arr = np.maximum.reduceat(np.where(arr == MISSING, -big, arr), starts) if len(trip) else np.empty(0, np.int64)
+        has_dist = ~np.isnan(dist)
+        min_dist = np.fmin.reduceat(dist, starts) if len(trip) else np.empty(0)
+        max_dist = np.fmax.reduceat(dist, starts) if len(trip) else np.empty(0)
+        ok = (min_dep != big) & (max_arr != -big)
+        duration = np.where(ok, max_arr - min_dep, 0)
+        keep = ok & (duration > 60)
+        store._derived['trip_stats'] = {
+            'trip': trips[keep],
+            'duration': duration[keep].astype(np.float64),
+            'distance': (max_dist - min_dist)[keep],
+            'has_distance': (np.add.reduceat(has_dist, starts) > 0)[keep] if len(trip) else np.empty(0, bool),
+        }
+    return store._derived['trip_stats']
+
+
+def _q2_groups(store: GTFSStore, service_filter: ServiceFilter, per_service: bool) -> List[Dict[str, Any]]:
+    codes, long_names, short_names = _route_long_groups(store)
+    ts = _trip_stats(store)
+    route = store.trip_route[ts['trip']]
+    service = store.trip_service[ts['trip']]
+    keep = route >= 0
+    if service_filter is not None:
+        keep &= np.isin(service, store.service_codes(service_filter))
+    group = codes[route[keep]].astype(np.int64)
+    service = service[keep]
+    dur, dist, has_dist = ts['duration'][keep], ts['distance'][keep], ts['has_distance'][keep]
+    key = group * max(store.n_services, 1) + service if per_service else group
+    keys, inv = np.unique(key, return_inverse=True)
+    n = len(keys)
+
+    count = np.bincount(inv, minlength=n)
+    dist_n = np.bincount(inv, weights=has_dist, minlength=n)
+    dist_sum = np.bincount(inv, weights=np.where(has_dist, dist, 0.0), minlength=n)
+    dur_sum = np.bincount(inv, weights=dur, minlength=n)
+    speed_sum = np.bincount(inv, weights=np.where(has_dist, dist / dur * 3600, 0.0), minlength=n)
+    mean_dur = dur_sum / np.maximum(count, 1)
+    var = np.bincount(inv, weights=(dur - mean_dur[inv]) ** 2, minlength=n) / np.maximum(count, 1)
+
+    rows = []
+    for i, k in enumerate(keys):
+        g = int(k // max(store.n_services, 1)) if per_service else int(k)
+        rows.append({
+            'route': long_names[g],
+            'route_short': short_names[g],
+            'service_id': str(store.service_ids[int(k % max(store.n_services, 1))]) if per_service else None,
+            'total_trips': int(count[i]),
+            'avg_trip_distance_km': float(dist_sum[i] / dist_n[i]) if dist_n[i] else None,
+            'avg_duration_min': float(mean_dur[i] / 60.0),
+            'duration_stddev_min': float(np.sqrt(var[i]) / 60.0),
+            'avg_speed_kmh': float(speed_sum[i] / dist_n[i]) if dist_n[i] else None,
+        })
+    return rows
+
+
+def _top(rows: List[Dict[str, Any]], key: str, limit_value: Optional[int]) -> List[Dict[str, Any]]:
+    rows = sorted(rows, key=lambda r: -(r[key] or 0.0))
+    return rows if limit_value is None else rows[:limit_value]
+
+
+def query_q2_avg_duration_speed(service_id: ServiceFilter, limit_param: Optional[str]) -> Dict[str, Any]:
+    store = get_store()
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+    if service_filter is None:
+        global_rows = _top(_q2_groups(store, None, per_service=False), 'avg_duration_min', limit_value)
+        return _build_q2_whole_week(global_rows, _q2_groups(store, None, per_service=True))
+    # The services of a date are pooled per route
+    pooled = isinstance(service_filter, tuple)
+    rows = _top(_q2_groups(store, service_filter, per_service=not pooled), 'avg_duration_min', limit_value)
+    return _build_q2_single_service(rows, service_label(service_filter) if pooled else None)
+
+
+def _hourly_frequency(store: GTFSStore) -> Dict[str, np.ndarray]:
+    """Equivalent of vw_hourly_frequency: distinct trips per (route_id, service_id, hour)."""
+    if 'hourly' not in store._derived:
+        valid = store.st_trip >= 0
+        trip = store.st_trip[valid].astype(np.int64)
+        dep = store.st_dep[valid]
+        hour = np.where(dep == MISSING, MISSING, dep // 3600).astype(np.int64)
+        n_hours = int(hour.max()) + 2 if len(hour) else 1
+        # NULL hours get their own bucket, like GROUP BY on HOUR(NULL)
+        hour_key = np.where(hour == MISSING, n_hours - 1, hour)
+        pairs = np.unique(trip * n_hours + hour_key)
+        p_trip, p_hour = pairs // n_hours, pairs % n_hours
+        route = store.trip_route[p_trip].astype(np.int64)
+        service = store.trip_service[p_trip].astype(np.int64)
+        ok = route >= 0
+        key = (route[ok] * max(store.n_services, 1) + service[ok]) * n_hours + p_hour[ok]
+        keys, counts = np.unique(key, return_counts=True)
+        rs, h = keys // n_hours, keys % n_hours
+        store._derived['hourly'] = {
+            'route': rs // max(store.n_services, 1),
+            'service': rs % max(store.n_services, 1),
+            'hour': np.where(h == n_hours - 1, MISSING, h),
+            'trips': counts,
+        }
+    return store._derived['hourly']
+
+
+def query_q4_hourly_frequency(service_id: ServiceFilter, limit_param: Optional[str]) -> Dict[str, Any]:
+    store = get_store()
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+    codes, long_names, short_names = _route_long_groups(store)
+    hf = _hourly_frequency(store)
+    keep = np.ones(len(hf['trips']), dtype=bool)
+    if service_filter is not None:
+        keep = np.isin(hf['service'], store.service_codes(service_filter))
+    route, service, hour, trips = hf['route'][keep], hf['service'][keep], hf['hour'][keep], hf['trips'][keep]
+
+    group = codes[route]
+    totals = np.bincount(group, weights=trips, minlength=len(long_names))
+    present = np.unique(group)
+    ranked = present[_rank(totals[present], limit_value)]
+    selected_routes = {long_names[g] for g in ranked}
+
+    order = np.lexsort((hour, service, route, group))
+    rows = [
+        {
+            'route': long_names[group[i]],
+            'route_short': _nullable_str(str(store.route_short_names[route[i]])),
+            'service_id': str(store.service_ids[service[i]]),
+            'hour_of_day': None if hour[i] == MISSING else int(hour[i]),
+            'trips_per_hour': int(trips[i]),
+        }
+        for i in order
+    ]
+    return _build_q4_response(rows, selected_routes, service_filter)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Encode dataset/*.txt into memory-mappable NumPy arrays")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--dataset", default=None, help="Defaults to DATASET_DIR")
+    parser.add_argument("--cache", default=None, help="Defaults to NPY_CACHE_DIR")
+    args = parser.parse_args(argv)
+    build_store(args.dataset, args.cache)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
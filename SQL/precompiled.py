@@ -0,0 +1,173 @@
+"""Precompiled Q1–Q4 responses: the UI's fixed requests kept as ready-to-send bytes.
+
+The UI only asks for service_id 1-4 with limit 10/20/50/all, and those answers change
+only when the data behind them is regenerated. During start-up the app renders each
+of them once through its normal views and keeps the body as identity, gzip and, with
+the optional `brotli` package, brotli bytes, with ETags hashed from the content. A
+matching request is answered with the bytes for its Accept-Encoding, or 304 when
+If-None-Match already has them. Anything else (other parameters, route_type, date=,
+NDJSON) is computed live as before.
+
+The data files behind the backends are re-checked at most every
+PRECOMPILED_RECHECK_SECONDS. When one changes, the entries are dropped, so requests
+go live again, and they are rebuilt in the background.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from .metrics import REGISTRY
+
+try:
+    import brotli
+except ImportError:  # optional: without it clients get gzip
+    brotli = None
+
+PRECOMPILED_SERVICE_IDS = ('1', '2', '3', '4')
+PRECOMPILED_LIMITS = ('10', '20', '50', 'all')
+API_MAX_AGE = int(os.getenv("API_MAX_AGE", "60"))
+PRECOMPILED_RECHECK_SECONDS = float(os.getenv("PRECOMPILED_RECHECK_SECONDS", "5"))
+BYPASS_ENVIRON_KEY = 'transit.precompiling'
+
+PRECOMPILED_RESPONSES = REGISTRY.counter(
+    'precompiled_responses_total', 'Q1–Q4 requests answered from precompiled bytes, by what was sent.')
+
+# Preferred first; brotli only when the package is installed
+ENCODINGS = (('br', 'br'), ('gzip', 'gz')) if brotli is not None else (('gzip', 'gz'),)
+
+
+def file_fingerprint(paths: Iterable[str]) -> Tuple[Any, ...]:
+    """(mtime_ns, size) per path, None for a missing one."""
+    out = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            out.append(None)
+            continue
+        out.append((st.st_mtime_ns, st.st_size))
+    return tuple(out)
+
+
+class CompiledResponse:
+    """One response body in every encoding, with an ETag per encoding."""
+
+    __slots__ = ('mimetype', 'bodies', 'etags')
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.mimetype = mimetype
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies: Dict[str, bytes] = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+        self.etags: Dict[str, str] = {'identity': digest}
+        for encoding, suffix in ENCODINGS:
+            self.etags[encoding] = f"{digest}-{suffix}"
+
+
+class PrecompiledResponses:
+    """The compiled responses of one app, keyed by (path, service_id, limit)."""
+
+    def __init__(self, paths: Iterable[str], fingerprint: Callable[[], Tuple[Any, ...]]):
+        self.paths = tuple(paths)
+        self._fingerprint = fingerprint
+        self._entries: Dict[Tuple[str, str, str], CompiledResponse] = {}
+        self._built_for: Optional[Tuple[Any, ...]] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, request: Any) -> Optional[Tuple[str, str, str]]:
+        """The entry a request maps to, or None when it must run live."""
+        if request.path not in self.paths or request.environ.get(BYPASS_ENVIRON_KEY):
+            return None
+        args = request.args
+        if len(args) != 2 or args.get("service_id") not in PRECOMPILED_SERVICE_IDS \
+                or args.get("limit") not in PRECOMPILED_LIMITS:
+            return None
+        if request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+            return None
+        return request.path, args["service_id"], args["limit"]
+
+    def build(self, app: Any) -> Dict[str, Any]:
+        """Render every combination through the app's own views and keep the bytes."""
+        fingerprint = self._fingerprint()
+        if fingerprint == self._built_for and self._entries:
+            return {"responses": len(self._entries), "rebuilt": False}
+        start = time.perf_counter()
+        entries: Dict[Tuple[str, str, str], CompiledResponse] = {}
+        for path in self.paths:
+            adapter = app.url_map.bind("")
+            endpoint, _ = adapter.match(path, method="GET")
+            for service_id in PRECOMPILED_SERVICE_IDS:
+                for limit in PRECOMPILED_LIMITS:
+                    with app.test_request_context(path, query_string={"service_id": service_id, "limit": limit},
+                                                  environ_base={BYPASS_ENVIRON_KEY: True}):
+                        try:
+                            response = app.make_response(app.view_functions[endpoint]())
+                        except Exception as e:  # left to the live path, which reports it properly
+                            print(f"[precompiled] {path}?service_id={service_id}&limit={limit}: {e!r}")
+                            continue
+                        if response.status_code != 200 or 'Warning' in response.headers:
+                            continue
+                        entries[(path, service_id, limit)] = CompiledResponse(response.get_data(), response.mimetype)
+        with self._lock:
+            self._entries = entries
+            self._built_for = fingerprint
+            self._checked = time.monotonic()
+        sizes = {enc: sum(len(e.bodies[enc]) for e in entries.values()) for enc in ('identity', *dict(ENCODINGS))}
+        return {"responses": len(entries), "rebuilt": True, "bytes": sizes,
+                "seconds": round(time.perf_counter() - start, 3)}
+
+    def _fresh(self, app: Any) -> bool:
+        now = time.monotonic()
+        if now - self._checked < PRECOMPILED_RECHECK_SECONDS:
+            return True
+        with self._lock:
+            self._checked = now
+            if self._fingerprint() == self._built_for:
+                return True
+            self._entries = {}
+            if self._rebuilding:
+                return False
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                self.build(app)
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=rebuild, name="precompile", daemon=True).start()
+        return False
+
+    def respond(self, app: Any, request: Any) -> Optional[Any]:
+        """The precompiled response for `request`, or None to compute it live."""
+        key = self.key(request)
+        if key is None or not self._entries or not self._fresh(app):
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        encoding = next((enc for enc, _ in ENCODINGS if request.accept_encodings[enc]), 'identity')
+        etag = entry.etags[encoding]
+        if any(request.if_none_match.contains(e) for e in entry.etags.values()):
+            response = app.response_class(status=304)
+            PRECOMPILED_RESPONSES.inc(endpoint=request.path, served='not_modified')
+        else:
+            response = app.response_class(entry.bodies[encoding], mimetype=entry.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+            PRECOMPILED_RESPONSES.inc(endpoint=request.path, served=encoding)
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = API_MAX_AGE
+        return response
+
@@ -0,0 +1,150 @@
+"""Pre-fork server for the Flask apps: load read-only data once, then fork N workers.
+
+The master imports the app and runs its `preload()` hook, which warms the precomputed
+CSV frames, the NumPy memmaps and their derived arrays. It then freezes the GC, so the
+loaded objects stay in shared copy-on-write pages, and binds the listening socket.
+Every worker inherits both, runs the app's `post_fork()` hook to open its own database
+pools (MySQL engine, DuckDB connection, MongoDB client; none of these survive a fork),
+and serves with a threaded WSGI server on the shared socket. The kernel spreads
+accepted connections across the workers, and the master respawns workers that die.
+
+    python -m SQL.prefork sql --workers 4            # analytics app on :5050
+    python -m SQL.prefork mongo --workers 4          # timetable app on :5000
+"""
+import gc
+import importlib
+import importlib.util
+import os
+import signal
+import socket
+import sys
+import time
+from types import ModuleType
+from typing import List, Optional
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app name -> (module path, default port)
+APPS = {
+    'sql': ('SQL/app.py', 5050),
+    'mongo': ('Mongo/app.py', 5000),
+}
+
+
+def load_app_module(name: str) -> ModuleType:
+    if name == 'sql':
+        return importlib.import_module('SQL.app')
+    # Mongo/ is a plain directory of scripts, not a package
+    spec = importlib.util.spec_from_file_location(f'{name}_app', os.path.join(ROOT_DIR, APPS[name][0]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _call_hook(module: ModuleType, hook: str) -> None:
+    fn = getattr(module, hook, None)
+    if fn is not None:
+        fn()
+
+
+def _serve(module: ModuleType, sock: socket.socket, threaded: bool) -> None:
+    from werkzeug.serving import make_server
+
+    # Ctrl-C reaches the whole process group; the master decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, module.app, threaded=threaded, fd=sock.fileno())
+    server.serve_forever()
+
+
+def _spawn(module: ModuleType, sock: socket.socket, threaded: bool) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        _call_hook(module, 'post_fork')
+        _serve(module, sock, threaded)
+    except BaseException as e:  # never fall back into the master's loop
+        print(f"[worker {os.getpid()}] {e!r}", file=sys.stderr)
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run(name: str, host: str = '127.0.0.1', port: Optional[int] = None, workers: int = WORKERS,
+        threaded: bool = True) -> int:
+    """Serve app `name` with `workers` forked processes until SIGINT/SIGTERM."""
+    port = APPS[name][1] if port is None else port
+    started = time.perf_counter()
+    module = load_app_module(name)
+    _call_hook(module, 'preload')
+    # Objects created so far are never collected, so GC passes in the workers don't
+    # write to (and un-share) their pages
+    gc.freeze()
+    print(f"[master {os.getpid()}] {name} app preloaded in {time.perf_counter() - started:.2f}s")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128 * workers)
+    sock.set_inheritable(True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    children = {_spawn(module, sock, threaded) for _ in range(workers)}
+    print(f"[master {os.getpid()}] serving http://{host}:{port} with {workers} workers")
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        if pid in children:
+            children.discard(pid)
+            print(f"[master] worker {pid} exited ({os.waitstatus_to_exitcode(status)}); respawning",
+                  file=sys.stderr)
+            children.add(_spawn(module, sock, threaded))
+
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-fork multi-process server for the Flask apps")
+    parser.add_argument("app", choices=sorted(APPS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="Defaults to 5050 (sql) / 5000 (mongo)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes (WEB_CONCURRENCY, else CPU count)")
+    parser.add_argument("--no-threads", action="store_true", help="One request at a time per worker")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return run(args.app, args.host, args.port, args.workers, threaded=not args.no_threads)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Opt-in cProfile captures of one API request (?_profile=1) or of the phases of an ETL run.
+
+Standard library only, so both apps and the ETL scripts can import it cheaply. Profiles
+are pstats files in PROFILE_DIR: `python -m pstats FILE`, snakeviz or gprof2dot open them.
+
+Requests: with PROFILE_REQUESTS=true, `_profile=1` on any URL of the SQL or Mongo app runs
+that one request under cProfile: the view, its queries and the whole response body, so
+streamed and serialized output is included. The response becomes the text report (top
+PROFILE_TOP functions by cumulative time); X-Profile-File names the saved file and
+X-Profiled-Status keeps the status of the real response. Profiled requests run one at a
+time; other requests are not affected. Without the flag `_profile` is an unknown parameter.
+
+ETL: `--profile` on Mongo/denormalization.py and SQL/generate_csv.py profiles each phase
+(extract, transform, load, ... or one query each) separately, see PhaseProfiler.
+"""
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                    "profiles"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+
+_request_lock = threading.Lock()
+_sequence = itertools.count(1)
+
+
+def _filename(label: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in label).strip("_") or "profile"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sequence)}-{safe}.prof"
+
+
+def save(profiler: cProfile.Profile, label: str, directory: Optional[str] = None) -> str:
+    """Write the profile as a pstats file; returns its path."""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _filename(label))
+    profiler.dump_stats(path)
+    return path
+
+
+def report(profiler: cProfile.Profile, top: int = PROFILE_TOP, sort: str = "cumulative") -> str:
+    """The pstats text report of the `top` functions."""
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort).print_stats(top)
+    return out.getvalue()
+
+
+def install_request_profiling(app: Any, enabled: bool = PROFILE_REQUESTS) -> None:
+    """Profile requests carrying `_profile=1` when `enabled` (PROFILE_REQUESTS)."""
+    if not enabled:
+        return
+    from flask import Response, g, request
+
+    def _stop() -> Optional[cProfile.Profile]:
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _request_lock.release()
+        return profiler
+
+    @app.before_request
+    def _profile_start():
+        if request.args.get("_profile") not in ("1", "true"):
+            return
+        _request_lock.acquire()
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+    @app.after_request
+    def _profile_report(response):
+        if "_profiler" not in g:
+            return response
+        try:
+            if not response.direct_passthrough:
+                size = len(response.get_data())  # runs a streamed body inside the profile
+            else:
+                size = response.content_length
+        finally:
+            profiler = _stop()
+        path = save(profiler, f"{request.method}-{request.path}")
+        header = (f"{request.method} {request.full_path} -> {response.status}, "
+                  f"{size if size is not None else '?'} bytes, {response.mimetype}\n")
+        return Response(header + report(profiler), mimetype="text/plain",
+                        headers={"X-Profile-File": path, "X-Profiled-Status": str(response.status_code),
+                                 "Cache-Control": "no-store"})
+
+    @app.teardown_request
+    def _profile_abort(exc):
+        # after_request is skipped when the view raised
+        _stop()
+
+
+class PhaseProfiler:
+    """cProfile per named phase of a batch job; a disabled instance only runs the code.
+
+        phases = PhaseProfiler("denormalization", enabled=args.profile)
+        with phases.phase("extract"):
+            ...
+        phases.finish()   # one pstats file per phase, plus a summary
+
+    A phase entered several times (once per chunk) accumulates into one profile.
+    """
+
+    def __init__(self, job: str, enabled: bool = True, directory: Optional[str] = None):
+        self.job = job
+        self.enabled = enabled
+        self.directory = directory
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        profiler = self._profiles.setdefault(name, cProfile.Profile())
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._seconds[name] = self._seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, top: int = 5) -> Dict[str, str]:
+        """Save every phase and print its wall time, file and `top` functions; returns name -> path."""
+        paths: Dict[str, str] = {}
+        if not self.enabled:
+            return paths
+        total = sum(self._seconds.values()) or 1e-9
+        print(f"Profile of {self.job} by phase:")
+        for name, profiler in self._profiles.items():
+            paths[name] = save(profiler, f"{self.job}-{name}", self.directory)
+            secs = self._seconds[name]
+            print(f"  {name:<14} {secs:8.2f}s  {secs / total:6.1%}  {paths[name]}")
+            stats = pstats.Stats(profiler).sort_stats("tottime")
+            for (filename, line, func) in stats.fcn_list[:top]:
+                tottime = stats.stats[(filename, line, func)][2]
+                print(f"      {tottime:8.3f}s  {func} ({os.path.basename(filename)}:{line})")
+        return paths
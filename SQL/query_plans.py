@@ -0,0 +1,245 @@
+"""Covering indexes and EXPLAIN plan checks for the MySQL queries behind Q1–Q4.
+
+    python -m SQL.query_plans apply [--dry-run]        # curated indexes in, redundant ones out
+    python -m SQL.query_plans check [--analyze]        # exit 1 when a plan regressed
+
+`apply` brings the live database to the index set of `transit schema.sql` plus
+`index and view.sql` (see load_gtfs.table_indexes), with one ALTER TABLE per table.
+An existing index is dropped only when the curated set already serves it (its columns
+lead a curated index or the primary key). Other unknown indexes are reported and kept.
+
+`check` runs EXPLAIN FORMAT=JSON on every statement of sql_utils.py and generate_csv.py,
+for one service and for the whole week. It fails when a plan:
+
+- reads a base table with a full scan (access_type ALL) of PLAN_SCAN_MIN_ROWS rows or more, or
+- runs a filesort over rows that are not yet grouped (GROUP BY by sorting, or ORDER BY on
+  the joined rows).
+
+Sorting grouped or materialized results, such as ORDER BY an aggregate, is expected and
+passes. `--analyze` also runs EXPLAIN ANALYZE (MySQL 8.0.18+), which executes each query,
+and prints its actual time.
+"""
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from . import generate_csv, sql_utils
+from .load_gtfs import index_columns, parse_index_file, parse_schema, redundant_indexes, table_indexes
+
+PLAN_SCAN_MIN_ROWS = int(os.getenv("PLAN_SCAN_MIN_ROWS", "1000"))
+
+# table -> index name -> (columns, unique)
+LiveIndexes = Dict[str, Dict[str, Tuple[Tuple[str, ...], bool]]]
+
+
+def live_indexes(conn: Any) -> LiveIndexes:
+    rows = conn.execute(text(
+        "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME\n"
+        "FROM information_schema.STATISTICS\n"
+        "WHERE TABLE_SCHEMA = DATABASE()\n"
+        "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+    )).all()
+    out: LiveIndexes = {}
+    for table, name, non_unique, column in rows:
+        cols, _ = out.setdefault(table, {}).get(name, ((), False))
+        out[table][name] = (cols + (column,), not int(non_unique))
+    return out
+
+
+def index_changes(live: LiveIndexes) -> Tuple[Dict[str, List[str]], List[str]]:
+    """(ALTER TABLE clauses per table, notes) that turn `live` into the curated index set."""
+    schema = parse_schema()
+    extra = parse_index_file()
+    alters: Dict[str, List[str]] = {}
+    notes: List[str] = []
+    for table, ddl in schema.items():
+        existing = live.get(table)
+        if existing is None:
+            notes.append(f"{table}: table not found")
+            continue
+        desired = [index_columns(c) for c in table_indexes(ddl, extra.get(table, []))]
+        clauses = []
+        for name, cols in desired:
+            have = existing.get(name)
+            if have is not None and have[0] == cols:
+                continue
+            if have is not None:
+                clauses.append(f"DROP INDEX `{name}`")
+            clauses.append(f"ADD INDEX `{name}` ({', '.join(f'`{c}`' for c in cols)})")
+        curated = {name for name, _ in desired}
+        others = [(name, cols) for name, (cols, unique) in existing.items()
+                  if name != 'PRIMARY' and not unique and name not in curated]
+        redundant = set(redundant_indexes(desired + others, ddl.primary_key))
+        for name, cols in others:
+            if name in redundant:
+                clauses.append(f"DROP INDEX `{name}`")
+            else:
+                notes.append(f"{table}.{name} ({', '.join(cols)}) is not in the curated set; left in place")
+        if clauses:
+            alters[table] = clauses
+    return alters, notes
+
+
+def apply_indexes(engine: Any, dry_run: bool = False) -> int:
+    with engine.connect() as conn:
+        alters, notes = index_changes(live_indexes(conn))
+        for table, clauses in alters.items():
+            sql = f"ALTER TABLE `{table}` " + ", ".join(clauses)
+            print(sql)
+            if not dry_run:
+                conn.execute(text(sql))
+        conn.commit()
+    for note in notes:
+        print(f"note: {note}")
+    if not alters:
+        print("Indexes already match the curated set")
+    return 0
+
+
+# --- Plan checks ---
+
+def plan_queries(conn: Any) -> List[Tuple[str, Any, Dict[str, Any]]]:
+    """(name, statement, params) of every Q1–Q4 query, for one service and the whole week."""
+    service = conn.execute(text("SELECT MIN(service_id) FROM trips")).scalar()
+    has_transfers = conn.execute(text(
+        "SELECT COUNT(*) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'stop_transfers'"
+    )).scalar()
+    limit_value = sql_utils._sanitize_limit(None)
+    queries: List[Tuple[str, Any, Dict[str, Any]]] = []
+    for label, service_filter in ((f"service {service}", str(service)), ("whole week", None)):
+        builders = [("q1", sql_utils._q1_statement), ("q3", sql_utils._q3_statement)]
+        if has_transfers:
+            builders.append(("q3_clusters", sql_utils._q3_cluster_statement))
+        for name, build in builders:
+            sql, params, _ = build(service_filter, None)
+            queries.append((f"sql_utils.{name} ({label})", sql, params))
+        if service_filter is None:
+            queries.append((f"sql_utils.q2 global ({label})", sql_utils._q2_global_statement(limit_value), {}))
+            queries.append((f"sql_utils.q2 per service ({label})", sql_utils._q2_per_service_statement(limit_value), {}))
+        else:
+            sql, params = sql_utils._q2_service_statement(service_filter, limit_value)
+            queries.append((f"sql_utils.q2 ({label})", sql, params))
+        sql, params = sql_utils._q4_data_statement(service_filter, limit_value)
+        queries.append((f"sql_utils.q4 top routes ({label})", sql, params))
+        sql, params = sql_utils._q4_data_statement(service_filter)
+        queries.append((f"sql_utils.q4 all routes ({label})", sql, params))
+        for name in ("q2", "q4"):
+            sql, params = sql_utils.export_statement(name, service_filter, str(limit_value))
+            queries.append((f"sql_utils.export {name} ({label})", sql, params))
+    queries += [
+        (f"generate_csv.q1 (service {service})", generate_csv.Q1_SQL.format(where=generate_csv.Q1_SERVICE_WHERE),
+         {"sid": service}),
+        ("generate_csv.q1 (whole week)", generate_csv.Q1_SQL.format(where=""), {"sid": "4"}),
+        (f"generate_csv.q3 (service {service})", generate_csv.Q3_SQL.format(where=generate_csv.Q3_SERVICE_WHERE),
+         {"sid": service}),
+        ("generate_csv.q3 (whole week)", generate_csv.Q3_SQL.format(where=""), {"sid": "4"}),
+        ("generate_csv.q2", generate_csv.Q2_SQL, {}),
+        ("generate_csv.q4", generate_csv.Q4_SQL, {}),
+    ]
+    return queries
+
+
+def _prefixed(prefix: str, sql: Any, params: Dict[str, Any]) -> Any:
+    return sql_utils._service_text(f"{prefix} {getattr(sql, 'text', sql)}", params)
+
+
+def explain(conn: Any, sql: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    return json.loads(conn.execute(_prefixed("EXPLAIN FORMAT=JSON", sql, params), params).scalar_one())
+
+
+def explain_analyze_ms(conn: Any, sql: Any, params: Dict[str, Any]) -> Optional[float]:
+    """Actual time of the query's root node from EXPLAIN ANALYZE, in milliseconds."""
+    tree = conn.execute(_prefixed("EXPLAIN ANALYZE", sql, params), params).scalar_one()
+    m = re.search(r"actual time=[\d.]+\.\.([\d.]+)", tree)
+    return float(m.group(1)) if m else None
+
+
+def _tables(node: Any) -> List[Dict[str, Any]]:
+    """The tables read by one query block, without descending into materialized subqueries."""
+    if isinstance(node, list):
+        return [t for item in node for t in _tables(item)]
+    if not isinstance(node, dict):
+        return []
+    if "table_name" in node:
+        return [node]
+    return [t for key, value in node.items() if key != "materialized_from_subquery" for t in _tables(value)]
+
+
+def _materialized(table: Dict[str, Any]) -> bool:
+    return "materialized_from_subquery" in table or table.get("table_name", "").startswith("<")
+
+
+def plan_problems(plan: Any, min_rows: int = PLAN_SCAN_MIN_ROWS) -> List[str]:
+    """Full scans of base tables and filesorts of ungrouped rows in an EXPLAIN FORMAT=JSON plan."""
+    problems: List[str] = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+            return
+        if not isinstance(node, dict):
+            return
+        if "table_name" in node and not _materialized(node) and node.get("access_type") == "ALL":
+            rows = int(node.get("rows_examined_per_scan", 0))
+            if rows >= min_rows:
+                problems.append(f"full scan of {node['table_name']} ({rows:,} rows)")
+        for key, value in node.items():
+            if isinstance(value, dict) and value.get("using_filesort"):
+                grouped = "grouping_operation" in value or "duplicates_removal" in value \
+                    or any(_materialized(t) for t in _tables(value))
+                if key == "grouping_operation" or not grouped:
+                    names = ", ".join(t["table_name"] for t in _tables(value)) or "?"
+                    problems.append(f"filesort in {key} over {names}")
+            walk(value)
+
+    walk(plan)
+    return problems
+
+
+def check_plans(engine: Any, analyze: bool = False, min_rows: int = PLAN_SCAN_MIN_ROWS) -> int:
+    sql_utils.ensure_hourly_frequency_view(engine)
+    failed = 0
+    with engine.connect() as conn:
+        for name, sql, params in plan_queries(conn):
+            plan = explain(conn, sql, params)
+            problems = plan_problems(plan, min_rows)
+            cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost", "?")
+            line = f"{'FAIL' if problems else 'ok'}  {name:<44} cost {cost}"
+            if analyze:
+                ms = explain_analyze_ms(conn, sql, params)
+                line += f"  actual {ms:.0f} ms" if ms is not None else ""
+            print(line)
+            for problem in problems:
+                print(f"      {problem}")
+            failed += bool(problems)
+    print(f"{failed} regressed plan(s)" if failed else "All plans use indexes")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Covering indexes and EXPLAIN plan checks for Q1–Q4 (MySQL)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    apply = sub.add_parser("apply", help="Create the curated indexes and drop the ones they make redundant")
+    apply.add_argument("--dry-run", action="store_true", help="Print the ALTER TABLE statements only")
+    check = sub.add_parser("check", help="EXPLAIN every query; exit 1 on full scans or filesorts of ungrouped rows")
+    check.add_argument("--analyze", action="store_true", help="Also run EXPLAIN ANALYZE and print actual times")
+    check.add_argument("--min-rows", type=int, default=PLAN_SCAN_MIN_ROWS,
+                       help="Smallest full table scan reported (PLAN_SCAN_MIN_ROWS)")
+    args = parser.parse_args(argv)
+
+    engine = sql_utils.get_engine()
+    if args.command == "apply":
+        return apply_indexes(engine, dry_run=args.dry_run)
+    return check_plans(engine, analyze=args.analyze, min_rows=args.min_rows)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""GTFS-Realtime TripUpdates laid over the memory-mapped timetables.
+
+The overlay keeps one int32 delay per departure row of a `TimetableFile`
+(NO_PREDICTION, CANCELED, or seconds late), plus an index from trip to its rows
+in stop_sequence order. Ingesting a feed compares every entity with the one of the
+same id in the previous feed and re-applies only the trips whose updates changed, so
+a feed costs O(changed trips), not O(timetable). Requests just index the delay array.
+
+Feeds are read from REALTIME_FEED: a .pb file that a fetcher overwrites, or a
+directory of recorded feeds (the newest *.pb is used). Like the timetable file,
+the path is re-checked at most every REALTIME_POLL_SECONDS, on the request path,
+so no thread has to survive a pre-fork. Feeds are decoded by a small reader for
+the protobuf wire format that knows the handful of TripUpdate fields used here.
+A feed that does not decode (a half-written file, say) is logged and skipped, and the
+last good overlay stays in use.
+
+    python -m SQL.realtime show FEED.pb           # decoded trip updates as JSON
+    python -m SQL.realtime replay DIR             # ingest recorded feeds in name order
+"""
+import datetime as dt
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from .timetable_file import CANCELED, NO_PREDICTION, TIMETABLE_FILE, TimetableFile
+
+REALTIME_FEED = os.getenv("REALTIME_FEED", "")
+REALTIME_POLL_SECONDS = float(os.getenv("REALTIME_POLL_SECONDS", "15"))
+REALTIME_TZ = os.getenv("REALTIME_TZ", "America/Toronto")  # agency_timezone, for absolute event times
+
+# Enum values from gtfs-realtime.proto
+TRIP_CANCELED = 3
+STOP_SKIPPED = 1
+STOP_NO_DATA = 2
+DIFFERENTIAL = 1
+
+logger = logging.getLogger('transit.realtime')
+
+
+# --- Protobuf wire format ---
+
+def _varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("truncated protobuf varint")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf: bytes) -> Iterator[Tuple[int, Any, int, int]]:
+    """(field number, value, start, end) per field; length-delimited values are bytes."""
+    pos, end = 0, len(buf)
+    while pos < end:
+        start = pos
+        key, pos = _varint(buf, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+        if pos > end:
+            raise ValueError("truncated protobuf field")
+        yield number, value, start, pos
+
+
+def _int32(value: int) -> int:
+    """A negative int32 is encoded as a 64-bit two's-complement varint."""
+    value &= 0xFFFFFFFFFFFFFFFF
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _message(buf: bytes, schema: Dict[int, str]) -> Dict[str, Any]:
+    """Named fields of one message; repeated fields (names ending in []) become lists."""
+    out: Dict[str, Any] = {}
+    for number, value, _, _ in _fields(buf):
+        name = schema.get(number)
+        if name is None:
+            continue
+        if name.endswith('[]'):
+            out.setdefault(name[:-2], []).append(value)
+        else:
+            out[name] = value
+    return out
+
+
+def _text(value: Optional[bytes]) -> Optional[str]:
+    return None if value is None else bytes(value).decode('utf-8')
+
+
+def _event(buf: Optional[bytes]) -> Optional[Dict[str, int]]:
+    if buf is None:
+        return None
+    e = _message(buf, {1: 'delay', 2: 'time'})
+    if 'delay' in e:
+        e['delay'] = _int32(e['delay'])
+    return e
+
+
+def parse_trip_update(buf: bytes) -> Dict[str, Any]:
+    """One TripUpdate message as a plain dict; ValueError when it does not decode."""
+    tu = _message(buf, {1: 'trip', 2: 'stop_time_update[]', 5: 'delay'})
+    trip = _message(tu.get('trip', b''), {1: 'trip_id', 3: 'start_date', 4: 'schedule_relationship'})
+    updates = []
+    for raw in tu.get('stop_time_update', []):
+        stu = _message(raw, {1: 'stop_sequence', 2: 'arrival', 3: 'departure', 4: 'stop_id',
+                             5: 'schedule_relationship'})
+        updates.append({
+            "stop_sequence": stu.get('stop_sequence'),
+            "stop_id": _text(stu.get('stop_id')),
+            "arrival": _event(stu.get('arrival')),
+            "departure": _event(stu.get('departure')),
+            "schedule_relationship": stu.get('schedule_relationship', 0),
+        })
+    start_date = _text(trip.get('start_date'))
+    if start_date:
+        dt.datetime.strptime(start_date, '%Y%m%d')
+    return {
+        "trip_id": _text(trip.get('trip_id')),
+        "start_date": start_date,
+        "schedule_relationship": trip.get('schedule_relationship', 0),
+        "delay": _int32(tu['delay']) if 'delay' in tu else None,
+        "stop_time_updates": updates,
+    }
+
+
+def parse_feed(buf: bytes) -> Tuple[Dict[str, Any], List[Tuple[str, bool, Optional[bytes]]]]:
+    """FeedMessage -> (header, [(entity id, is_deleted, TripUpdate bytes or None)])."""
+    top = _message(buf, {1: 'header', 2: 'entity[]'})
+    header = _message(top.get('header', b''), {2: 'incrementality', 3: 'timestamp'})
+    entities = []
+    for raw in top.get('entity', []):
+        e = _message(raw, {1: 'id', 2: 'is_deleted', 3: 'trip_update'})
+        entities.append((_text(e.get('id')) or '', bool(e.get('is_deleted', 0)), e.get('trip_update')))
+    return header, entities
+
+
+def change_key(trip_update: bytes) -> bytes:
+    """The TripUpdate without its timestamp, which producers bump on every feed even when
+    the prediction did not move."""
+    return b''.join(trip_update[start:end] for number, _, start, end in _fields(trip_update) if number != 4)
+
+
+# --- The overlay ---
+
+class RealtimeOverlay:
+    """Per-departure delays for one timetable generation, updated feed by feed."""
+
+    def __init__(self, timetable: TimetableFile, tz: str = REALTIME_TZ):
+        self.timetable = timetable
+        self.tz = ZoneInfo(tz)
+        self.delays = np.full(len(timetable.departures), NO_PREDICTION, dtype=np.int32)
+        self._trip_index = {t: i for i, t in enumerate(timetable.trip_ids)}
+        # Rows of each trip, contiguous and in stop_sequence order
+        self._rows = np.lexsort((timetable.stop_sequences, timetable.trips))
+        self._trip_offsets = np.searchsorted(timetable.trips[self._rows], np.arange(len(timetable.trip_ids) + 1))
+        group_stop = np.repeat(np.arange(len(timetable.stop_ids)), np.diff(timetable.stop_offsets))
+        self._row_stop = np.repeat(group_stop, np.diff(timetable.group_offsets))
+        self._entities: Dict[str, Tuple[bytes, Optional[int]]] = {}
+        self.feed_timestamp: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def trip_rows(self, trip: int) -> np.ndarray:
+        return self._rows[self._trip_offsets[trip]:self._trip_offsets[trip + 1]]
+
+    def _service_midnight(self, start_date: Optional[str], scheduled: int, event_time: int) -> int:
+        """Epoch of the service day's 'noon minus 12h', the origin of GTFS clock times."""
+        if start_date:
+            days = [dt.datetime.strptime(start_date, '%Y%m%d').date()]
+        else:
+            # Without start_date, the service day that puts the event nearest its schedule
+            today = dt.datetime.fromtimestamp(event_time, self.tz).date()
+            days = [today - dt.timedelta(days=1), today]
+        origins = [int(dt.datetime.combine(d, dt.time(12), self.tz).timestamp()) - 43200 for d in days]
+        return min(origins, key=lambda o: abs(event_time - o - scheduled))
+
+    def _apply(self, tu: Dict[str, Any]) -> Optional[int]:
+        """Write one trip's delays; returns its trip code (None for a trip not in the timetable)."""
+        trip = self._trip_index.get(tu["trip_id"])
+        if trip is None:
+            return None
+        rows = self.trip_rows(trip)
+        delays = self.delays
+        if tu["schedule_relationship"] == TRIP_CANCELED:
+            delays[rows] = CANCELED
+            return trip
+        delays[rows] = NO_PREDICTION if tu["delay"] is None else tu["delay"]
+        sequences = self.timetable.stop_sequences[rows]
+        stops = self._row_stop[rows]
+        skipped = []
+        positions = []
+        for stu in tu["stop_time_updates"]:
+            if stu["stop_sequence"] is not None:
+                at = np.flatnonzero(sequences == stu["stop_sequence"])
+            else:
+                at = np.flatnonzero(stops == self.timetable.stop_index.get(stu["stop_id"], -2))
+            if len(at):
+                positions.append((int(at[0]), stu))
+        # A delay holds for the following stops until the next update overrides it
+        for p, stu in sorted(positions, key=lambda x: x[0]):
+            if stu["schedule_relationship"] == STOP_SKIPPED:
+                skipped.append(p)
+                continue
+            if stu["schedule_relationship"] == STOP_NO_DATA:
+                delays[rows[p:]] = NO_PREDICTION
+                continue
+            event = stu["departure"] or stu["arrival"] or {}
+            if 'delay' in event:
+                delay = event['delay']
+            elif 'time' in event:
+                scheduled = int(self.timetable.departures[rows[p]])
+                delay = event['time'] - self._service_midnight(tu["start_date"], scheduled, event['time']) - scheduled
+            else:
+                continue
+            delays[rows[p:]] = delay
+        delays[rows[skipped]] = CANCELED
+        return trip
+
+    def _clear(self, trip: Optional[int]) -> None:
+        if trip is not None:
+            self.delays[self.trip_rows(trip)] = NO_PREDICTION
+
+    def ingest(self, feed: bytes) -> Dict[str, Any]:
+        """Apply one FeedMessage, touching only entities that are new, changed or gone.
+
+        The feed and every changed TripUpdate are decoded before anything is applied, so
+        a feed that raises ValueError leaves the overlay as it was.
+        """
+        header, entities = parse_feed(feed)
+        stats = {"entities": len(entities), "changed": 0, "removed": 0, "unknown_trips": 0}
+        with self._lock:
+            seen = set()
+            # eid -> None (gone) or (change key, decoded TripUpdate)
+            changes: Dict[str, Optional[Tuple[bytes, Dict[str, Any]]]] = {}
+            for eid, deleted, trip_update in entities:
+                seen.add(eid)
+                old = self._entities.get(eid)
+                if deleted or trip_update is None:
+                    if old is not None:
+                        changes[eid] = None
+                    continue
+                key = change_key(trip_update)
+                if old is None or old[0] != key:
+                    changes[eid] = (key, parse_trip_update(trip_update))
+            for eid, change in changes.items():
+                old = self._entities.pop(eid, None)
+                if old is not None:
+                    self._clear(old[1])
+                if change is None:
+                    stats["removed"] += 1
+                    continue
+                trip = self._apply(change[1])
+                if trip is None:
+                    stats["unknown_trips"] += 1
+                self._entities[eid] = (change[0], trip)
+                stats["changed"] += 1
+            # A full-dataset feed drops every trip it no longer mentions
+            if header.get('incrementality', 0) != DIFFERENTIAL:
+                for eid in [e for e in self._entities if e not in seen]:
+                    self._clear(self._entities.pop(eid)[1])
+                    stats["removed"] += 1
+            self.feed_timestamp = header.get('timestamp', self.feed_timestamp)
+        stats["feed_timestamp"] = self.feed_timestamp
+        return stats
+
+    def status(self) -> Dict[str, Any]:
+        """The "realtime" block of a response."""
+        ts = self.feed_timestamp
+        return {"feed_timestamp": ts, "age_s": None if ts is None else max(0, int(time.time()) - ts),
+                "trip_updates": len(self._entities)}
+
+
+def feed_path(source: str = REALTIME_FEED) -> Optional[str]:
+    """The feed file to read: `source` itself, or the newest *.pb in a directory of them."""
+    if not source:
+        return None
+    if os.path.isdir(source):
+        feeds = glob.glob(os.path.join(source, '*.pb'))
+        return max(feeds, key=os.path.getmtime) if feeds else None
+    return source if os.path.exists(source) else None
+
+
+# generation -> [overlay, checked at, (path, mtime_ns, size) of the last feed read, whether one ingested]
+_overlays: Dict[str, List[Any]] = {}
+_overlays_lock = threading.Lock()
+
+
+def overlay_for(timetable: TimetableFile, source: str = REALTIME_FEED) -> Optional[RealtimeOverlay]:
+    """The overlay for `timetable`, refreshed from `source` at most every REALTIME_POLL_SECONDS.
+
+    None when no feed is configured or none has been read yet.
+    """
+    if not source:
+        return None
+    now = time.monotonic()
+    with _overlays_lock:
+        entry = _overlays.get(timetable.generation)
+        if entry is not None and now - entry[1] < REALTIME_POLL_SECONDS:
+            return entry[0] if entry[3] else None
+        if entry is None:
+            # Only the current generation is kept; the old one's delays index old rows
+            _overlays.clear()
+            entry = _overlays[timetable.generation] = [RealtimeOverlay(timetable), now, None, False]
+        entry[1] = now
+        try:
+            path = feed_path(source)
+            st = os.stat(path) if path is not None else None
+        except FileNotFoundError:
+            st = None  # replaced while being looked up; picked up on the next poll
+        if st is not None:
+            identity = (path, st.st_mtime_ns, st.st_size)
+            if identity != entry[2]:
+                # A bad feed is not retried until the file changes
+                entry[2] = identity
+                try:
+                    with open(path, 'rb') as f:
+                        entry[0].ingest(f.read())
+                    entry[3] = True
+                except (OSError, ValueError) as e:
+                    logger.warning("Skipping realtime feed %s: %s", path, e)
+        return entry[0] if entry[3] else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="GTFS-Realtime TripUpdates over the timetable file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="Print a feed's trip updates as JSON")
+    show.add_argument("feed")
+    show.add_argument("--limit", type=int, default=20)
+    replay = sub.add_parser("replay", help="Ingest recorded feeds in file-name order and report each")
+    replay.add_argument("directory")
+    replay.add_argument("--timetable", default=TIMETABLE_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        with open(args.feed, 'rb') as f:
+            feed = f.read()
+        header, entities = parse_feed(feed)
+        updates = [{"entity_id": eid, **parse_trip_update(tu)}
+                   for eid, deleted, tu in entities if tu is not None and not deleted][:args.limit]
+        print(json.dumps({"header": header, "entities": len(entities), "trip_updates": updates}, indent=2))
+        return 0
+
+    overlay = RealtimeOverlay(TimetableFile(args.timetable))
+    for path in sorted(glob.glob(os.path.join(args.directory, '*.pb'))):
+        with open(path, 'rb') as f:
+            feed = f.read()
+        start = time.perf_counter()
+        stats = overlay.ingest(feed)
+        predicted = int(np.count_nonzero(overlay.delays != NO_PREDICTION))
+        print(json.dumps({"feed": os.path.basename(path), **stats, "predicted_departures": predicted,
+                          "ms": round((time.perf_counter() - start) * 1000, 2)}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Graceful degradation for the Flask apps: serve the last good response when a query times out.
+
+A view wrapped with `serve_stale_on` remembers its latest successful (buffered, 200)
+response per URL. If a later call raises an error the caller classifies as a timeout
+(statement timeout, pool exhaustion), the remembered body is replayed with staleness
+headers; with nothing remembered the client gets a 503 with Retry-After. The error
+itself (its SQL and parameters) is logged, never sent to the client.
+
+Streamed responses (Q1/Q3 with limit=all or NDJSON) are not remembered, since their
+bodies are unbounded: a timeout before their first row gets the 503, and one after it
+ends the stream (see json_provider.stream_items).
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Optional, Tuple
+
+from .metrics import REGISTRY, endpoint_label
+
+STALE_CACHE_ENTRIES = int(os.getenv("STALE_CACHE_ENTRIES", "256"))
+STALE_CACHE_MAX_BYTES = int(os.getenv("STALE_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+RETRY_AFTER_SECONDS = int(os.getenv("DEGRADED_RETRY_AFTER", "5"))
+
+logger = logging.getLogger('transit.degraded')
+
+DEGRADED_RESPONSES = REGISTRY.counter(
+    'degraded_responses_total', 'Requests whose query timed out, by endpoint and what was served.')
+
+
+class StaleCache:
+    """Bounded LRU of response bodies keyed by request path + query string."""
+
+    def __init__(self, max_entries: int = STALE_CACHE_ENTRIES, max_bytes: int = STALE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, key: str, response: Any) -> None:
+        if response.status_code != 200 or response.is_streamed or self.max_entries <= 0:
+            return
+        body = response.get_data()
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), body, response.mimetype)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Tuple[float, bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+
+def serve_stale_on(is_timeout: Callable[[BaseException], bool], cache: StaleCache) -> Callable:
+    """Decorator: replay the cached response (marked stale) when the view raises a timeout."""
+    from flask import jsonify, make_response, request
+
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = request.full_path
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception as e:
+                if not is_timeout(e):
+                    raise
+                logger.warning("%s timed out: %s", key, e)
+                entry = cache.get(key)
+                if entry is None:
+                    DEGRADED_RESPONSES.inc(endpoint=endpoint_label(), served='unavailable')
+                    response = jsonify({"error": "Query timed out and no cached result is available"})
+                    response.status_code = 503
+                    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+                    return response
+                stored_at, body, mimetype = entry
+                DEGRADED_RESPONSES.inc(endpoint=endpoint_label(), served='stale')
+                age = max(int(time.time() - stored_at), 0)
+                response = make_response(body)
+                response.mimetype = mimetype
+                response.headers['Warning'] = '110 - "Response is Stale"'
+                response.headers['X-Stale-Age'] = str(age)
+                return response
+            cache.remember(key, response)
+            return response
+
+        return wrapper
+
+    return decorator
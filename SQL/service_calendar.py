@@ -0,0 +1,226 @@
+"""Which services run on a given date, from GTFS calendar (+ calendar_dates) as per-service bitsets.
+
+Each service gets one bit per day of the feed's date range (weekday flags within
+start_date..end_date, then calendar_dates additions/removals), packed 8 days to a byte.
+Days with the same set of active services share a pattern, so resolving a date is an
+index into the day array and a tuple lookup, independent of the number of services.
+
+    python -m SQL.service_calendar dataset ../dataset --date 2024-03-15
+    python -m SQL.service_calendar mysql
+"""
+import datetime as dt
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+DATASET_DIR = os.getenv("DATASET_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dataset'))
+CALENDAR_FILE = 'service_calendar.npz'
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+# calendar_dates.exception_type
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+
+def parse_date(value: Any) -> dt.date:
+    """YYYYMMDD / YYYY-MM-DD text (or a date, datetime, Timestamp) -> date; ValueError otherwise."""
+    if isinstance(value, dt.datetime):
+        return value.date()
+    if isinstance(value, dt.date):
+        return value
+    text = str(value).strip()
+    for fmt in ('%Y%m%d', '%Y-%m-%d'):
+        try:
+            return dt.datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"date must be YYYYMMDD or YYYY-MM-DD, got {text!r}")
+
+
+class ServiceCalendar:
+    """Per-service day bitsets over [start, start + n_days)."""
+
+    def __init__(self, start: dt.date, n_days: int, service_ids: List[str], bits: np.ndarray):
+        self.start = start
+        self.n_days = n_days
+        self.service_ids = [str(s) for s in service_ids]
+        # bits[s] is service s's bitset: day d is bit d % 8 of byte d // 8
+        self.bits = bits
+        self._service_index = {s: i for i, s in enumerate(self.service_ids)}
+        active = np.unpackbits(bits, axis=1, count=n_days, bitorder='little').astype(bool)
+        patterns, day_pattern = np.unique(active.T, axis=0, return_inverse=True)
+        self._day_pattern = day_pattern.reshape(-1).astype(np.int32)
+        self._patterns = [tuple(self.service_ids[i] for i in np.flatnonzero(p)) for p in patterns]
+
+    @property
+    def end(self) -> dt.date:
+        return self.start + dt.timedelta(days=max(self.n_days - 1, 0))
+
+    def covers(self, day: dt.date) -> bool:
+        return 0 <= (day - self.start).days < self.n_days
+
+    def services_on(self, day: Any) -> Tuple[str, ...]:
+        """Service ids running on `day` (empty outside the feed's date range)."""
+        offset = (parse_date(day) - self.start).days
+        if not 0 <= offset < self.n_days:
+            return ()
+        return self._patterns[self._day_pattern[offset]]
+
+    def runs_on(self, service_id: str, day: Any) -> bool:
+        s = self._service_index.get(str(service_id))
+        offset = (parse_date(day) - self.start).days
+        if s is None or not 0 <= offset < self.n_days:
+            return False
+        return bool(self.bits[s, offset >> 3] >> (offset & 7) & 1)
+
+    def active_days(self, service_id: str) -> int:
+        s = self._service_index.get(str(service_id))
+        return 0 if s is None else int(np.unpackbits(self.bits[s], count=self.n_days, bitorder='little').sum())
+
+    def save(self, path: str) -> None:
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, start=np.int64(self.start.toordinal()), n_days=np.int64(self.n_days),
+                 service_ids=np.asarray(self.service_ids, dtype=str), bits=self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ServiceCalendar':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(dt.date.fromordinal(int(data['start'])), int(data['n_days']),
+                       [str(s) for s in data['service_ids']], data['bits'])
+
+    @classmethod
+    def from_frames(cls, calendar: pd.DataFrame, calendar_dates: Optional[pd.DataFrame] = None) -> 'ServiceCalendar':
+        """Build from calendar (and calendar_dates) rows; dates may be text, dates or timestamps."""
+        cal_rows = [
+            (str(r['service_id']), parse_date(r['start_date']), parse_date(r['end_date']),
+             [str(r[d]).strip() in ('1', 'True') for d in WEEKDAYS])
+            for r in calendar.to_dict('records')
+        ]
+        exceptions = [] if calendar_dates is None else [
+            (str(r['service_id']), parse_date(r['date']), int(r['exception_type']))
+            for r in calendar_dates.to_dict('records')
+        ]
+        service_ids = sorted({row[0] for row in cal_rows} | {row[0] for row in exceptions})
+        days = [d for row in cal_rows for d in row[1:3]] + [row[1] for row in exceptions]
+        if not days:
+            return cls(dt.date.today(), 0, service_ids, np.zeros((len(service_ids), 0), dtype=np.uint8))
+        start = min(days)
+        n_days = (max(days) - start).days + 1
+        index = {s: i for i, s in enumerate(service_ids)}
+
+        active = np.zeros((len(service_ids), n_days), dtype=bool)
+        weekday = (start.weekday() + np.arange(n_days)) % 7
+        for sid, first, last, flags in cal_rows:
+            lo, hi = (first - start).days, (last - start).days + 1
+            if hi > lo:
+                active[index[sid], lo:hi] = np.asarray(flags)[weekday[lo:hi]]
+        for sid, day, kind in exceptions:
+            if kind in (SERVICE_ADDED, SERVICE_REMOVED):
+                active[index[sid], (day - start).days] = kind == SERVICE_ADDED
+        return cls(start, n_days, service_ids, np.packbits(active, axis=1, bitorder='little'))
+
+
+def _read_optional_csv(path: str) -> Optional[pd.DataFrame]:
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                       skipinitialspace=True).rename(columns=str.strip)
+
+
+def calendar_from_dataset(dataset_dir: Optional[str] = None) -> ServiceCalendar:
+    """calendar.txt (+ calendar_dates.txt); either file may be missing but not both."""
+    dataset_dir = dataset_dir or DATASET_DIR
+    calendar = _read_optional_csv(os.path.join(dataset_dir, 'calendar.txt'))
+    calendar_dates = _read_optional_csv(os.path.join(dataset_dir, 'calendar_dates.txt'))
+    if calendar is None and calendar_dates is None:
+        raise FileNotFoundError(f"No calendar.txt or calendar_dates.txt in {dataset_dir}")
+    if calendar is None:
+        calendar = pd.DataFrame(columns=['service_id', *WEEKDAYS, 'start_date', 'end_date'])
+    return ServiceCalendar.from_frames(calendar, calendar_dates)
+
+
+def calendar_from_mysql(engine) -> ServiceCalendar:
+    from sqlalchemy import inspect, text
+
+    with engine.connect() as conn:
+        calendar = pd.read_sql(text("SELECT * FROM calendar"), conn)
+        calendar_dates = None
+        if inspect(conn).has_table('calendar_dates'):
+            calendar_dates = pd.read_sql(text("SELECT service_id, date, exception_type FROM calendar_dates"), conn)
+    return ServiceCalendar.from_frames(calendar, calendar_dates)
+
+
+def _cache_paths() -> Iterable[str]:
+    from .duckdb_backend import SNAPSHOT_DIR
+    from .numpy_engine import CACHE_DIR
+
+    return (os.path.join(SNAPSHOT_DIR, CALENDAR_FILE), os.path.join(CACHE_DIR, CALENDAR_FILE))
+
+
+_calendar: Optional[ServiceCalendar] = None
+
+
+def get_calendar() -> ServiceCalendar:
+    """The calendar saved next to the snapshots / NumPy cache, else DATASET_DIR, else MySQL.
+
+    Raises LookupError when none of them is available.
+    """
+    global _calendar
+    if _calendar is None:
+        for path in _cache_paths():
+            if os.path.exists(path):
+                _calendar = ServiceCalendar.load(path)
+                return _calendar
+        try:
+            _calendar = calendar_from_dataset()
+        except FileNotFoundError:
+            from .sql_utils import get_engine
+
+            try:
+                _calendar = calendar_from_mysql(get_engine())
+            except Exception as e:
+                raise LookupError(f"No service calendar available ({e})") from e
+    return _calendar
+
+
+def _summary(calendar: ServiceCalendar) -> Dict[str, Any]:
+    return {
+        "start": calendar.start.isoformat(),
+        "end": calendar.end.isoformat(),
+        "services": {s: calendar.active_days(s) for s in calendar.service_ids},
+        "day_patterns": len(calendar._patterns),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Resolve dates to running services from the GTFS calendar")
+    parser.add_argument("source", choices=["dataset", "mysql"])
+    parser.add_argument("dataset", nargs="?", default=None, help="GTFS directory (defaults to DATASET_DIR)")
+    parser.add_argument("--date", action="append", default=[], help="YYYYMMDD or YYYY-MM-DD; repeatable")
+    parser.add_argument("--out", default=None, help=f"Save the bitsets ({CALENDAR_FILE})")
+    args = parser.parse_args(argv)
+
+    if args.source == "mysql":
+        from .sql_utils import get_engine
+
+        calendar = calendar_from_mysql(get_engine())
+    else:
+        calendar = calendar_from_dataset(args.dataset)
+    print(json.dumps(_summary(calendar), indent=2))
+    for value in args.date:
+        print(f"{parse_date(value).isoformat()}: {', '.join(calendar.services_on(value)) or '(no service)'}")
+    if args.out:
+        calendar.save(args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
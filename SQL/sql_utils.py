@@ -1,8 +1,28 @@
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, exc, text
 from sqlalchemy.engine import Engine, Result
+from sqlalchemy.pool import QueuePool
+
+from .metrics import POOL_TIMEOUTS, POOL_WAIT, STATEMENT_TIMEOUTS, instrument_engine, instrument_pool
+
+
+# Rows fetched per round trip when streaming unbounded (limit=all) results
+STREAM_BUFFER_ROWS = int(os.getenv("STREAM_BUFFER_ROWS", "1000"))
+
+# MySQL errors raised when max_execution_time stops a SELECT
+STATEMENT_TIMEOUT_ERRORS = {3024, 1317}
+
+# Query the integer-keyed tables of 'compact schema.sql' (python -m SQL.load_gtfs --compact)
+# instead of the VARCHAR-keyed stop_times/trips; results still carry the GTFS ids
+COMPACT_SCHEMA = os.getenv("MYSQL_COMPACT_SCHEMA", "false").lower() == "true"
+HOURLY_VIEW = "vw_hourly_frequency_compact" if COMPACT_SCHEMA else "vw_hourly_frequency"
+
+_statement_timeout_ms: ContextVar[Optional[int]] = ContextVar("statement_timeout_ms", default=None)
 
 
 def get_mysql_connection_url() -> str:
@@ -14,10 +34,83 @@ def get_mysql_connection_url() -> str:
     return f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}"
 
 
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection."""
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+
 def get_engine() -> Engine:
     echo = os.getenv("MYSQL_ECHO", "false").lower() == "true"
     url = get_mysql_connection_url()
-    return create_engine(url, echo=echo, pool_pre_ping=True, pool_recycle=300)
+    max_overflow = int(os.getenv("MYSQL_MAX_OVERFLOW", "10"))
+    engine = create_engine(
+        url, echo=echo, pool_pre_ping=True, pool_recycle=300,
+        poolclass=TimedQueuePool,
+        pool_size=int(os.getenv("MYSQL_POOL_SIZE", "5")),
+        max_overflow=max_overflow,
+        pool_timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "10")),
+    )
+    event.listen(engine, "before_cursor_execute", _apply_statement_timeout)
+    event.listen(engine, "handle_error", _count_statement_timeouts)
+    instrument_pool(engine, max_overflow)
+    return instrument_engine(engine)
+
+
+def statement_timeout_for(name: str) -> Optional[int]:
+    """Milliseconds from STATEMENT_TIMEOUT_MS_<NAME>, else STATEMENT_TIMEOUT_MS; None when unset/0."""
+    value = os.getenv(f"STATEMENT_TIMEOUT_MS_{name.upper()}") or os.getenv("STATEMENT_TIMEOUT_MS")
+    try:
+        ms = int(value) if value else 0
+    except ValueError:
+        return None
+    return ms if ms > 0 else None
+
+
+@contextmanager
+def statement_timeout(ms: Optional[int]) -> Iterator[None]:
+    """Cap SELECTs issued inside the block at `ms` milliseconds (MySQL max_execution_time)."""
+    token = _statement_timeout_ms.set(ms)
+    try:
+        yield
+    finally:
+        _statement_timeout_ms.reset(token)
+
+
+def _apply_statement_timeout(conn, cursor, statement, parameters, context, executemany) -> None:
+    ms = _statement_timeout_ms.get()
+    if context is not None:
+        ms = context.execution_options.get("statement_timeout_ms", ms)
+    ms = int(ms or 0)
+    # Session variable: only send SET when this pooled connection's value changes
+    if conn.info.get("max_execution_time", 0) != ms:
+        cursor.execute(f"SET SESSION max_execution_time = {ms}")
+        conn.info["max_execution_time"] = ms
+
+
+def is_timeout_error(error: BaseException) -> bool:
+    """True for pool checkout timeouts and statements stopped by max_execution_time."""
+    if isinstance(error, exc.TimeoutError):
+        return True
+    return _mysql_error_code(getattr(error, "orig", None)) in STATEMENT_TIMEOUT_ERRORS
+
+
+def _mysql_error_code(error: Optional[BaseException]) -> Optional[int]:
+    args = getattr(error, "args", None)
+    return args[0] if args else None
+
+
+def _count_statement_timeouts(context) -> None:
+    if _mysql_error_code(context.original_exception) in STATEMENT_TIMEOUT_ERRORS:
+        STATEMENT_TIMEOUTS.inc()
 
 
 def _sanitize_limit(limit_param: Optional[str]) -> Optional[int]:
@@ -37,25 +130,53 @@ def _sanitize_limit(limit_param: Optional[str]) -> Optional[int]:
         return 20
 
 
-def _service_id_filter(service_id_param: Optional[str]) -> Optional[str]:
+# None (every service), one service_id, or the services running on a date (see service_calendar)
+ServiceFilter = Union[None, str, Tuple[str, ...]]
+
+
+def _service_id_filter(service_id_param: Any) -> ServiceFilter:
+    if isinstance(service_id_param, (tuple, list, set, frozenset)):
+        service_ids = tuple(sorted({str(s) for s in service_id_param}))
+        return service_ids[0] if len(service_ids) == 1 else service_ids
     if service_id_param in {None, "", "4", 4}:
         return None
     return str(service_id_param)
 
 
-def ensure_hourly_frequency_view(engine: Engine) -> None:
-    with engine.begin() as conn:
-        exists_sql = text(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM information_schema.VIEWS
-            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vw_hourly_frequency'
-            """
-        )
-        cnt = conn.execute(exists_sql).scalar_one()
-        if int(cnt) == 0:
-            create_view_sql = text(
-                """
+def service_label(service_filter: ServiceFilter) -> Optional[str]:
+    """The service_id reported for a filter: several services are joined with commas."""
+    return ",".join(service_filter) if isinstance(service_filter, tuple) else service_filter
+
+
+def _service_condition(column: str, service_filter: ServiceFilter) -> str:
+    if isinstance(service_filter, tuple):
+        return f"{column} IN :service_ids"
+    return f"(:service_id IS NULL OR {column} = :service_id)"
+
+
+def _service_key_condition(column: str, service_filter: ServiceFilter) -> str:
+    """_service_condition for a service_key column of the compact schema."""
+    if isinstance(service_filter, tuple):
+        return f"{column} IN (SELECT service_key FROM service_keys WHERE service_id IN :service_ids)"
+    return (f"(:service_id IS NULL OR {column} = "
+            "(SELECT service_key FROM service_keys WHERE service_id = :service_id))")
+
+
+def _service_params(service_filter: ServiceFilter) -> Dict[str, Any]:
+    if isinstance(service_filter, tuple):
+        return {"service_ids": list(service_filter)}
+    return {"service_id": service_filter}
+
+
+def _service_text(sql: str, params: Dict[str, Any]) -> Any:
+    stmt = text(sql)
+    return stmt.bindparams(bindparam("service_ids", expanding=True)) if "service_ids" in params else stmt
+
+
+# The hourly view over the standard and the compact tables; same columns and GTFS ids.
+# The compact one groups on service_id (not its key) so a service filter is pushed into it.
+HOURLY_VIEWS = {
+    "vw_hourly_frequency": """
                 CREATE VIEW vw_hourly_frequency AS
                 SELECT
                     t.route_id,
@@ -65,58 +186,125 @@ def ensure_hourly_frequency_view(engine: Engine) -> None:
                 FROM stop_times st
                 JOIN trips t ON t.trip_id = st.trip_id
                 GROUP BY t.route_id, t.service_id, hour_of_day
-                """
-            )
-            conn.execute(create_view_sql)
+                """,
+    "vw_hourly_frequency_compact": """
+                CREATE VIEW vw_hourly_frequency_compact AS
+                SELECT
+                    rk.route_id,
+                    sk.service_id,
+                    st.departure_s DIV 3600 AS hour_of_day,
+                    COUNT(DISTINCT st.trip_key) AS trips_per_hour
+                FROM stop_times_compact st
+                JOIN trip_keys t ON t.trip_key = st.trip_key
+                JOIN route_keys rk ON rk.route_key = t.route_key
+                JOIN service_keys sk ON sk.service_key = t.service_key
+                GROUP BY rk.route_key, sk.service_id, hour_of_day
+                """,
+}
+
+
+def ensure_hourly_frequency_view(engine: Engine, view: str = HOURLY_VIEW) -> None:
+    with engine.begin() as conn:
+        exists_sql = text(
+            """
+            SELECT COUNT(*) AS cnt
+            FROM information_schema.VIEWS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :view
+            """
+        )
+        cnt = conn.execute(exists_sql, {"view": view}).scalar_one()
+        if int(cnt) == 0:
+            conn.execute(text(HOURLY_VIEWS[view]))
 
 
-def query_q1_busiest_stops(engine: Engine, service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
-    service_filter = _service_id_filter(service_id)
-    limit_value = _sanitize_limit(limit_param)
+def _format_q1_row(r: Any) -> Dict[str, Any]:
+    return {
+        "stop_id": r["stop_id"],
+        "stop_code": r.get("stop_code"),
+        "stop_name": r["stop_name"],
+        "stop_lat": float(f"{r['stop_lat']:.6f}"),
+        "stop_lon": float(f"{r['stop_lon']:.6f}"),
+        "total_trip_events": int(r["total_trip_events"]),
+        "num_unique_routes": int(r["num_unique_routes"]),
+    }
 
-    base_sql = (
-        "SELECT st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
-        "COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_id) AS num_unique_routes "
-        "FROM stop_times st "
-        "JOIN trips t ON t.trip_id = st.trip_id "
-        "JOIN stops s ON s.stop_id = st.stop_id "
-    )
-    where_clause = "WHERE (:service_id IS NULL OR t.service_id = :service_id) "
-    group_order = "GROUP BY st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon ORDER BY total_trip_events DESC "
-    limit_clause = f"LIMIT {limit_value}" if limit_value is not None else ""
 
-    sql = text(base_sql + where_clause + group_order + limit_clause)
-    params = {"service_id": service_filter}
+def _format_q3_row(r: Any) -> Dict[str, Any]:
+    return {
+        "stop_id": r["stop_id"],
+        "stop_code": r.get("stop_code"),
+        "stop_name": r["stop_name"],
+        "stop_lat": float(f"{r['stop_lat']:.6f}"),
+        "stop_lon": float(f"{r['stop_lon']:.6f}"),
+        "num_unique_routes": int(r["num_unique_routes"]),
+    }
 
-    with engine.begin() as conn:
-        rows = conn.execute(sql, params).mappings().all()
 
-    result: List[Dict[str, Any]] = []
-    for r in rows:
-        result.append({
-            "stop_id": r["stop_id"],
-            "stop_code": r.get("stop_code"),
-            "stop_name": r["stop_name"],
-            "stop_lat": float(f"{r['stop_lat']:.6f}"),
-            "stop_lon": float(f"{r['stop_lon']:.6f}"),
-            "total_trip_events": int(r["total_trip_events"]),
-            "num_unique_routes": int(r["num_unique_routes"]),
-        })
-    return result
-
-
-def query_q3_transfer_points(engine: Engine, service_id: Optional[str], limit_param: Optional[str]) -> List[Dict[str, Any]]:
+def _format_q3_cluster_row(r: Any) -> Dict[str, Any]:
+    return {**_format_q3_row(r), "num_stops": int(r["num_stops"])}
+
+
+def _q1_statement(service_id: ServiceFilter, limit_param: Optional[str]) -> Tuple[Any, Dict[str, Any], Optional[int]]:
     service_filter = _service_id_filter(service_id)
     limit_value = _sanitize_limit(limit_param)
 
-    with_clause = (
-        "WITH UniqueStopRoutes AS (\n"
+    if COMPACT_SCHEMA:
+        # Count on the integer keys; GTFS ids and stop details are joined to one row per stop
+        select_sql = (
+            "SELECT sk.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
+            "c.total_trip_events, c.num_unique_routes "
+            "FROM (SELECT st.stop_key, COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_key) AS num_unique_routes "
+            "FROM stop_times_compact st "
+            "JOIN trip_keys t ON t.trip_key = st.trip_key "
+            f"WHERE {_service_key_condition('t.service_key', service_filter)} "
+            "GROUP BY st.stop_key) c "
+            "JOIN stop_keys sk ON sk.stop_key = c.stop_key "
+            "JOIN stops s ON s.stop_id = sk.stop_id "
+            "ORDER BY c.total_trip_events DESC "
+        )
+    else:
+        base_sql = (
+            "SELECT st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, "
+            "COUNT(*) AS total_trip_events, COUNT(DISTINCT t.route_id) AS num_unique_routes "
+            "FROM stop_times st "
+            "JOIN trips t ON t.trip_id = st.trip_id "
+            "JOIN stops s ON s.stop_id = st.stop_id "
+        )
+        where_clause = f"WHERE {_service_condition('t.service_id', service_filter)} "
+        group_order = "GROUP BY st.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon ORDER BY total_trip_events DESC "
+        select_sql = base_sql + where_clause + group_order
+    limit_clause = f"LIMIT {limit_value}" if limit_value is not None else ""
+
+    params = _service_params(service_filter)
+    sql = _service_text(select_sql + limit_clause, params)
+    return sql, params, limit_value
+
+
+def _unique_stop_routes_sql(service_filter: ServiceFilter) -> str:
+    """Body of the UniqueStopRoutes CTE of Q3: the distinct (stop_id, route_id) of the service."""
+    if COMPACT_SCHEMA:
+        return (
+            "    SELECT sk.stop_id, rk.route_id\n"
+            "    FROM (SELECT DISTINCT st.stop_key, t.route_key\n"
+            "          FROM stop_times_compact st\n"
+            "          JOIN trip_keys t ON t.trip_key = st.trip_key\n"
+            f"          WHERE {_service_key_condition('t.service_key', service_filter)}) u\n"
+            "    JOIN stop_keys sk ON sk.stop_key = u.stop_key\n"
+            "    JOIN route_keys rk ON rk.route_key = u.route_key\n"
+        )
+    return (
         "    SELECT DISTINCT st.stop_id, t.route_id\n"
         "    FROM stop_times st\n"
         "    JOIN trips t ON t.trip_id = st.trip_id\n"
-        "    WHERE (:service_id IS NULL OR t.service_id = :service_id)\n"
-        ")\n"
+        f"    WHERE {_service_condition('t.service_id', service_filter)}\n"
     )
+
+
+def _q3_statement(service_id: ServiceFilter, limit_param: Optional[str]) -> Tuple[Any, Dict[str, Any], Optional[int]]:
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+
+    with_clause = f"WITH UniqueStopRoutes AS (\n{_unique_stop_routes_sql(service_filter)})\n"
     main_sql = (
         "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, COUNT(USR.route_id) AS num_unique_routes\n"
         "FROM stops s\n"
@@ -126,26 +314,142 @@ def query_q3_transfer_points(engine: Engine, service_id: Optional[str], limit_pa
         "ORDER BY num_unique_routes DESC\n"
     )
     limit_clause = f"LIMIT {limit_value}" if limit_value is not None else ""
-    sql = text(with_clause + main_sql + limit_clause)
-    params = {"service_id": service_filter}
+    params = _service_params(service_filter)
+    sql = _service_text(with_clause + main_sql + limit_clause, params)
+    return sql, params, limit_value
+
+
+# Q3 over walking clusters: each served stop pools the routes of every served stop within
+# the stop_transfers radius, and a stop is reported only when no neighbour's cluster has
+# more routes (ties go to the smaller stop_id), so an interchange shows up once.
+Q3_CLUSTER_SELECT = (
+    "ServedStops AS (\n"
+    "    SELECT DISTINCT stop_id FROM UniqueStopRoutes\n"
+    "),\n"
+    "Walkable AS (\n"
+    "    SELECT stop_id AS hub_id, stop_id FROM ServedStops\n"
+    "    UNION ALL\n"
+    "    SELECT tr.from_stop_id, tr.to_stop_id\n"
+    "    FROM stop_transfers tr\n"
+    "    JOIN ServedStops ss ON ss.stop_id = tr.from_stop_id\n"
+    "),\n"
+    "ClusterRoutes AS (\n"
+    "    SELECT w.hub_id, COUNT(DISTINCT USR.route_id) AS num_unique_routes, COUNT(DISTINCT USR.stop_id) AS num_stops\n"
+    "    FROM Walkable w\n"
+    "    JOIN UniqueStopRoutes USR ON USR.stop_id = w.stop_id\n"
+    "    GROUP BY w.hub_id\n"
+    ")\n"
+    "SELECT s.stop_id, s.stop_code, s.stop_name, s.stop_lat, s.stop_lon, c.num_unique_routes, c.num_stops\n"
+    "FROM ClusterRoutes c\n"
+    "JOIN stops s ON s.stop_id = c.hub_id\n"
+    "WHERE c.num_unique_routes >= 2\n"
+    "  AND NOT EXISTS (\n"
+    "    SELECT 1 FROM stop_transfers tr\n"
+    "    JOIN ClusterRoutes n ON n.hub_id = tr.to_stop_id\n"
+    "    WHERE tr.from_stop_id = c.hub_id\n"
+    "      AND (n.num_unique_routes > c.num_unique_routes\n"
+    "           OR (n.num_unique_routes = c.num_unique_routes AND n.hub_id < c.hub_id))\n"
+    "  )\n"
+    "ORDER BY c.num_unique_routes DESC\n"
+)
+
+
+def _q3_cluster_statement(service_id: ServiceFilter, limit_param: Optional[str]) -> Tuple[Any, Dict[str, Any], Optional[int]]:
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+
+    with_clause = f"WITH UniqueStopRoutes AS (\n{_unique_stop_routes_sql(service_filter)}),\n"
+    limit_clause = f"LIMIT {limit_value}" if limit_value is not None else ""
+    params = _service_params(service_filter)
+    sql = _service_text(with_clause + Q3_CLUSTER_SELECT + limit_clause, params)
+    return sql, params, limit_value
+
+
+def _iter_rows(engine: Engine, sql: Any, params: Dict[str, Any], stream: bool,
+               timeout_ms: Optional[int]) -> Iterator[Any]:
+    """Yield result rows; `stream` uses a server-side cursor so client memory stays flat."""
+    with engine.connect() as conn:
+        # Streamed rows are consumed after the request handler returns, so the
+        # statement timeout travels as an execution option rather than the context.
+        conn = conn.execution_options(statement_timeout_ms=timeout_ms)
+        if stream:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=STREAM_BUFFER_ROWS)
+        for r in conn.execute(sql, params).mappings():
+            yield r
+
+
+def query_q1_busiest_stops(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    sql, params, _ = _q1_statement(service_id, limit_param)
 
     with engine.begin() as conn:
         rows = conn.execute(sql, params).mappings().all()
 
-    result: List[Dict[str, Any]] = []
-    for r in rows:
-        result.append({
-            "stop_id": r["stop_id"],
-            "stop_code": r.get("stop_code"),
-            "stop_name": r["stop_name"],
-            "stop_lat": float(f"{r['stop_lat']:.6f}"),
-            "stop_lon": float(f"{r['stop_lon']:.6f}"),
-            "num_unique_routes": int(r["num_unique_routes"]),
-        })
-    return result
+    return [_format_q1_row(r) for r in rows]
+
+
+def iter_q1_busiest_stops(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Q1 rows one at a time; unbounded (limit=all) results are streamed from the server."""
+    sql, params, limit_value = _q1_statement(service_id, limit_param)
+    rows = _iter_rows(engine, sql, params, stream=limit_value is None, timeout_ms=_statement_timeout_ms.get())
+    return (_format_q1_row(r) for r in rows)
+
+
+def query_q3_transfer_points(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    sql, params, _ = _q3_statement(service_id, limit_param)
+
+    with engine.begin() as conn:
+        rows = conn.execute(sql, params).mappings().all()
+
+    return [_format_q3_row(r) for r in rows]
+
+
+def iter_q3_transfer_points(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Q3 rows one at a time; unbounded (limit=all) results are streamed from the server."""
+    sql, params, limit_value = _q3_statement(service_id, limit_param)
+    rows = _iter_rows(engine, sql, params, stream=limit_value is None, timeout_ms=_statement_timeout_ms.get())
+    return (_format_q3_row(r) for r in rows)
+
+
+def query_q3_transfer_clusters(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> List[Dict[str, Any]]:
+    sql, params, _ = _q3_cluster_statement(service_id, limit_param)
+
+    with engine.begin() as conn:
+        rows = conn.execute(sql, params).mappings().all()
+
+    return [_format_q3_cluster_row(r) for r in rows]
+
+
+def iter_q3_transfer_clusters(engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Q3 over walking clusters (needs the stop_transfers table), one row at a time."""
+    sql, params, limit_value = _q3_cluster_statement(service_id, limit_param)
+    rows = _iter_rows(engine, sql, params, stream=limit_value is None, timeout_ms=_statement_timeout_ms.get())
+    return (_format_q3_cluster_row(r) for r in rows)
 
 
 def _q2_trip_stats_cte() -> str:
+    if COMPACT_SCHEMA:
+        # Times are already seconds; the per-trip MIN/MAX runs on the (trip_key, stop_sequence) key
+        return (
+            "WITH trip_stats AS (\n"
+            "    SELECT\n"
+            "        rk.route_id,\n"
+            "        sk.service_id,\n"
+            "        ts.trip_duration_seconds,\n"
+            "        ts.trip_distance\n"
+            "    FROM (\n"
+            "        SELECT\n"
+            "            st.trip_key,\n"
+            "            MAX(st.arrival_s) - MIN(st.departure_s) AS trip_duration_seconds,\n"
+            "            (MAX(st.shape_dist_traveled) - MIN(st.shape_dist_traveled)) AS trip_distance\n"
+            "        FROM stop_times_compact st\n"
+            "        GROUP BY st.trip_key\n"
+            "        HAVING trip_duration_seconds > 60\n"
+            "    ) ts\n"
+            "    JOIN trip_keys t ON t.trip_key = ts.trip_key\n"
+            "    JOIN route_keys rk ON rk.route_key = t.route_key\n"
+            "    JOIN service_keys sk ON sk.service_key = t.service_key\n"
+            ")\n"
+        )
     return (
         "WITH trip_stats AS (\n"
         "    SELECT\n"
@@ -161,206 +465,212 @@ def _q2_trip_stats_cte() -> str:
     )
 
 
-def query_q2_avg_duration_speed(
-    engine: Engine, service_id: Optional[str], limit_param: Optional[str]
-) -> Dict[str, Any]:
-    limit_value = _sanitize_limit(limit_param)
-    service_filter = _service_id_filter(service_id)
+def _round2(val: Optional[float]) -> Optional[float]:
+    if val is None:
+        return None
+    return float(f"{val:.2f}")
+
+
+def _build_q2_whole_week(global_rows: List[Any], ps_rows: List[Any]) -> Dict[str, Any]:
+    """Shape the whole-week Q2 response from ranked global rows and per-service rows."""
+    selected_routes = {r["route"] for r in global_rows}
+
+    route_to_services: Dict[str, Dict[str, Any]] = {}
+    for r in global_rows:
+        route_to_services[r["route"]] = {
+            "route_long_name": r["route"],
+            "route_short_name": r.get("route_short"),
+            "global": {
+                "total_trips": int(r["total_trips"]),
+                "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
+                "avg_duration_min": _round2(r["avg_duration_min"]),
+                "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
+            },
+            "services": [],
+        }
+
+    for r in ps_rows:
+        route = r["route"]
+        if route not in selected_routes:
+            continue
+        route_to_services[route]["services"].append(
+            {
+                "service_id": str(r["service_id"]),
+                "total_trips": int(r["total_trips"]),
+                "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
+                "avg_duration_min": _round2(r["avg_duration_min"]),
+                "duration_stddev_min": _round2(r["duration_stddev_min"]),
+                "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
+            }
+        )
 
-    cte = _q2_trip_stats_cte()
+    # Overall weighted averages across selected routes (using global total_trips)
+    total_trips_all = sum(v["global"]["total_trips"] for v in route_to_services.values()) or 1
+    overall_duration = sum(
+        (v["global"]["avg_duration_min"] or 0.0) * v["global"]["total_trips"]
+        for v in route_to_services.values()
+    ) / total_trips_all
+    overall_speed = sum(
+        (v["global"]["avg_speed_kmh"] or 0.0) * v["global"]["total_trips"]
+        for v in route_to_services.values()
+    ) / total_trips_all
 
-    def _round2(val: Optional[float]) -> Optional[float]:
-        if val is None:
-            return None
-        return float(f"{val:.2f}")
+    return {
+        "mode": "whole_week",
+        "routes": list(route_to_services.values()),
+        "overall": {
+            "avg_duration_min": _round2(overall_duration),
+            "avg_speed_kmh": _round2(overall_speed),
+        },
+    }
 
-    with engine.begin() as conn:
-        if service_filter is None:
-            # Global per route for ranking
-            global_sql = text(
-                cte
-                + (
-                    "SELECT r.route_long_name AS route, r.route_short_name AS route_short,\n"
-                    "       COUNT(*) AS total_trips,\n"
-                    "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
-                    "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
-                    "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
-                    "FROM trip_stats ts\n"
-                    "JOIN routes r ON r.route_id = ts.route_id\n"
-                    "GROUP BY r.route_long_name\n"
-                    "ORDER BY avg_duration_min DESC\n"
-                )
-                + (f"LIMIT {limit_value}" if limit_value is not None else "")
-            )
-            global_rows = conn.execute(global_sql).mappings().all()
-            selected_routes = {r["route"] for r in global_rows}
-
-            # Per service per route
-            per_service_sql = text(
-                cte
-                + (
-                    "SELECT r.route_long_name AS route, r.route_short_name AS route_short, ts.service_id,\n"
-                    "       COUNT(*) AS total_trips,\n"
-                    "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
-                    "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
-                    "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
-                    "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
-                    "FROM trip_stats ts\n"
-                    "JOIN routes r ON r.route_id = ts.route_id\n"
-                    "GROUP BY r.route_long_name, ts.service_id\n"
-                )
-            )
-            ps_rows = conn.execute(per_service_sql).mappings().all()
-
-            # Build response
-            route_to_services: Dict[str, Dict[str, Any]] = {}
-            for r in global_rows:
-                route_to_services[r["route"]] = {
-                    "route_long_name": r["route"],
-                    "route_short_name": r.get("route_short"),
-                    "global": {
-                        "total_trips": int(r["total_trips"]),
-                        "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
-                        "avg_duration_min": _round2(r["avg_duration_min"]),
-                        "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
-                    },
-                    "services": [],
-                }
 
-            for r in ps_rows:
-                route = r["route"]
-                if route not in selected_routes:
-                    continue
-                route_to_services[route]["services"].append(
-                    {
-                        "service_id": str(r["service_id"]),
-                        "total_trips": int(r["total_trips"]),
-                        "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
-                        "avg_duration_min": _round2(r["avg_duration_min"]),
-                        "duration_stddev_min": _round2(r["duration_stddev_min"]),
-                        "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
-                    }
-                )
-
-            # Overall weighted averages across selected routes (using global total_trips)
-            total_trips_all = sum(v["global"]["total_trips"] for v in route_to_services.values()) or 1
-            overall_duration = sum(
-                (v["global"]["avg_duration_min"] or 0.0) * v["global"]["total_trips"]
-                for v in route_to_services.values()
-            ) / total_trips_all
-            overall_speed = sum(
-                (v["global"]["avg_speed_kmh"] or 0.0) * v["global"]["total_trips"]
-                for v in route_to_services.values()
-            ) / total_trips_all
-
-            return {
-                "mode": "whole_week",
-                "routes": list(route_to_services.values()),
-                "overall": {
-                    "avg_duration_min": _round2(overall_duration),
-                    "avg_speed_kmh": _round2(overall_speed),
-                },
-            }
-        else:
-            # Single service filter
-            sql = text(
-                cte
-                + (
-                    "SELECT r.route_long_name AS route, r.route_short_name AS route_short, ts.service_id, COUNT(*) AS total_trips,\n"
-                    "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
-                    "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
-                    "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
-                    "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
-                    "FROM trip_stats ts\n"
-                    "JOIN routes r ON r.route_id = ts.route_id\n"
-                    "WHERE ts.service_id = :service_id\n"
-                    "GROUP BY r.route_long_name, ts.service_id\n"
-                    "ORDER BY avg_duration_min DESC\n"
-                )
-                + (f"LIMIT {limit_value}" if limit_value is not None else "")
-            )
-            rows = conn.execute(sql, {"service_id": service_filter}).mappings().all()
-
-            total_trips_all = sum(int(r["total_trips"]) for r in rows) or 1
-            overall_duration = sum(
-                float(r["avg_duration_min"]) * int(r["total_trips"]) for r in rows
-            ) / total_trips_all
-            overall_speed = sum(
-                float(r["avg_speed_kmh"]) * int(r["total_trips"]) for r in rows
-            ) / total_trips_all
-
-            return {
-                "mode": "single_service",
-                "routes": [{
-                    "route_long_name": r["route"],
-                    "route_short_name": r.get("route_short"),
-                    "service_id": str(r["service_id"]),
-                    "total_trips": int(r["total_trips"]),
-                    "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
-                    "avg_duration_min": _round2(r["avg_duration_min"]),
-                    "duration_stddev_min": _round2(r["duration_stddev_min"]),
-                    "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
-                } for r in rows],
-                "overall": {
-                    "avg_duration_min": _round2(overall_duration),
-                    "avg_speed_kmh": _round2(overall_speed),
-                },
-            }
+def _build_q2_single_service(rows: List[Any], label: Optional[str] = None) -> Dict[str, Any]:
+    """Shape the single-service Q2 response from ranked per-route rows.
 
+    `label` replaces the per-row service_id when the rows pool several services.
+    """
+    total_trips_all = sum(int(r["total_trips"]) for r in rows) or 1
+    overall_duration = sum(
+        float(r["avg_duration_min"]) * int(r["total_trips"]) for r in rows
+    ) / total_trips_all
+    overall_speed = sum(
+        float(r["avg_speed_kmh"]) * int(r["total_trips"]) for r in rows
+    ) / total_trips_all
 
-def query_q4_hourly_frequency(
-    engine: Engine, service_id: Optional[str], limit_param: Optional[str]
+    return {
+        "mode": "single_service",
+        "routes": [{
+            "route_long_name": r["route"],
+            "route_short_name": r.get("route_short"),
+            "service_id": label or str(r["service_id"]),
+            "total_trips": int(r["total_trips"]),
+            "avg_trip_distance_km": _round2(r["avg_trip_distance_km"]),
+            "avg_duration_min": _round2(r["avg_duration_min"]),
+            "duration_stddev_min": _round2(r["duration_stddev_min"]),
+            "avg_speed_kmh": _round2(r["avg_speed_kmh"]),
+        } for r in rows],
+        "overall": {
+            "avg_duration_min": _round2(overall_duration),
+            "avg_speed_kmh": _round2(overall_speed),
+        },
+    }
+
+
+def _q2_global_statement(limit_value: Optional[int]) -> Any:
+    """Whole-week Q2: every route ranked by average duration over all services."""
+    return text(
+        _q2_trip_stats_cte()
+        + (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            "GROUP BY r.route_long_name\n"
+            "ORDER BY avg_duration_min DESC, r.route_long_name\n"
+        )
+        + (f"LIMIT {limit_value}" if limit_value is not None else "")
+    )
+
+
+def _top_routes_join(rank_sql: str, limit_value: Optional[int]) -> str:
+    # A derived table rather than IN (...): MySQL rejects LIMIT inside IN subqueries
+    if limit_value is None:
+        return ""
+    return f"JOIN ({rank_sql}LIMIT {limit_value}) top ON top.route = r.route_long_name\n"
+
+
+def _q2_top_routes_sql(where: str) -> str:
+    """Route names in Q2 order (average duration, ties by name), for _top_routes_join."""
+    return ("SELECT r.route_long_name AS route FROM trip_stats ts JOIN routes r ON r.route_id = ts.route_id\n"
+            + where + "GROUP BY r.route_long_name ORDER BY AVG(ts.trip_duration_seconds)/60.0 DESC, r.route_long_name\n")
+
+
+def _q2_per_service_statement(limit_value: Optional[int] = None) -> Any:
+    """Whole-week Q2: the per-service breakdown of the routes _q2_global_statement ranks.
+
+    The limit is applied in SQL, so only the selected routes' rows are fetched; trip_stats
+    is referenced twice and materialized once.
+    """
+    return text(
+        _q2_trip_stats_cte()
+        + (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, ts.service_id,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+        )
+        + _top_routes_join(_q2_top_routes_sql(""), limit_value)
+        + "GROUP BY r.route_long_name, ts.service_id\n"
+    )
+
+
+def _q2_service_statement(service_filter: ServiceFilter, limit_value: Optional[int]) -> Tuple[Any, Dict[str, Any]]:
+    """Single-service Q2; the services of a date are pooled per route."""
+    pooled = isinstance(service_filter, tuple)
+    params = _service_params(service_filter)
+    sql = _service_text(
+        _q2_trip_stats_cte()
+        + (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, "
+            + ("" if pooled else "ts.service_id, ")
+            + "COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            f"WHERE {_service_condition('ts.service_id', service_filter)}\n"
+            + ("GROUP BY r.route_long_name\n" if pooled else "GROUP BY r.route_long_name, ts.service_id\n")
+            + "ORDER BY avg_duration_min DESC, r.route_long_name\n"
+        )
+        + (f"LIMIT {limit_value}" if limit_value is not None else ""),
+        params,
+    )
+    return sql, params
+
+
+def query_q2_avg_duration_speed(
+    engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]
 ) -> Dict[str, Any]:
-    ensure_hourly_frequency_view(engine)
-    service_filter = _service_id_filter(service_id)
     limit_value = _sanitize_limit(limit_param)
+    service_filter = _service_id_filter(service_id)
 
     with engine.begin() as conn:
-        # Determine top routes by total_daily_trips (sum of trips_per_hour)
-        rank_sql = text(
-            (
-                "SELECT r.route_long_name AS route, "+
-                ("vhf.service_id AS service_id, " if service_filter is not None else "")+
-                "SUM(vhf.trips_per_hour) AS total_daily_trips\n"
-                "FROM vw_hourly_frequency vhf\n"
-                "JOIN routes r ON r.route_id = vhf.route_id\n"
-            )
-            + ("WHERE vhf.service_id = :service_id\n" if service_filter is not None else "")
-            + (
-                "GROUP BY r.route_long_name"
-                + (", vhf.service_id\n" if service_filter is not None else "\n")
-                + "ORDER BY total_daily_trips DESC\n"
-            )
-            + (f"LIMIT {limit_value}" if limit_value is not None else "")
-        )
-        rank_rows = conn.execute(
-            rank_sql, ({"service_id": service_filter} if service_filter is not None else {})
-        ).mappings().all()
-        selected_routes = {r["route"] for r in rank_rows}
-
-        data_sql = text(
-            (
-                "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id, vhf.hour_of_day, vhf.trips_per_hour\n"
-                "FROM vw_hourly_frequency vhf\n"
-                "JOIN routes r ON r.route_id = vhf.route_id\n"
-            )
-            + ("WHERE vhf.service_id = :service_id\n" if service_filter is not None else "")
-            + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
-        )
-        rows = conn.execute(
-            data_sql, ({"service_id": service_filter} if service_filter is not None else {})
-        ).mappings().all()
+        if service_filter is None:
+            global_rows = conn.execute(_q2_global_statement(limit_value)).mappings().all()
+            ps_rows = conn.execute(_q2_per_service_statement(limit_value)).mappings().all()
+            return _build_q2_whole_week(global_rows, ps_rows)
+        sql, params = _q2_service_statement(service_filter, limit_value)
+        rows = conn.execute(sql, params).mappings().all()
+
+    pooled = isinstance(service_filter, tuple)
+    return _build_q2_single_service(rows, service_label(service_filter) if pooled else None)
+
 
-    # Group by route and optionally by service
+def _build_q4_response(
+    rows: List[Any], selected_routes: Set[str], service_filter: ServiceFilter
+) -> Dict[str, Any]:
+    """Group hourly view rows by route (and service) and keep only the ranked routes."""
     from collections import defaultdict
 
     route_to_hours: Dict[str, Dict[str, Dict[int, int]]] = defaultdict(lambda: defaultdict(dict))
     route_short_by_route: Dict[str, Optional[str]] = {}
+    service_ids: Set[str] = set()
     max_hour = 0
     for r in rows:
         route = r["route"]
         route_short = r.get("route_short")
         sid = str(r["service_id"])
+        service_ids.add(sid)
         hour = int(r["hour_of_day"]) if r["hour_of_day"] is not None else 0
         trips = int(r["trips_per_hour"]) if r["trips_per_hour"] is not None else 0
         max_hour = max(max_hour, hour)
@@ -383,12 +693,12 @@ def query_q4_hourly_frequency(
             hours_sorted = sorted(hourly_counts.keys())
             series = [{"hour": h, "trips": hourly_counts.get(h, 0)} for h in hours_sorted]
             total = sum(hourly_counts.values())
-            # Per-service totals 1/2/3 and average
+            # Per-service totals and their average over the feed's services
             per_sid_totals: Dict[str, int] = {}
-            for sid_key in ["1", "2", "3"]:
+            for sid_key in sorted(service_ids):
                 sid_map = service_map.get(sid_key, {})
                 per_sid_totals[sid_key] = sum(sid_map.values()) if sid_map else 0
-            avg_daily = sum(per_sid_totals.values()) / 3.0
+            avg_daily = sum(per_sid_totals.values()) / max(len(per_sid_totals), 1)
             result_routes.append(
                 {
                     "route_long_name": route,
@@ -401,8 +711,11 @@ def query_q4_hourly_frequency(
                 }
             )
         else:
-            sid = service_filter
-            sid_map = service_map.get(sid, {})
+            sid = service_label(service_filter)
+            sid_map: Dict[int, int] = defaultdict(int)
+            for sid_key in (service_filter if isinstance(service_filter, tuple) else (service_filter,)):
+                for h, c in service_map.get(sid_key, {}).items():
+                    sid_map[h] += c
             hours_sorted = sorted(sid_map.keys())
             series = [{"hour": h, "trips": sid_map.get(h, 0)} for h in hours_sorted]
             total = sum(sid_map.values())
@@ -422,3 +735,102 @@ def query_q4_hourly_frequency(
     }
 
 
+def _q4_data_statement(service_filter: ServiceFilter, limit_value: Optional[int] = None) -> Tuple[Any, Dict[str, Any]]:
+    """The hourly view rows of the filtered services, for _build_q4_response.
+
+    With `limit_value` only the rows of the top routes by summed trips_per_hour are
+    fetched (several services, a date, rank on their sum; ties by name). One extra row
+    per service, with a NULL route, carries the service's latest hour, so the response
+    still sees every service and the overall max_hour. The view is read once.
+    """
+    params = _service_params(service_filter) if service_filter is not None else {}
+    where = f"WHERE {_service_condition('vhf.service_id', service_filter)}\n" if service_filter is not None else ""
+    if limit_value is None:
+        sql = (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id, vhf.hour_of_day, vhf.trips_per_hour\n"
+            f"FROM {HOURLY_VIEW} vhf\n"
+            "JOIN routes r ON r.route_id = vhf.route_id\n"
+            + where
+            + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
+        )
+    else:
+        sql = (
+            "WITH hourly AS (\n"
+            "    SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id, vhf.hour_of_day, vhf.trips_per_hour\n"
+            f"    FROM {HOURLY_VIEW} vhf\n"
+            "    JOIN routes r ON r.route_id = vhf.route_id\n"
+            + ("    " + where if where else "")
+            + ")\n"
+            "SELECT h.route, h.route_short, h.service_id, h.hour_of_day, h.trips_per_hour\n"
+            "FROM hourly h\n"
+            "JOIN (SELECT route FROM hourly GROUP BY route ORDER BY SUM(trips_per_hour) DESC, route\n"
+            f"      LIMIT {limit_value}) top ON top.route = h.route\n"
+            "UNION ALL\n"
+            "SELECT NULL, NULL, service_id, MAX(hour_of_day), NULL FROM hourly GROUP BY service_id\n"
+            "ORDER BY route, service_id, hour_of_day\n"
+        )
+    return _service_text(sql, params), params
+
+
+def query_q4_hourly_frequency(
+    engine: Engine, service_id: ServiceFilter, limit_param: Optional[str]
+) -> Dict[str, Any]:
+    ensure_hourly_frequency_view(engine)
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+
+    with engine.begin() as conn:
+        # Only the top routes by total_daily_trips come back (plus one row per service)
+        data_sql, params = _q4_data_statement(service_filter, limit_value)
+        rows = conn.execute(data_sql, params).mappings().all()
+
+    return _build_q4_response(rows, {r["route"] for r in rows if r["route"] is not None}, service_filter)
+
+
+def export_statement(query: str, service_id: ServiceFilter, limit_param: Optional[str]) -> Tuple[Any, Dict[str, Any]]:
+    """(statement, params) of the flat rows behind a Q1–Q4 answer, for SQL.export.
+
+    Q2 has one row per route and service, Q4 one per route, service and hour; a limit
+    keeps the top routes as ranked by the JSON endpoint.
+    """
+    if query in ("q1", "q3", "q3_clusters"):
+        build = {"q1": _q1_statement, "q3": _q3_statement, "q3_clusters": _q3_cluster_statement}[query]
+        sql, params, _ = build(service_id, limit_param)
+        return sql, params
+    service_filter = _service_id_filter(service_id)
+    limit_value = _sanitize_limit(limit_param)
+    params = _service_params(service_filter)
+    if query == "q2":
+        where = f"WHERE {_service_condition('ts.service_id', service_filter)}\n"
+        rank_sql = _q2_top_routes_sql(where)
+        sql = (
+            _q2_trip_stats_cte()
+            + "SELECT r.route_long_name AS route, r.route_short_name AS route_short, ts.service_id,\n"
+            "       COUNT(*) AS total_trips,\n"
+            "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+            "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+            "       STDDEV(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+            "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+            "FROM trip_stats ts\n"
+            "JOIN routes r ON r.route_id = ts.route_id\n"
+            + _top_routes_join(rank_sql, limit_value)
+            + where
+            + "GROUP BY r.route_long_name, ts.service_id\n"
+            "ORDER BY avg_duration_min DESC\n"
+        )
+    elif query == "q4":
+        where = f"WHERE {_service_condition('vhf.service_id', service_filter)}\n"
+        rank_sql = (f"SELECT r.route_long_name AS route FROM {HOURLY_VIEW} vhf JOIN routes r ON r.route_id = vhf.route_id\n"
+                    + where + "GROUP BY r.route_long_name ORDER BY SUM(vhf.trips_per_hour) DESC, r.route_long_name\n")
+        sql = (
+            "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id,\n"
+            "       vhf.hour_of_day, vhf.trips_per_hour\n"
+            f"FROM {HOURLY_VIEW} vhf\n"
+            "JOIN routes r ON r.route_id = vhf.route_id\n"
+            + _top_routes_join(rank_sql, limit_value)
+            + where
+            + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
+        )
+    else:
+        raise ValueError(f"Unknown export {query!r}")
+    return _service_text(sql, params), params
@@ -0,0 +1,171 @@
+"""Fast start for the Flask apps: lazy imports, a background startup phase, health probes.
+
+Importing an app only builds the Flask object. Backends that pull in pandas, numpy,
+SQLAlchemy or DuckDB are bound with `lazy_import` and load on the first request
+that touches them. Work that needs the network or the disk (MongoDB index checks,
+warming caches, opening the MySQL engine) runs as the app's startup phase, in a
+background thread, so the server accepts connections at once:
+
+    GET /healthz   200 while the process is serving (liveness)
+    GET /readyz    200 once startup has succeeded, else 503 with its state (readiness)
+
+`python -m SQL.startup check-imports` guards against import-time regressions: it
+imports each app under `python -X importtime` and fails when the import takes longer
+than IMPORT_BUDGET_MS or loads one of the heavy modules eagerly.
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", "5"))
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "600"))
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages an app import must not load; each costs 50-500 ms
+HEAVY_MODULES = ('pandas', 'numpy', 'sqlalchemy', 'duckdb', 'pyarrow', 'scipy')
+
+# app -> statement that imports it, run from the repo root
+APP_IMPORTS = {
+    'sql': "import SQL.app",
+    'mongo': ("import importlib.util; "
+              "spec = importlib.util.spec_from_file_location('mongo_app', 'Mongo/app.py'); "
+              "spec.loader.exec_module(importlib.util.module_from_spec(spec))"),
+}
+
+
+class _LazyModule(ModuleType):
+    """Stands in for a module and imports it on first attribute access.
+
+    Unlike importlib's LazyLoader this is safe when several request threads hit the
+    module at once: the import goes through importlib's per-module lock.
+    """
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Module `name`, imported on first use (or at once if it is already loaded)."""
+    return sys.modules.get(name) or _LazyModule(name)
+
+
+class Startup:
+    """State of an app's startup phase, shared by /readyz and the code that runs it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "pending"  # pending -> starting -> ready, or failed (retried)
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.ready_in: Optional[float] = None
+        self._created = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def run(self, fn: Callable[[], Any]) -> bool:
+        """Run `fn` once now; True when it succeeded and the app is ready."""
+        with self._lock:
+            if self.ready:
+                return True
+            self.state = "starting"
+            self.attempts += 1
+            try:
+                fn()
+            except Exception as e:  # reported by /readyz and retried by run_in_background
+                self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+                print(f"[{self.name}] startup failed: {self.error}", file=sys.stderr)
+                return False
+            self.state, self.error = "ready", None
+            self.ready_in = round(time.monotonic() - self._created, 3)
+            return True
+
+    def run_in_background(self, fn: Callable[[], Any], retry_seconds: float = STARTUP_RETRY_SECONDS) -> None:
+        """Run `fn` on a daemon thread until it succeeds, every `retry_seconds`."""
+        def loop():
+            while not self.run(fn):
+                time.sleep(retry_seconds)
+
+        self._thread = threading.Thread(target=loop, name=f"{self.name}-startup", daemon=True)
+        self._thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        return {"status": self.state, "error": self.error, "attempts": self.attempts, "ready_in_s": self.ready_in}
+
+
+def install_health_endpoints(app: Any, startup: Startup) -> None:
+    """GET /healthz (liveness) and GET /readyz (readiness) on `app`."""
+    from flask import jsonify
+
+    @app.get("/healthz")
+    def healthz():
+        return jsonify({"status": "ok", "pid": os.getpid()})
+
+    @app.get("/readyz")
+    def readyz():
+        return jsonify(startup.status()), 200 if startup.ready else 503
+
+
+# --- Import-time budget ---
+
+def import_profile(app: str) -> Tuple[float, Dict[str, float]]:
+    """(total ms, cumulative ms per top-level module) of importing `app` in a fresh interpreter."""
+    import subprocess
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", APP_IMPORTS[app]], cwd=ROOT_DIR,
+                            capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    if result.returncode != 0:
+        raise RuntimeError(f"importing the {app} app failed:\n{result.stderr[-2000:]}")
+    total = 0.0
+    modules: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        ms = int(cumulative) / 1000
+        top = name.strip().split(".")[0]
+        modules[top] = max(modules.get(top, 0.0), ms)
+        if len(name) - len(name.lstrip()) == 1:  # imported by the statement itself, not nested
+            total += ms
+    return total, modules
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Start-up checks for the Flask apps")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check = sub.add_parser("check-imports", help="Fail when an app's import is over budget or loads heavy modules")
+    check.add_argument("apps", nargs="*", help=f"Any of {', '.join(sorted(APP_IMPORTS))} (default: all)")
+    check.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    check.add_argument("--runs", type=int, default=3, help="Best of N fresh interpreters")
+    check.add_argument("--top", type=int, default=8, help="Slowest modules to list")
+    args = parser.parse_args(argv)
+    unknown = set(args.apps) - set(APP_IMPORTS)
+    if unknown:
+        parser.error(f"unknown app(s): {', '.join(sorted(unknown))}")
+
+    failed = False
+    for app in args.apps or sorted(APP_IMPORTS):
+        best, modules = min((import_profile(app) for _ in range(max(args.runs, 1))), key=lambda p: p[0])
+        heavy = sorted(m for m in modules if m in HEAVY_MODULES)
+        over = best > args.budget_ms
+        print(f"{app}: {best:.0f} ms (budget {args.budget_ms:.0f} ms)"
+              + (f"; eagerly imports {', '.join(heavy)}" if heavy else ""))
+        for name, ms in sorted(modules.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"  {ms:8.1f} ms  {name}")
+        failed |= over or bool(heavy)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -42,13 +42,91 @@ function createMap(divId) {
   return { map, layer };
 }
 
+// Server-side clustered stops for limit=all: /tiles/{layer}/{z}/{x}/{y} returns GeoJSON
+// points per map tile (clusters with a stop count, single stops when zoomed in), and
+// only tiles in view are fetched. Markers go to a shared canvas renderer.
+const StopTileLayer = L.GridLayer.extend({
+  initialize(layerName, params, options) {
+    L.GridLayer.prototype.initialize.call(this, options);
+    this._layerName = layerName;
+    this._params = params;
+    this._groups = {};
+    this._renderer = L.canvas({ padding: 0.5 });
+    this.on('tileunload', (e) => this._dropGroup(this._tileCoordsToKey(e.coords)));
+  },
+
+  createTile(coords, done) {
+    const tile = document.createElement('div');
+    const key = this._tileCoordsToKey(coords);
+    const url = new URL(`/tiles/${this._layerName}/${coords.z}/${coords.x}/${coords.y}`, window.location.origin);
+    url.searchParams.set('service_id', this._params.service_id);
+    fetch(url)
+      .then(res => res.json())
+      .then(data => {
+        // The tile may have scrolled out of view while the request was in flight
+        if (this._map && this._tiles[key]) {
+          const markers = (data.features || []).map(f => this._marker(f, data.range || [0, 1]));
+          this._groups[key] = L.layerGroup(markers).addTo(this._map);
+        }
+        done(null, tile);
+      })
+      .catch(err => done(err, tile));
+    return tile;
+  },
+
+  onRemove(map) {
+    Object.keys(this._groups).forEach(key => this._dropGroup(key));
+    L.GridLayer.prototype.onRemove.call(this, map);
+  },
+
+  _dropGroup(key) {
+    const group = this._groups[key];
+    if (group) {
+      group.remove();
+      delete this._groups[key];
+    }
+  },
+
+  _marker(feature, range) {
+    const [lon, lat] = feature.geometry.coordinates;
+    const p = feature.properties;
+    // Q1 clusters sum trip events, so colour them by their per-stop average
+    const perStop = this._layerName === 'q1' ? p.value / p.count : p.value;
+    const color = getColor(perStop, range[0], range[1]);
+    const marker = L.circleMarker([lat, lon], {
+      renderer: this._renderer,
+      radius: p.count > 1 ? 6 + 3 * Math.log2(p.count) : 6,
+      color,
+      fillColor: color,
+      fillOpacity: p.count > 1 ? 0.6 : 0.8,
+      weight: 1
+    });
+    const label = this._layerName === 'q1' ? 'Trip events' : (p.count > 1 ? 'Max unique routes' : 'Unique routes');
+    if (p.count > 1) {
+      marker.bindTooltip(`<b>${p.count} stops</b><br/>${label}: ${p.value}`, {sticky: true, direction: 'top'});
+      marker.on('click', () => this._map.setView([lat, lon], this._map.getZoom() + 2));
+    } else {
+      marker.bindTooltip(`<b>${p.stop_name}</b><br/>Stop code: ${p.stop_code ?? ''}<br/>${label}: ${p.value}`, {sticky: true, direction: 'top'});
+    }
+    return marker;
+  }
+});
+
+function useStopTiles(map, current, layerName, params) {
+  if (current) map.removeLayer(current);
+  if (String(params.limit) !== 'all') return null;
+  return new StopTileLayer(layerName, params, { tileSize: 256 }).addTo(map);
+}
+
 // Q1 - Busiest Stops
 const q1 = (function() {
   const { map, layer } = createMap('map-q1');
   let lastBounds = null;
+  let tiles = null;
 
   async function load() {
     const params = getFormParams(document.getElementById('form-q1'));
+    tiles = useStopTiles(map, tiles, 'q1', params);
     const url = new URL('/api/q1', window.location.origin);
     url.searchParams.set('service_id', params.service_id);
     url.searchParams.set('limit', params.limit);
@@ -68,6 +146,7 @@ const q1 = (function() {
       if (typeof d.stop_lat !== 'number' || typeof d.stop_lon !== 'number') return;
       lats.push(d.stop_lat);
       lons.push(d.stop_lon);
+      if (tiles) return;
       const color = getColor(d.total_trip_events, vmin, vmax);
       const radius = 6;
       const marker = L.circleMarker([d.stop_lat, d.stop_lon], {
@@ -108,9 +187,11 @@ const q1 = (function() {
 const q3 = (function() {
   const { map, layer } = createMap('map-q3');
   let lastBounds = null;
+  let tiles = null;
 
   async function load() {
     const params = getFormParams(document.getElementById('form-q3'));
+    tiles = useStopTiles(map, tiles, 'q3', params);
     const url = new URL('/api/q3', window.location.origin);
     url.searchParams.set('service_id', params.service_id);
     url.searchParams.set('limit', params.limit);
@@ -130,6 +211,7 @@ const q3 = (function() {
       if (typeof d.stop_lat !== 'number' || typeof d.stop_lon !== 'number') return;
       lats.push(d.stop_lat);
       lons.push(d.stop_lon);
+      if (tiles) return;
       const color = getColor(d.num_unique_routes, vmin, vmax);
       const radius = 6;
       const marker = L.circleMarker([d.stop_lat, d.stop_lon], {
@@ -0,0 +1,153 @@
+"""Zoom-dependent stop clusters for the Q1/Q3 maps, served as small GeoJSON tiles.
+
+Stops are projected to Web Mercator and keyed by a Morton (Z-order) code over a
+2^MORTON_LEVEL grid, then sorted. Every slippy-map tile (z, x, y) is one contiguous
+range of those codes, and so is every cluster cell (a tile CELL_LEVELS zooms deeper,
+i.e. 64 px on a 256 px tile). Clusters for each zoom up to CLUSTER_MAX_ZOOM are
+precomputed with reduceat over the sorted codes; a tile request is two searchsorted
+calls and at most 4^CELL_LEVELS features. Deeper zooms serve the individual stops.
+"""
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+MORTON_LEVEL = 24  # ~2.4 m cells at the equator; codes fit in 48 bits
+CELL_LEVELS = 2  # cluster cells are 1/4 of a tile side
+CLUSTER_MAX_ZOOM = int(os.getenv("TILE_CLUSTER_MAX_ZOOM", "14"))
+TILE_INDEX_ENTRIES = int(os.getenv("TILE_INDEX_ENTRIES", "16"))
+MAX_LAT = 85.0511287798
+
+# Layer -> (value column, how clusters aggregate it)
+LAYERS = {
+    'q1': ('total_trip_events', 'sum'),
+    'q3': ('num_unique_routes', 'max'),
+}
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Insert a zero bit above each of the low 32 bits."""
+    v = v.astype(np.uint64)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+
+def morton(x: Any, y: Any) -> np.ndarray:
+    return (_spread_bits(np.asarray(x)) | (_spread_bits(np.asarray(y)) << np.uint64(1))).astype(np.int64)
+
+
+def mercator_cells(lat: np.ndarray, lon: np.ndarray, level: int = MORTON_LEVEL) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer (x, y) tile coordinates of each point at zoom `level`."""
+    n = 1 << level
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lon) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+    return (np.clip((x * n).astype(np.int64), 0, n - 1),
+            np.clip((y * n).astype(np.int64), 0, n - 1))
+
+
+class StopTileIndex:
+    """One layer's stops (one service filter), sorted by Morton code, with clusters per zoom."""
+
+    def __init__(self, layer: str, rows: Iterable[Dict[str, Any]]):
+        column, how = LAYERS[layer]
+        self.layer = layer
+        rows = [r for r in rows if r.get('stop_lat') is not None and r.get('stop_lon') is not None]
+        lat = np.asarray([r['stop_lat'] for r in rows], dtype=np.float64)
+        lon = np.asarray([r['stop_lon'] for r in rows], dtype=np.float64)
+        value = np.asarray([r[column] for r in rows], dtype=np.int64)
+        code = morton(*mercator_cells(lat, lon))
+        order = np.argsort(code, kind='stable')
+        self.code, self.lat, self.lon, self.value = code[order], lat[order], lon[order], value[order]
+        self.stops = [(rows[i]['stop_id'], rows[i]['stop_name'], rows[i].get('stop_code')) for i in order]
+        self.range = (int(self.value.min()), int(self.value.max())) if len(value) else (0, 0)
+        digest = hashlib.sha1(self.code.tobytes())
+        digest.update(self.value.tobytes())
+        self.etag = f"{layer}-{digest.hexdigest()[:16]}"
+
+        reduce_value = np.maximum if how == 'max' else np.add
+        self.clusters: List[Dict[str, np.ndarray]] = []
+        for z in range(CLUSTER_MAX_ZOOM + 1):
+            cell = self.code >> (2 * (MORTON_LEVEL - min(z + CELL_LEVELS, MORTON_LEVEL)))
+            starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]]) if len(cell) else np.empty(0, np.int64)
+            count = np.diff(np.r_[starts, len(cell)])
+            self.clusters.append({
+                'cell': cell[starts],
+                'first': starts,
+                'count': count,
+                'value': reduce_value.reduceat(self.value, starts) if len(starts) else self.value[:0],
+                'lat': np.add.reduceat(self.lat, starts) / count if len(starts) else self.lat[:0],
+                'lon': np.add.reduceat(self.lon, starts) / count if len(starts) else self.lon[:0],
+            })
+
+    def _stop_feature(self, i: int) -> Dict[str, Any]:
+        stop_id, stop_name, stop_code = self.stops[i]
+        return _feature(self.lat[i], self.lon[i], {
+            "count": 1, "value": int(self.value[i]),
+            "stop_id": stop_id, "stop_name": stop_name, "stop_code": stop_code,
+        })
+
+    def tile(self, z: int, x: int, y: int) -> Dict[str, Any]:
+        """GeoJSON FeatureCollection for one tile; clusters carry a stop count and the aggregated value."""
+        check_tile(z, x, y)
+        prefix = int(morton(x, y))
+        features = []
+        if z <= CLUSTER_MAX_ZOOM:
+            level = self.clusters[z]
+            shift = 2 * (min(z + CELL_LEVELS, MORTON_LEVEL) - z)
+            lo, hi = np.searchsorted(level['cell'], [prefix << shift, (prefix + 1) << shift])
+            for j in range(lo, hi):
+                if level['count'][j] == 1:
+                    features.append(self._stop_feature(int(level['first'][j])))
+                else:
+                    features.append(_feature(level['lat'][j], level['lon'][j], {
+                        "count": int(level['count'][j]), "value": int(level['value'][j]),
+                    }))
+        else:
+            shift = 2 * (MORTON_LEVEL - z)
+            lo, hi = np.searchsorted(self.code, [prefix << shift, (prefix + 1) << shift])
+            features = [self._stop_feature(i) for i in range(lo, hi)]
+        return {"type": "FeatureCollection", "features": features, "range": list(self.range)}
+
+
+def check_tile(z: int, x: int, y: int) -> None:
+    """ValueError unless z/x/y names a tile of the scheme (zoom 0 to MORTON_LEVEL)."""
+    if not (0 <= z <= MORTON_LEVEL and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise ValueError(f"No tile {z}/{x}/{y} (zoom 0-{MORTON_LEVEL})")
+
+
+def _feature(lat: float, lon: float, properties: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [round(float(lon), 6), round(float(lat), 6)]},
+        "properties": properties,
+    }
+
+
+_indexes: "OrderedDict[Tuple[Any, ...], StopTileIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(key: Tuple[Any, ...], layer: str, rows: Callable[[], Iterable[Dict[str, Any]]]) -> StopTileIndex:
+    """The cached index for `key`, built from rows() on first use (LRU of TILE_INDEX_ENTRIES)."""
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = StopTileIndex(layer, rows())
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > max(TILE_INDEX_ENTRIES, 1):
+            _indexes.popitem(last=False)
+    return index
+
@@ -0,0 +1,176 @@
+"""Walking transfers between nearby stops, found with a uniform grid index.
+
+Stops are projected to metres and bucketed into square cells slightly larger than the
+walking radius, so every pair within the radius sits in the same or an adjacent cell.
+Candidate pairs come from joining each cell with its 3x3 neighbourhood via sorted cell
+keys, which is linear in stops plus pairs rather than O(n^2). Both directions of each
+pair are kept: (from_stop_id, to_stop_id, distance_m, walk_seconds).
+
+    python -m SQL.stop_transfers mysql                       # rebuild the stop_transfers table
+    python -m SQL.stop_transfers dataset ../dataset --out transfers.csv
+"""
+import math
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+TRANSFER_RADIUS_M = float(os.getenv("TRANSFER_RADIUS_M", "250"))
+WALK_SPEED_MPS = float(os.getenv("WALK_SPEED_MPS", "1.3"))
+INSERT_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "10000"))
+
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
+EARTH_RADIUS_M = 6371008.8
+# Cells are a little wider than the radius to absorb the flat projection's error away from lat0
+GRID_SLACK = 1.25
+
+STOP_TRANSFERS_DDL = (
+    "CREATE TABLE `stop_transfers` (\n"
+    "  `from_stop_id` VARCHAR(64) NOT NULL,\n"
+    "  `to_stop_id` VARCHAR(64) NOT NULL,\n"
+    "  `distance_m` FLOAT NOT NULL,\n"
+    "  `walk_seconds` INT NOT NULL,\n"
+    "  PRIMARY KEY (`from_stop_id`, `to_stop_id`)\n"
+    ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"
+)
+
+
+def haversine_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def pairs_within(lat: np.ndarray, lon: np.ndarray,
+                 radius_m: float = TRANSFER_RADIUS_M) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(from_index, to_index, distance_m) for every ordered pair of distinct points within radius_m.
+
+    Points with missing coordinates are skipped; output is sorted by (from, to).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    points = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    empty = np.empty(0, dtype=np.int64)
+    if len(points) < 2 or radius_m <= 0:
+        return empty, empty, np.empty(0, dtype=np.float64)
+    plat, plon = lat[points], lon[points]
+
+    cell = radius_m * GRID_SLACK
+    x = plon * M_PER_DEG_LON * math.cos(math.radians(float(plat.mean())))
+    y = plat * M_PER_DEG_LAT
+    cx = ((x - x.min()) // cell).astype(np.int64)
+    cy = ((y - y.min()) // cell).astype(np.int64)
+    # One spare column, so stepping off either edge of a row lands in an empty cell
+    width = int(cx.max()) + 2
+    key = cy * width + cx
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+
+    src_parts, dst_parts = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            target = key + dy * width + dx
+            lo = np.searchsorted(sorted_key, target, 'left')
+            counts = np.searchsorted(sorted_key, target, 'right') - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            src_parts.append(np.repeat(np.arange(len(points)), counts))
+            dst_parts.append(order[np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(total)])
+    src = np.concatenate(src_parts)
+    dst = np.concatenate(dst_parts)
+    # Cheap planar prefilter (with the same slack) before the exact great-circle distance
+    keep = (src != dst) & ((x[src] - x[dst]) ** 2 + (y[src] - y[dst]) ** 2 <= cell * cell)
+    src, dst = src[keep], dst[keep]
+    dist = haversine_m(plat[src], plon[src], plat[dst], plon[dst])
+    near = dist <= radius_m
+    src, dst, dist = points[src[near]], points[dst[near]], dist[near]
+    ordered = np.lexsort((dst, src))
+    return src[ordered], dst[ordered], dist[ordered]
+
+
+def walk_seconds(distance_m: np.ndarray) -> np.ndarray:
+    return np.ceil(np.asarray(distance_m) / WALK_SPEED_MPS).astype(np.int32)
+
+
+def compute_transfers(stops: pd.DataFrame, radius_m: float = TRANSFER_RADIUS_M) -> pd.DataFrame:
+    """stop_transfers rows for a frame with stop_id, stop_lat, stop_lon."""
+    lat = pd.to_numeric(stops['stop_lat'], errors='coerce').to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(stops['stop_lon'], errors='coerce').to_numpy(dtype=np.float64)
+    src, dst, dist = pairs_within(lat, lon, radius_m)
+    ids = stops['stop_id'].astype(str).to_numpy()
+    return pd.DataFrame({
+        'from_stop_id': ids[src],
+        'to_stop_id': ids[dst],
+        'distance_m': np.round(dist, 1),
+        'walk_seconds': walk_seconds(dist),
+    })
+
+
+def transfers_from_dataset(dataset_dir: str, radius_m: float = TRANSFER_RADIUS_M) -> pd.DataFrame:
+    stops = pd.read_csv(os.path.join(dataset_dir, 'stops.txt'), dtype=str, keep_default_na=False,
+                        usecols=lambda c: c.strip() in ('stop_id', 'stop_lat', 'stop_lon'))
+    return compute_transfers(stops.rename(columns=str.strip), radius_m)
+
+
+def write_mysql(engine, transfers: pd.DataFrame) -> None:
+    """Replace the stop_transfers table with `transfers`."""
+    sql = "INSERT INTO `stop_transfers` (from_stop_id, to_stop_id, distance_m, walk_seconds) VALUES (%s, %s, %s, %s)"
+    rows = list(zip(transfers['from_stop_id'], transfers['to_stop_id'],
+                    transfers['distance_m'].astype(float), transfers['walk_seconds'].astype(int)))
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("DROP TABLE IF EXISTS `stop_transfers`")
+        cursor.execute(STOP_TRANSFERS_DDL)
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(sql, rows[i:i + INSERT_BATCH_SIZE])
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def refresh_mysql(engine, radius_m: float = TRANSFER_RADIUS_M) -> int:
+    """Recompute stop_transfers from the stops table; returns the number of (directed) pairs."""
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        stops = pd.read_sql(text("SELECT stop_id, stop_lat, stop_lon FROM stops"), conn)
+    transfers = compute_transfers(stops, radius_m)
+    write_mysql(engine, transfers)
+    return len(transfers)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stop pairs within walking distance (grid index)")
+    parser.add_argument("source", choices=["mysql", "dataset"])
+    parser.add_argument("dataset", nargs="?", default=None, help="GTFS directory for the dataset source")
+    parser.add_argument("--radius", type=float, default=TRANSFER_RADIUS_M, help="Walking radius in metres")
+    parser.add_argument("--out", default=None, help="CSV output (dataset source)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.source == "mysql":
+        from .sql_utils import get_engine
+
+        pairs = refresh_mysql(get_engine(), args.radius)
+        print(f"stop_transfers: {pairs:,} pairs within {args.radius:.0f} m in {time.perf_counter() - start:.2f}s")
+        return 0
+    if not args.dataset:
+        parser.error("the dataset source needs a GTFS directory")
+    transfers = transfers_from_dataset(args.dataset, args.radius)
+    print(f"{len(transfers):,} pairs within {args.radius:.0f} m in {time.perf_counter() - start:.2f}s")
+    if args.out:
+        transfers.to_csv(args.out, index=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""Deterministic synthetic GTFS feeds for scale testing.
+
+The 1x profile approximates the GTA feed this project was built on; larger scales
+model bigger agencies by growing stops, routes and trips together.
+"""
+import csv
+import os
+import sys
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class ServicePattern:
+    service_id: str
+    days: str  # seven 0/1 flags, monday first
+    trip_share: float  # trips relative to the weekday count
+
+
+@dataclass(frozen=True)
+class FeedProfile:
+    stops: int = 10000
+    routes: int = 250
+    weekday_trips: int = 70000
+    avg_stops_per_trip: int = 60
+    services: tuple = (
+        ServicePattern('1', '1111100', 1.0),
+        ServicePattern('2', '0000010', 0.7),
+        ServicePattern('3', '0000001', 0.6),
+    )
+    not_in_service_share: float = 0.02
+    start_date: str = '20240101'
+    end_date: str = '20241231'
+
+    def scaled(self, scale: float) -> 'FeedProfile':
+        return replace(
+            self,
+            stops=max(10, int(self.stops * scale)),
+            routes=max(2, int(self.routes * scale)),
+            weekday_trips=max(10, int(self.weekday_trips * scale)),
+        )
+
+
+GTA_PROFILE = FeedProfile()
+SCALES = {'1x': 1, '10x': 10, '50x': 50}
+
+# Toronto-centred bounding box; bigger agencies cover proportionally more area
+CENTER_LAT, CENTER_LON = 43.70, -79.40
+BASE_SPAN_DEG = 0.35
+
+
+def _fmt_times(seconds: np.ndarray) -> pd.Series:
+    s = pd.Series(seconds)
+    hh = (s // 3600).astype(str).str.zfill(2)
+    mm = ((s % 3600) // 60).astype(str).str.zfill(2)
+    ss = (s % 60).astype(str).str.zfill(2)
+    return hh + ':' + mm + ':' + ss
+
+
+def _write_csv(path: str, header: List[str], rows: List[List]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _departure_profile(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Trip start times with AM/PM peaks, spanning 05:00 to 25:30 like real feeds."""
+    peak = rng.random(n)
+    am = rng.normal(8 * 3600, 3600, n)
+    pm = rng.normal(17 * 3600, 4500, n)
+    flat = rng.uniform(5 * 3600, 25.5 * 3600, n)
+    t = np.where(peak < 0.3, am, np.where(peak < 0.6, pm, flat))
+    return np.clip(t, 5 * 3600, 25.5 * 3600).astype(np.int64)
+
+
+def generate_feed(out_dir: str, scale: float = 1.0, seed: int = 42,
+                  profile: FeedProfile = GTA_PROFILE) -> Dict[str, int]:
+    """Write agency/calendar/routes/stops/trips/stop_times.txt; returns row counts."""
+    p = profile.scaled(scale)
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Stops scattered over an area that grows with the network
+    span = BASE_SPAN_DEG * np.sqrt(scale)
+    lat = CENTER_LAT + rng.uniform(-span, span, p.stops) * 0.7
+    lon = CENTER_LON + rng.uniform(-span, span, p.stops)
+    stop_ids = np.array([f'S{i}' for i in range(p.stops)])
+    stop_names = np.array([f'Synthetic Stop {i}' for i in range(p.stops)])
+    _write_csv(os.path.join(out_dir, 'stops.txt'),
+               ['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon'],
+               [[stop_ids[i], str(10000 + i), stop_names[i], f'{lat[i]:.6f}', f'{lon[i]:.6f}']
+                for i in range(p.stops)])
+
+    _write_csv(os.path.join(out_dir, 'agency.txt'),
+               ['agency_id', 'agency_name', 'agency_url', 'agency_timezone'],
+               [['1', 'Synthetic Transit', 'https://example.invalid', 'America/Toronto']])
+    _write_csv(os.path.join(out_dir, 'calendar.txt'),
+               ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+                'sunday', 'start_date', 'end_date'],
+               [[sp.service_id, *sp.days, p.start_date, p.end_date] for sp in p.services])
+
+    # Hub stops appear in many route patterns (Zipf popularity) so Q3 has transfer points
+    stop_weight = 1.0 / np.arange(1, p.stops + 1) ** 0.6
+    stop_weight = rng.permutation(stop_weight / stop_weight.sum())
+
+    route_rows, patterns = [], []
+    for r in range(p.routes):
+        n = int(np.clip(rng.normal(p.avg_stops_per_trip, p.avg_stops_per_trip * 0.35), 5, min(p.stops, 3 * p.avg_stops_per_trip)))
+        members = rng.choice(p.stops, size=n, replace=False, p=stop_weight)
+        # Order stops along a random axis so consecutive stops are geographically coherent
+        angle = rng.uniform(0, np.pi)
+        members = members[np.argsort(lat[members] * np.sin(angle) + lon[members] * np.cos(angle))]
+        patterns.append(members)
+        route_type = 1 if r < max(1, p.routes // 80) else (0 if r < max(2, p.routes // 20) else 3)
+        route_rows.append([f'R{r}', '1', str(r + 1), f'SYNTHETIC ROUTE {r + 1}', str(route_type)])
+    _write_csv(os.path.join(out_dir, 'routes.txt'),
+               ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'], route_rows)
+
+    route_weight = 1.0 / np.arange(1, p.routes + 1) ** 0.8
+    route_weight = rng.permutation(route_weight / route_weight.sum())
+
+    trips_path = os.path.join(out_dir, 'trips.txt')
+    st_path = os.path.join(out_dir, 'stop_times.txt')
+    counts = {'stops': p.stops, 'routes': p.routes, 'trips': 0, 'stop_times': 0}
+    with open(trips_path, 'w', newline='', encoding='utf-8') as tf, \
+            open(st_path, 'w', newline='', encoding='utf-8') as sf:
+        trip_writer = csv.writer(tf)
+        trip_writer.writerow(['route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id'])
+        sf.write('trip_id,arrival_time,departure_time,stop_id,stop_sequence,shape_dist_traveled\n')
+        trip_no = 0
+        for sp in p.services:
+            per_route = rng.multinomial(int(p.weekday_trips * sp.trip_share), route_weight)
+            for r, n_trips in enumerate(per_route):
+                if n_trips == 0:
+                    continue
+                pattern = patterns[r]
+                direction = rng.integers(0, 2, n_trips)
+                trip_ids = np.array([f'T{trip_no + i}' for i in range(n_trips)])
+                trip_no += n_trips
+                headsigns = np.where(
+                    rng.random(n_trips) < p.not_in_service_share, 'NOT IN SERVICE',
+                    np.where(direction == 0, f'{r + 1} towards {stop_names[pattern[-1]]}',
+                             f'{r + 1} towards {stop_names[pattern[0]]}'))
+                trip_writer.writerows(zip([f'R{r}'] * n_trips, [sp.service_id] * n_trips, trip_ids,
+                                          headsigns, direction))
+
+                # stop_times for every trip of this route at once: starts x hop offsets
+                hops = rng.integers(60, 180, len(pattern))
+                hops[0] = 0
+                offsets = np.cumsum(hops)
+                dist = np.round(np.cumsum(np.r_[0.0, rng.uniform(0.2, 0.8, len(pattern) - 1)]), 3)
+                times = _departure_profile(rng, n_trips)[:, None] + offsets[None, :]
+                seq = np.broadcast_to(np.arange(1, len(pattern) + 1), times.shape)
+                stops_fwd = np.broadcast_to(pattern, times.shape)
+                stops_rev = np.broadcast_to(pattern[::-1], times.shape)
+                stop_idx = np.where(direction[:, None] == 0, stops_fwd, stops_rev)
+                time_str = _fmt_times(times.ravel())
+                frame = pd.DataFrame({
+                    'trip_id': np.repeat(trip_ids, len(pattern)),
+                    'arrival_time': time_str,
+                    'departure_time': time_str,
+                    'stop_id': stop_ids[stop_idx.ravel()],
+                    'stop_sequence': seq.ravel(),
+                    'shape_dist_traveled': np.broadcast_to(dist, times.shape).ravel(),
+                })
+                frame.to_csv(sf, header=False, index=False)
+                counts['trips'] += n_trips
+                counts['stop_times'] += len(frame)
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic GTFS feed")
+    parser.add_argument("--scale", default="1x", help="1x, 10x, 50x or a number (1 = GTA-sized)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True, help="Output directory for the *.txt files")
+    args = parser.parse_args(argv)
+    scale = SCALES.get(args.scale, None) or float(args.scale.rstrip('x'))
+    counts = generate_feed(args.out, scale=scale, seed=args.seed)
+    print(", ".join(f"{k}={v:,}" for k, v in counts.items()) + f" -> {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
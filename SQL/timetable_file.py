@@ -0,0 +1,414 @@
+"""Read-only stop timetables in one memory-mapped file, for the Mongo timetable app.
+
+`Mongo/denormalization.py` writes this file next to the MongoDB documents, from the
+same rows. The file holds a stop index and dictionaries for services, routes and
+headsigns. Each (stop, service, route, headsign) group has its sorted departures
+(int32 seconds) as a slice of one array, addressed through offsets. Parallel arrays
+hold each departure's trip and stop_sequence, which the realtime overlay
+(`SQL/realtime.py`) keys its delays on. The app maps the file and answers timetable
+lookups by slicing those arrays, with no copies and no MongoDB round trip. Every process that maps the file shares its page cache.
+
+A new generation is written to a temporary file and renamed over the old one, so
+readers see either file whole. `current()` notices the rename and maps the new file.
+Requests already holding the old mapping finish on it.
+
+    python -m SQL.timetable_file build            # MySQL -> TIMETABLE_FILE
+    python -m SQL.timetable_file info [PATH]
+"""
+import datetime as dt
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+TIMETABLE_FILE = os.getenv(
+    "TIMETABLE_FILE", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'Mongo', 'timetable.bin'))
+TIMETABLE_RECHECK_SECONDS = float(os.getenv("TIMETABLE_RECHECK_SECONDS", "2"))
+
+MAGIC = b'GTFSTT02'
+ALIGN = 64
+MISSING = -1
+NOT_IN_SERVICE = "NOT IN SERVICE"
+# Per-departure realtime delays (int32 seconds) use these two values as markers
+NO_PREDICTION = np.iinfo(np.int32).min
+CANCELED = NO_PREDICTION + 1
+
+def _nullable(value: Any) -> Any:
+    return None if value is None or (not isinstance(value, str) and pd.isna(value)) else value
+
+
+def _departure_seconds(values: pd.Series) -> np.ndarray:
+    """MySQL TIME (timedelta) or 'H:MM:SS' text -> int32 seconds; missing -> MISSING."""
+    if pd.api.types.is_timedelta64_dtype(values):
+        secs = values.dt.total_seconds()
+        return secs.fillna(MISSING).to_numpy(dtype=np.int64).astype(np.int32)
+    from .numpy_engine import parse_gtfs_seconds
+
+    return parse_gtfs_seconds(values.where(values.notna(), '').astype(str))
+
+
+def clock(seconds: int) -> str:
+    """Same text as the MongoDB documents' departure_time once 'N days ' is stripped."""
+    h, rem = divmod(int(seconds) % 86400, 3600)
+    return f"{h:02d}:{rem // 60:02d}:{rem % 60:02d}"
+
+
+def predicted(scheduled: int, delay: int) -> Optional[str]:
+    """Clock text of a departure moved by its realtime delay; None without a prediction."""
+    if delay == NO_PREDICTION:
+        return None
+    if delay == CANCELED:
+        return "canceled"
+    return clock(int(scheduled) + int(delay))
+
+
+def _with_predictions(payload: Dict[str, Any], predictions: Optional[List[Optional[str]]]) -> Dict[str, Any]:
+    if predictions is not None:
+        payload["predicted"] = predictions
+    return payload
+
+
+class _Dictionary:
+    """Incremental value -> code mapping (None/NaN -> MISSING), with per-code attributes."""
+
+    def __init__(self):
+        self.index: Dict[Any, int] = {}
+        self.attrs: List[Tuple[Any, ...]] = []
+
+    def encode(self, keys: pd.Series, attrs: Optional[pd.DataFrame] = None) -> np.ndarray:
+        keys = keys.map(_nullable)
+        fresh = ~keys.isin(list(self.index)) & keys.notna()
+        if fresh.any():
+            first = keys[fresh].drop_duplicates()
+            for i, key in zip(first.index, first):
+                self.index[key] = len(self.attrs)
+                self.attrs.append(() if attrs is None else tuple(_nullable(v) for v in attrs.loc[i]))
+        return keys.map(self.index).fillna(MISSING).to_numpy(dtype=np.int32)
+
+
+class TimetableFileWriter:
+    """Collects ETL chunks (BUILD_SQL's columns) and writes the file atomically."""
+
+    def __init__(self):
+        self._stops = _Dictionary()
+        self._services = _Dictionary()
+        self._routes = _Dictionary()
+        self._headsigns = _Dictionary()
+        self._trips = _Dictionary()
+        self._parts: List[Tuple[np.ndarray, ...]] = []
+
+    def add(self, frame: pd.DataFrame) -> None:
+        frame = frame.reset_index(drop=True)
+        stop = self._stops.encode(frame['stop_id'].astype(str), frame[['stop_name', 'stop_code']])
+        service = self._services.encode(frame['service_id'].map(lambda v: None if _nullable(v) is None else str(v)))
+        route = self._routes.encode(frame['route_id'].astype(str), frame[['route_short_name', 'route_long_name']])
+        headsign = self._headsigns.encode(frame['trip_headsign'])
+        departure = _departure_seconds(frame['departure_time'])
+        trip = self._trips.encode(frame['trip_id'].astype(str))
+        sequence = pd.to_numeric(frame['stop_sequence'], errors='coerce').fillna(MISSING).to_numpy(dtype=np.int32)
+        keep = departure != MISSING
+        self._parts.append(tuple(a[keep] for a in (stop, service, route, headsign, departure, trip, sequence)))
+
+    def write(self, path: str = TIMETABLE_FILE) -> Dict[str, Any]:
+        columns = (
+            np.concatenate([p[i] for p in self._parts]) if self._parts else np.empty(0, np.int32)
+            for i in range(7))
+        stop, service, route, headsign, departure, trip, sequence = columns
+        order = np.lexsort((departure, headsign, route, service, stop))
+        stop, service, route, headsign, departure, trip, sequence = (
+            a[order] for a in (stop, service, route, headsign, departure, trip, sequence))
+        n = len(departure)
+        # A group starts wherever any of its four keys changes
+        same = np.zeros(n, dtype=bool)
+        same[1:] = True
+        for key in (stop, service, route, headsign):
+            same[1:] &= key[1:] == key[:-1]
+        starts = np.flatnonzero(~same)
+        n_stops = len(self._stops.attrs)
+        arrays = {
+            'stop_offsets': np.searchsorted(stop[starts], np.arange(n_stops + 1)).astype(np.int64),
+            'group_service': service[starts],
+            'group_route': route[starts],
+            'group_headsign': headsign[starts],
+            'group_offsets': np.r_[starts, n].astype(np.int64),
+            'departures': departure.astype(np.int32),
+            'trips': trip,
+            'stop_sequences': sequence,
+        }
+        header: Dict[str, Any] = {
+            "generation": dt.datetime.now(dt.timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ'),
+            "stops": {"ids": list(self._stops.index),
+                      "names": [a[0] for a in self._stops.attrs],
+                      "codes": [None if a[1] is None else str(a[1]) for a in self._stops.attrs]},
+            "services": list(self._services.index),
+            "routes": {"ids": list(self._routes.index),
+                       "short_names": [None if a[0] is None else str(a[0]) for a in self._routes.attrs],
+                       "long_names": [a[1] for a in self._routes.attrs]},
+            "headsigns": list(self._headsigns.index),
+            "trips": list(self._trips.index),
+            "arrays": {},
+        }
+        # Offsets are relative to the first aligned byte after the header
+        offset = 0
+        for name, a in arrays.items():
+            header["arrays"][name] = {"dtype": a.dtype.str, "offset": offset, "length": len(a)}
+            offset += -(-a.nbytes // ALIGN) * ALIGN
+        blob = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        data_start = -(-(len(MAGIC) + 8 + len(blob)) // ALIGN) * ALIGN
+
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(blob)) + blob)
+            for name, a in arrays.items():
+                f.seek(data_start + header["arrays"][name]["offset"])
+                f.write(a.tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return {"path": path, "generation": header["generation"], "stops": n_stops,
+                "groups": len(starts), "departures": n, "bytes": data_start + offset}
+
+
+class TimetableFile:
+    """A mapped timetable file; all arrays are read-only views of the mapping."""
+
+    def __init__(self, path: str = TIMETABLE_FILE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            st = os.fstat(f.fileno())
+        self.identity = (st.st_ino, st.st_mtime_ns)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a timetable file of this version (rebuild it with denormalization.py)")
+        (length,) = struct.unpack_from('<Q', self._mmap, len(MAGIC))
+        header_end = len(MAGIC) + 8 + length
+        header = json.loads(self._mmap[len(MAGIC) + 8:header_end])
+        data_start = -(-header_end // ALIGN) * ALIGN
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            setattr(self, name, np.frombuffer(self._mmap, dtype=dtype, count=spec["length"],
+                                              offset=data_start + spec["offset"]))
+        self.generation = header["generation"]
+        self.stop_ids = header["stops"]["ids"]
+        self.stop_names = header["stops"]["names"]
+        self.stop_codes = header["stops"]["codes"]
+        self.service_ids = header["services"]
+        self.route_ids = header["routes"]["ids"]
+        self.route_short_names = header["routes"]["short_names"]
+        self.route_long_names = header["routes"]["long_names"]
+        self.headsigns = header["headsigns"]
+        self.trip_ids = header["trips"]
+        self.stop_index = {s: i for i, s in enumerate(self.stop_ids)}
+        self._service_index = {s: i for i, s in enumerate(self.service_ids)}
+
+    def headsign(self, code: int) -> Optional[str]:
+        return None if code == MISSING else self.headsigns[code]
+
+    def departures_of(self, group: int) -> np.ndarray:
+        return self.departures[self.group_offsets[group]:self.group_offsets[group + 1]]
+
+    def groups(self, stop_id: str, allowed: Optional[Set[str]] = None) -> Optional[np.ndarray]:
+        """Group numbers at `stop_id` whose service is allowed (None = all); None for an unknown stop."""
+        s = self.stop_index.get(stop_id)
+        if s is None:
+            return None
+        groups = np.arange(self.stop_offsets[s], self.stop_offsets[s + 1])
+        if allowed is not None:
+            codes = [self._service_index[sid] for sid in allowed if sid in self._service_index]
+            groups = groups[np.isin(self.group_service[groups], codes)]
+        return groups
+
+    def _rows(self, groups: Iterable[int]) -> np.ndarray:
+        """Departure rows of `groups`, in the order the MongoDB path sorts their times."""
+        parts = [np.arange(self.group_offsets[g], self.group_offsets[g + 1]) for g in groups]
+        if not parts:
+            return np.empty(0, np.int64)
+        rows = np.concatenate(parts)
+        # The MongoDB path sorts 'HH:MM:SS' strings with the day part dropped
+        return rows[np.argsort(self.departures[rows] % 86400, kind='stable')]
+
+    def _clock_lists(self, groups: Iterable[int],
+                     delays: Optional[np.ndarray] = None) -> Tuple[List[str], Optional[List[Optional[str]]]]:
+        """Scheduled times, and with `delays` the predicted time of each (None / "canceled")."""
+        rows = self._rows(groups)
+        times = [clock(t) for t in self.departures[rows]]
+        if delays is None:
+            return times, None
+        return times, [predicted(t, d) for t, d in zip(self.departures[rows], delays[rows])]
+
+    # --- Payloads of the Mongo app's endpoints ---
+
+    def timetable(self, stop_id: str, allowed: Optional[Set[str]] = None) -> Optional[Dict[str, Dict[str, List[str]]]]:
+        groups = self.groups(stop_id, allowed)
+        if groups is None:
+            return None
+        by_key: Dict[Tuple[Any, Any], List[int]] = {}
+        for g in groups:
+            key = (self.route_long_names[self.group_route[g]], self.headsign(self.group_headsign[g]))
+            by_key.setdefault(key, []).append(int(g))
+        schedule: Dict[Any, Dict[Any, List[str]]] = {}
+        for (route, headsign), members in by_key.items():
+            schedule.setdefault(route, {})[headsign] = self._clock_lists(members)[0]
+        return schedule
+
+    def routes_for_stop(self, stop_id: str, allowed: Optional[Set[str]] = None) -> List[Dict[str, str]]:
+        groups = self.groups(stop_id, allowed)
+        pairs = set()
+        for g in () if groups is None else groups:
+            headsign = self.headsign(self.group_headsign[g])
+            short_name = self.route_short_names[self.group_route[g]]
+            if headsign is None or headsign == NOT_IN_SERVICE or short_name is None:
+                continue
+            pairs.add((short_name, headsign))
+        return [{"route_short_name": r, "trip_headsign": h} for r, h in sorted(pairs)]
+
+    def arrivals(self, stop_id: str, allowed: Optional[Set[str]] = None, route_short_name: Optional[str] = None,
+                 trip_headsign: Optional[str] = None, delays: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """The get_arrivals payload; with `delays`, each times list gets a parallel "predicted" list."""
+        groups = self.groups(stop_id, allowed)
+        flat = route_short_name is not None and trip_headsign is not None
+        if groups is None:
+            return {"times": [], "count": 0}  # what the MongoDB path answers for an unknown stop
+        if flat:
+            times, predictions = self._clock_lists((
+                g for g in groups
+                if self.headsign(self.group_headsign[g]) == trip_headsign
+                and str(self.route_short_names[self.group_route[g]]) == route_short_name), delays)
+            return _with_predictions({"times": times, "count": len(times)}, predictions)
+
+        by_key: Dict[Tuple[str, str], List[int]] = {}
+        for g in groups:
+            headsign = self.headsign(self.group_headsign[g])
+            if headsign is None or headsign == NOT_IN_SERVICE:
+                continue
+            by_key.setdefault((self.route_ids[self.group_route[g]], headsign), []).append(int(g))
+        out = []
+        for (route_id, headsign), members in by_key.items():
+            short_name = self.route_short_names[self.group_route[members[0]]]
+            times, predictions = self._clock_lists(members, delays)
+            out.append(_with_predictions({
+                "route_id": route_id, "route_short_name": "" if short_name is None else short_name,
+                "trip_headsign": headsign, "times": times, "count": len(times)}, predictions))
+        out.sort(key=lambda g: (g["route_short_name"], g["trip_headsign"]))
+        return {"groups": out, "total_count": sum(g["count"] for g in out)}
+
+    def next_departures(self, stop_id: str, after: int, limit: int,
+                        allowed: Optional[Set[str]] = None,
+                        delays: Optional[np.ndarray] = None) -> Optional[List[Dict[str, Any]]]:
+        """The first `limit` departures scheduled at or after `after` seconds (GTFS clock, may pass 24:00).
+
+        With `delays`, each departure also carries its "predicted" time (None / "canceled").
+        """
+        groups = self.groups(stop_id, allowed)
+        if groups is None:
+            return None
+        found: List[Tuple[int, int]] = []
+        for g in groups:
+            headsign = self.headsign(self.group_headsign[g])
+            if headsign == NOT_IN_SERVICE:
+                continue
+            times = self.departures_of(g)
+            first = int(np.searchsorted(times, after))
+            row = int(self.group_offsets[g]) + first
+            found.extend((int(t), int(g), row + i) for i, t in enumerate(times[first:first + limit]))
+        found.sort()
+        out = []
+        for t, g, row in found[:limit]:
+            item = {
+                "departure_time": f"{t // 3600:02d}:{t % 3600 // 60:02d}:{t % 60:02d}",
+                "route_id": self.route_ids[self.group_route[g]],
+                "route_short_name": self.route_short_names[self.group_route[g]],
+                "trip_headsign": self.headsign(self.group_headsign[g]),
+                "service_id": self.service_ids[self.group_service[g]] if self.group_service[g] != MISSING else None,
+            }
+            if delays is not None:
+                item["predicted"] = predicted(t, delays[row])
+            out.append(item)
+        return out
+
+
+_current: Dict[str, Tuple[float, Optional[TimetableFile]]] = {}
+_current_lock = threading.Lock()
+
+
+def current(path: str = TIMETABLE_FILE) -> Optional[TimetableFile]:
+    """The mapped file at `path` (None when absent), remapped after a new generation is renamed in.
+
+    The file is re-stat'ed at most every TIMETABLE_RECHECK_SECONDS.
+    """
+    now = time.monotonic()
+    checked, tt = _current.get(path, (None, None))
+    if checked is not None and now - checked < TIMETABLE_RECHECK_SECONDS:
+        return tt
+    with _current_lock:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            tt = None
+        else:
+            if tt is None or tt.identity != (st.st_ino, st.st_mtime_ns):
+                tt = TimetableFile(path)
+        _current[path] = (now, tt)
+    return tt
+
+
+BUILD_SQL = (
+    "SELECT st.stop_id, s.stop_name, s.stop_code, r.route_id, r.route_short_name, r.route_long_name, "
+    "t.trip_id, t.service_id, t.trip_headsign, st.stop_sequence, st.departure_time "
+    "FROM stop_times st "
+    "JOIN stops s ON s.stop_id = st.stop_id "
+    "JOIN trips t ON t.trip_id = st.trip_id "
+    "JOIN routes r ON r.route_id = t.route_id"
+)
+
+
+def build_from_mysql(engine, path: str = TIMETABLE_FILE, chunk_size: int = 100000) -> Dict[str, Any]:
+    from sqlalchemy import text
+
+    writer = TimetableFileWriter()
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(text(BUILD_SQL), conn, chunksize=chunk_size):
+            writer.add(chunk)
+    return writer.write(path)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory-mapped stop timetables for the Mongo app")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Write the file from MySQL (the ETL also writes it)")
+    build.add_argument("--out", default=TIMETABLE_FILE)
+    info = sub.add_parser("info", help="Summarise a timetable file")
+    info.add_argument("path", nargs="?", default=TIMETABLE_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from .sql_utils import get_engine
+
+        start = time.perf_counter()
+        summary = build_from_mysql(get_engine(), args.out)
+        print(json.dumps(summary, indent=2))
+        print(f"Built in {time.perf_counter() - start:.2f}s")
+        return 0
+    tt = TimetableFile(args.path)
+    print(json.dumps({
+        "path": args.path, "generation": tt.generation, "stops": len(tt.stop_ids),
+        "services": len(tt.service_ids), "routes": len(tt.route_ids), "headsigns": len(tt.headsigns),
+        "trips": len(tt.trip_ids), "groups": len(tt.group_service), "departures": len(tt.departures),
+        "bytes": os.path.getsize(args.path),
+    }, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
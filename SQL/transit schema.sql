@@ -27,6 +27,16 @@ CREATE TABLE IF NOT EXISTS `transit`.`calendar` (
   PRIMARY KEY (`service_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- -----------------------------------------------------
+-- Table `transit`.`calendar_dates`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `transit`.`calendar_dates` (
+  `service_id` VARCHAR(64) NOT NULL,
+  `date` DATE NOT NULL,
+  `exception_type` TINYINT NOT NULL,
+  PRIMARY KEY (`service_id`, `date`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- -----------------------------------------------------
 -- Table `transit`.`routes`
 -- -----------------------------------------------------
@@ -0,0 +1,25 @@
+"""DuckDB and the NumPy engine give the same Q1–Q4 answers (limit=all) on a synthetic feed."""
+import pytest
+
+from SQL import duckdb_backend, numpy_engine
+
+from conftest import SERVICE_FILTERS
+
+QUERIES = [
+    ("query_q1_busiest_stops", "stop_id"),
+    ("query_q2_avg_duration_speed", "route_long_name"),
+    ("query_q3_transfer_points", "stop_id"),
+    ("query_q3_transfer_clusters", "stop_id"),
+    ("query_q4_hourly_frequency", "route_long_name"),
+]
+
+
+@pytest.mark.parametrize("service_id", SERVICE_FILTERS, ids=str)
+@pytest.mark.parametrize("query, key", QUERIES, ids=[q for q, _ in QUERIES])
+def test_duckdb_matches_numpy(synthetic_feed, query, key, service_id):
+    expected = duckdb_backend._keyed(getattr(numpy_engine, query)(service_id, "all"), key)
+    actual = duckdb_backend._keyed(getattr(duckdb_backend, query)(service_id, "all"), key)
+    assert len(expected) > 1
+    problems = []
+    duckdb_backend._diff(f"{query}[service_id={service_id}]", expected, actual, problems)
+    assert problems == []
@@ -0,0 +1,29 @@
+"""DuckDB and the NumPy engine give the same Q1–Q4 answers (limit=all) as sql_utils on MySQL.
+
+Needs TEST_MYSQL_URL (see conftest.py); skipped otherwise.
+"""
+import pytest
+
+from SQL import duckdb_backend, numpy_engine, sql_utils
+
+from conftest import SERVICE_FILTERS
+from test_backend_parity import QUERIES
+
+BACKENDS = {"duckdb": duckdb_backend, "numpy": numpy_engine}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("service_id", SERVICE_FILTERS, ids=str)
+@pytest.mark.parametrize("query, key", QUERIES, ids=[q for q, _ in QUERIES])
+def test_matches_mysql(mysql_engine, backend, query, key, service_id):
+    expected = duckdb_backend._keyed(getattr(sql_utils, query)(mysql_engine, service_id, "all"), key)
+    actual = duckdb_backend._keyed(getattr(BACKENDS[backend], query)(service_id, "all"), key)
+    assert len(expected) > 1
+    problems = []
+    duckdb_backend._diff(f"{query}[service_id={service_id}, {backend}]", expected, actual, problems)
+    assert problems == []
+
+
+def test_duckdb_parity_check(mysql_engine):
+    """`python -m SQL.duckdb_backend parity`, limited Q2/Q4 included, finds nothing."""
+    assert duckdb_backend.check_parity(mysql_engine, service_ids=SERVICE_FILTERS) == []
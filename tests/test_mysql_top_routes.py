@@ -0,0 +1,80 @@
+"""sql_utils' pushed-down Q2/Q4 statements against the pre-push-down shape, on MySQL.
+
+The `_before_*` helpers are the sql_utils code before the push-down (with the name
+tie-break added, so the selection is deterministic). Needs TEST_MYSQL_URL (see conftest.py).
+"""
+import pytest
+
+from SQL import sql_utils
+from SQL.sql_utils import (
+    HOURLY_VIEW,
+    _build_q2_whole_week,
+    _build_q4_response,
+    _q2_global_statement,
+    _q2_per_service_statement,
+    _q4_data_statement,
+    _sanitize_limit,
+    _service_condition,
+    _service_id_filter,
+    _service_params,
+    _service_text,
+)
+
+from conftest import SERVICE_FILTERS
+from test_top_routes import LIMITS
+
+
+def _before_q4(engine, service_id, limit_param):
+    """Rank the routes in one query, fetch every route's hourly rows, keep the ranked ones."""
+    service_filter = _service_id_filter(service_id)
+    params = _service_params(service_filter) if service_filter is not None else {}
+    where = f"WHERE {_service_condition('vhf.service_id', service_filter)}\n" if service_filter is not None else ""
+    rank_sql = _service_text(
+        "SELECT r.route_long_name AS route, SUM(vhf.trips_per_hour) AS total_daily_trips\n"
+        f"FROM {HOURLY_VIEW} vhf\n"
+        "JOIN routes r ON r.route_id = vhf.route_id\n"
+        + where
+        + "GROUP BY r.route_long_name\n"
+        "ORDER BY total_daily_trips DESC, r.route_long_name\n"
+        f"LIMIT {_sanitize_limit(limit_param)}",
+        params,
+    )
+    with engine.connect() as conn:
+        selected_routes = {r["route"] for r in conn.execute(rank_sql, params).mappings().all()}
+        rows = conn.execute(*_q4_data_statement(service_filter)).mappings().all()
+    return _build_q4_response(rows, selected_routes, service_filter)
+
+
+def _before_q2_whole_week(engine, limit_param):
+    """The ranked routes, then the per-service rows of every route."""
+    with engine.connect() as conn:
+        global_rows = conn.execute(_q2_global_statement(_sanitize_limit(limit_param))).mappings().all()
+        ps_rows = conn.execute(_q2_per_service_statement()).mappings().all()
+    return _build_q2_whole_week(global_rows, ps_rows)
+
+
+@pytest.mark.parametrize("limit_param", LIMITS)
+@pytest.mark.parametrize("service_id", SERVICE_FILTERS, ids=str)
+def test_q4_top_routes(mysql_engine, service_id, limit_param):
+    top = sql_utils.query_q4_hourly_frequency(mysql_engine, service_id, limit_param)
+    assert len(top["routes"]) == int(limit_param)
+    assert top == _before_q4(mysql_engine, service_id, limit_param)
+
+    # The statement returns the top routes' rows plus one NULL-route row per service
+    service_filter = _service_id_filter(service_id)
+    with mysql_engine.connect() as conn:
+        rows = conn.execute(*_q4_data_statement(service_filter, int(limit_param))).mappings().all()
+        services = {r["service_id"] for r in conn.execute(*_q4_data_statement(service_filter)).mappings()}
+    assert {r["route"] for r in rows if r["route"] is not None} == {r["route_long_name"] for r in top["routes"]}
+    assert sorted(r["service_id"] for r in rows if r["route"] is None) == sorted(services)
+
+
+@pytest.mark.parametrize("limit_param", LIMITS)
+def test_q2_whole_week_top_routes(mysql_engine, limit_param):
+    top = sql_utils.query_q2_avg_duration_speed(mysql_engine, None, limit_param)
+    assert len(top["routes"]) == int(limit_param)
+    assert top == _before_q2_whole_week(mysql_engine, limit_param)
+
+    with mysql_engine.connect() as conn:
+        rows = conn.execute(_q2_per_service_statement(int(limit_param))).mappings().all()
+    assert {r["route"] for r in rows} == {r["route_long_name"] for r in top["routes"]}
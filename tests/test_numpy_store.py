@@ -0,0 +1,49 @@
+"""Rebuilding the NumPy cache publishes a new generation and leaves mapped arrays intact."""
+import json
+import os
+import threading
+
+import numpy as np
+
+from SQL import numpy_engine
+
+
+def _generation(cache_dir):
+    with open(os.path.join(cache_dir, numpy_engine.MANIFEST)) as f:
+        return json.load(f)["generation"]
+
+
+def test_rebuild_keeps_mapped_store_readable(synthetic_feed, tmp_path):
+    cache_dir = str(tmp_path / "npy_cache")
+    numpy_engine.build_store(synthetic_feed, cache_dir)
+    first = _generation(cache_dir)
+    store = numpy_engine.load_store(cache_dir)
+    before = np.array(store.st_trip)
+
+    numpy_engine.build_store(synthetic_feed, cache_dir)
+    second = _generation(cache_dir)
+    assert second != first
+    np.testing.assert_array_equal(store.st_trip, before)
+    np.testing.assert_array_equal(numpy_engine.load_store(cache_dir).st_trip, before)
+
+    numpy_engine.build_store(synthetic_feed, cache_dir)
+    generations = sorted(e for e in os.listdir(cache_dir) if e.startswith("gen-"))
+    assert generations == sorted([second, _generation(cache_dir)])
+    assert not [e for e in os.listdir(cache_dir) if e.startswith(".build-")]
+
+
+def test_get_store_builds_once(synthetic_feed, tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_engine, "CACHE_DIR", str(tmp_path / "npy_cache"))
+    monkeypatch.setattr(numpy_engine, "_store", None)
+    builds = []
+    build_store = numpy_engine.build_store
+    monkeypatch.setattr(numpy_engine, "build_store", lambda: builds.append(1) or build_store())
+
+    stores = []
+    threads = [threading.Thread(target=lambda: stores.append(numpy_engine.get_store())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1
+    assert len({id(s) for s in stores}) == 1
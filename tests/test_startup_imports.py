@@ -0,0 +1,15 @@
+"""Importing either app stays within IMPORT_BUDGET_MS and loads none of the heavy modules.
+
+The same check as `python -m SQL.startup check-imports`: each app is imported in a fresh
+`python -X importtime` interpreter, best of three runs.
+"""
+import pytest
+
+from SQL.startup import APP_IMPORTS, HEAVY_MODULES, IMPORT_BUDGET_MS, import_profile
+
+
+@pytest.mark.parametrize("app", sorted(APP_IMPORTS))
+def test_app_import_budget(app):
+    best, modules = min((import_profile(app) for _ in range(3)), key=lambda p: p[0])
+    assert sorted(m for m in modules if m in HEAVY_MODULES) == []
+    assert best <= IMPORT_BUDGET_MS, f"{app} app imports in {best:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
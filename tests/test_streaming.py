@@ -0,0 +1,67 @@
+"""Streamed Q1/Q3 responses (limit=all, NDJSON) when the row iterator fails."""
+import json
+
+import pymysql
+import pytest
+from sqlalchemy import exc
+
+import SQL.app as sql_app
+
+ROWS = [{"stop_id": "S1", "num_unique_routes": 3}, {"stop_id": "S2", "num_unique_routes": 2}]
+
+
+def _statement_timeout():
+    return exc.OperationalError("SELECT ... FROM stop_times", {"service_id": "1"},
+                                pymysql.err.OperationalError(3024, "maximum statement execution time exceeded"))
+
+
+def _rows_then(error, rows=()):
+    yield from rows
+    raise error
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sql_app, "_stale_cache", sql_app.StaleCache())
+    return sql_app.app.test_client()
+
+
+def test_timeout_before_first_row_is_answered_by_the_view(client, monkeypatch):
+    monkeypatch.setattr(sql_app, "_q1_rows", lambda *args: _rows_then(_statement_timeout()))
+    response = client.get("/api/q1?service_id=1&limit=all")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert response.get_json()["error"]
+
+
+@pytest.mark.parametrize("query", ["limit=all", "limit=all&format=ndjson"])
+def test_empty_result_streams_a_complete_body(client, monkeypatch, query):
+    monkeypatch.setattr(sql_app, "_q1_rows", lambda *args: iter(()))
+    response = client.get(f"/api/q1?service_id=1&{query}")
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == ("" if "ndjson" in query else '{"items":[]}\n')
+
+
+def test_error_mid_stream_leaves_json_unterminated(client, monkeypatch):
+    monkeypatch.setattr(sql_app, "_q1_rows", lambda *args: _rows_then(RuntimeError("connection lost"), ROWS))
+    response = client.get("/api/q1?service_id=1&limit=all")
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert body.startswith('{"items":[') and not body.rstrip().endswith("]}")
+    with pytest.raises(ValueError):
+        json.loads(body)
+
+
+def test_error_mid_stream_ends_ndjson_with_an_error_line(client, monkeypatch):
+    monkeypatch.setattr(sql_app, "_q3_rows", lambda *args: _rows_then(RuntimeError("connection lost"), ROWS))
+    response = client.get("/api/q3?service_id=1&limit=all&format=ndjson")
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.status_code == 200
+    assert lines[:-1] == ROWS
+    assert "error" in lines[-1] and "connection lost" not in lines[-1]["error"]
+
+
+def test_timeout_response_does_not_expose_the_statement(client, monkeypatch):
+    monkeypatch.setattr(sql_app, "_q1_rows", lambda *args: _rows_then(_statement_timeout()))
+    body = client.get("/api/q1?service_id=1&limit=all").get_data(as_text=True)
+    assert "stop_times" not in body and "service_id" not in body
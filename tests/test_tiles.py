@@ -0,0 +1,23 @@
+"""/tiles/<layer>/<z>/<x>/<y>: revalidation against the layer ETag and tile bounds."""
+import pytest
+
+import SQL.app as sql_app
+
+
+@pytest.fixture
+def client(synthetic_feed):
+    return sql_app.app.test_client()
+
+
+def test_matching_etag_gets_304(client):
+    etag = client.get("/tiles/q1/3/2/2?service_id=1").headers["ETag"]
+    response = client.get("/tiles/q1/3/2/2?service_id=1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+@pytest.mark.parametrize("tile", ["3/8/0", "3/0/8", "25/0/0"])
+def test_out_of_range_tile_is_404_even_with_a_matching_etag(client, tile):
+    etag = client.get("/tiles/q1/3/2/2?service_id=1").headers["ETag"]
+    response = client.get(f"/tiles/q1/{tile}?service_id=1", headers={"If-None-Match": etag})
+    assert response.status_code == 404
+    assert "error" in response.get_json()
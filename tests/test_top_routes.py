@@ -0,0 +1,152 @@
+"""Q2/Q4 with a limit: the top routes pushed into SQL against limit=all and the pre-push-down shape.
+
+Before the push-down, Q4 ranked the routes in one query, fetched every route's hourly rows
+and kept the ranked ones in Python; whole-week Q2 fetched every route's per-service rows.
+The `_before_*` helpers below rebuild those shapes (with the same name tie-break, so the
+selection is deterministic) to check that the responses did not change.
+"""
+import pytest
+
+from SQL import duckdb_backend as db
+from SQL.sql_utils import _build_q2_whole_week, _build_q4_response, _sanitize_limit, _service_id_filter
+
+from conftest import SERVICE_FILTERS
+
+LIMITS = ["1", "5", "10"]
+
+
+def _before_q4(service_id, limit_param):
+    service_filter = _service_id_filter(service_id)
+    params = {}
+    where = db._filters(service_filter, None, params, service_col="vhf.service_id")
+    rank_sql = (
+        "SELECT r.route_long_name AS route, SUM(vhf.trips_per_hour) AS total_daily_trips\n"
+        "FROM vw_hourly_frequency vhf\n"
+        "JOIN routes r ON r.route_id = vhf.route_id\n"
+        + where
+        + "GROUP BY r.route_long_name\n"
+        "ORDER BY total_daily_trips DESC, r.route_long_name\n"
+        + db._limit_clause(_sanitize_limit(limit_param))
+    )
+    selected_routes = {r["route"] for r in db._fetch(rank_sql, params)}
+    data_sql = (
+        "SELECT r.route_long_name AS route, r.route_short_name AS route_short, vhf.service_id,\n"
+        "       vhf.hour_of_day, vhf.trips_per_hour\n"
+        "FROM vw_hourly_frequency vhf\n"
+        "JOIN routes r ON r.route_id = vhf.route_id\n"
+        + where
+        + "ORDER BY r.route_long_name, vhf.service_id, vhf.hour_of_day\n"
+    )
+    return _build_q4_response(db._fetch(data_sql, params), selected_routes, service_filter)
+
+
+def _before_q2_whole_week(limit_param):
+    global_sql = (
+        db._Q2_TRIP_STATS_CTE
+        + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short,\n"
+        "       COUNT(*) AS total_trips,\n"
+        "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+        "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+        "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+        "FROM trip_stats ts\n"
+        "JOIN routes r ON r.route_id = ts.route_id\n"
+        "GROUP BY r.route_long_name\n"
+        "ORDER BY avg_duration_min DESC, r.route_long_name\n"
+        + db._limit_clause(_sanitize_limit(limit_param))
+    )
+    per_service_sql = (
+        db._Q2_TRIP_STATS_CTE
+        + "SELECT r.route_long_name AS route, ANY_VALUE(r.route_short_name) AS route_short, ts.service_id,\n"
+        "       COUNT(*) AS total_trips,\n"
+        "       AVG(ts.trip_distance) AS avg_trip_distance_km,\n"
+        "       AVG(ts.trip_duration_seconds)/60.0 AS avg_duration_min,\n"
+        "       STDDEV_POP(ts.trip_duration_seconds)/60.0 AS duration_stddev_min,\n"
+        "       AVG(ts.trip_distance / NULLIF(ts.trip_duration_seconds,0) * 3600) AS avg_speed_kmh\n"
+        "FROM trip_stats ts\n"
+        "JOIN routes r ON r.route_id = ts.route_id\n"
+        "GROUP BY r.route_long_name, ts.service_id\n"
+    )
+    return _build_q2_whole_week(db._fetch(global_sql, {}), db._fetch(per_service_sql, {}))
+
+
+def _top_n_problems(full, top, limit_param, rank, meta_keys):
+    problems = []
+    db._check_top_n("top", full, top, int(limit_param), rank, meta_keys, problems)
+    return problems
+
+
+@pytest.mark.parametrize("limit_param", LIMITS)
+@pytest.mark.parametrize("service_id", SERVICE_FILTERS, ids=str)
+def test_q4_top_routes(synthetic_feed, service_id, limit_param):
+    top = db.query_q4_hourly_frequency(service_id, limit_param)
+    full = db.query_q4_hourly_frequency(service_id, "all")
+    assert len(full["routes"]) > int(limit_param)
+    assert top == _before_q4(service_id, limit_param)
+    assert _top_n_problems(full, top, limit_param, db._q4_rank, ("max_hour",)) == []
+    assert top["max_hour"] == full["max_hour"]
+    by_route = {r["route_long_name"]: r for r in full["routes"]}
+    for route in top["routes"]:
+        assert route.keys() == by_route[route["route_long_name"]].keys()
+        if service_id is None:
+            # Every service of the feed, including those the top routes do not run on
+            assert route["totals_by_service"] == by_route[route["route_long_name"]]["totals_by_service"]
+
+
+def _write_feed(directory, tables):
+    directory.mkdir()
+    for name, rows in tables.items():
+        (directory / f"{name}.txt").write_text("\n".join(",".join(row) for row in rows) + "\n")
+
+
+@pytest.fixture
+def uneven_feed(synthetic_feed, tmp_path, monkeypatch):
+    """Route A is the busiest but only runs on service 1; route B runs once, on service 2 at 25:10."""
+    dataset = tmp_path / "gtfs"
+    _write_feed(dataset, {
+        "stops": [("stop_id", "stop_code", "stop_name", "stop_lat", "stop_lon"),
+                  ("S1", "1", "One", "43.70", "-79.40"), ("S2", "2", "Two", "43.71", "-79.41")],
+        "routes": [("route_id", "route_short_name", "route_long_name", "route_type"),
+                   ("A", "1", "Route A", "3"), ("B", "2", "Route B", "3")],
+        "trips": [("route_id", "service_id", "trip_id", "trip_headsign", "direction_id"),
+                  ("A", "1", "A1", "East", "0"), ("A", "1", "A2", "East", "0"), ("A", "1", "A3", "East", "0"),
+                  ("B", "2", "B1", "North", "0")],
+        "stop_times": [("trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence")]
+        + [(trip, f"0{h}:00:00", f"0{h}:00:00", "S1", "1") for trip, h in (("A1", 6), ("A2", 7), ("A3", 8))]
+        + [(trip, f"0{h}:20:00", f"0{h}:20:00", "S2", "2") for trip, h in (("A1", 6), ("A2", 7), ("A3", 8))]
+        + [("B1", "25:10:00", "25:10:00", "S1", "1"), ("B1", "25:30:00", "25:30:00", "S2", "2")],
+    })
+    monkeypatch.setattr(db, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    db.reset_connection()
+    db.export_snapshots_from_dataset(str(dataset))
+    yield
+    db.reset_connection()
+
+
+def test_q4_top_routes_keep_every_service(uneven_feed):
+    """The top route alone does not run on service 2 nor after 08:00; the response still covers both."""
+    top = db.query_q4_hourly_frequency(None, "1")
+    assert [r["route_long_name"] for r in top["routes"]] == ["Route A"]
+    assert top["max_hour"] == 25
+    assert top["routes"][0]["totals_by_service"] == {"1": 3, "2": 0}
+    assert top == _before_q4(None, "1")
+
+
+@pytest.mark.parametrize("limit_param", LIMITS)
+def test_q2_whole_week_top_routes(synthetic_feed, limit_param):
+    top = db.query_q2_avg_duration_speed(None, limit_param)
+    full = db.query_q2_avg_duration_speed(None, "all")
+    assert len(full["routes"]) > int(limit_param)
+    assert top == _before_q2_whole_week(limit_param)
+    assert _top_n_problems(full, top, limit_param, db._q2_rank, ("mode",)) == []
+    assert top.keys() == full.keys()
+    by_route = {r["route_long_name"]: r for r in full["routes"]}
+    for route in top["routes"]:
+        assert route.keys() == by_route[route["route_long_name"]].keys()
+
+
+@pytest.mark.parametrize("limit_param", LIMITS)
+@pytest.mark.parametrize("service_id", [s for s in SERVICE_FILTERS if s is not None], ids=str)
+def test_q2_single_service_top_routes(synthetic_feed, service_id, limit_param):
+    top = db.query_q2_avg_duration_speed(service_id, limit_param)
+    full = db.query_q2_avg_duration_speed(service_id, "all")
+    assert _top_n_problems(full, top, limit_param, db._q2_rank, ("mode",)) == []